@@ -0,0 +1,29 @@
+"""
+pytest hooks of the test session
+"""
+import test_rest_api
+
+
+def pytest_sessionstart(session):
+    """clear up old diff and output files once per session before any test case writes to them.
+
+    Only in the main pytest process, not in pytest-xdist workers, so workers never wipe each other's results.
+    """
+    if not hasattr(session.config, "workerinput"):
+        test_rest_api.setup_output_dirs()
+
+
+def pytest_terminal_summary(terminalreporter):
+    """
+    report pool sizing and connection reuse of the shared connection pools, see shared_session(), and log records
+    dropped by full log queues, which miss from the logs of requests and responses
+    """
+    if test_rest_api.connection_counts["requests"]:
+        terminalreporter.write_sep("-", "connection pools")
+        terminalreporter.write_line(test_rest_api.connection_stats())
+    dropped = test_rest_api.log_records_dropped()
+    terminalreporter.write_sep("-", "logs")
+    terminalreporter.write_line(
+        "Log records dropped: %s (LOG_QUEUE_FULL = %s)." % (dropped, test_rest_api.LOG_QUEUE_FULL),
+        yellow=dropped > 0,
+    )
@@ -9,6 +9,105 @@ Another option is to use aiohttp module, which uses asyncio for asynchrony. This
 the API test functions, though they are quite like requests functions, and measuring the response time 
 is not straight forward as requests and the response time may not be accurate for the nature of asyncio.
 
+Engines:
+thread  - one OS thread per concurrent user with requests (default).
+asyncio - concurrent users run as coroutines on one event loop with aiohttp, which scales to thousands
+          of users. Set engine = "asyncio" in main(). Requires: pip install aiohttp
+Both engines record results the same way, see Result statistics below, so stats() output is comparable.
+
+Multi-process mode:
+Set processes = N in main() to spread concurrent users over N worker processes, e.g. one per core.
+Each worker process times its own requests and sends partial results (ResultStats) to the parent process
+every stats interval, which merges them into the same stats() report.
+
+Open model:
+The default closed model loops each user, so offered load drops when the server slows down and the latency
+under overload is hidden (coordinated omission). Set arrival_rate in main() to fire requests at a target rate,
+fixed or poisson, regardless of response times. Response time is then measured from the intended start time
+of each request, and requests started later than intended because of client backlog are counted as late.
+
+Distributed mode:
+Run agents on load generator hosts (or several on localhost): python perf_test_rest_api.py --agent 0.0.0.0:5701
+An agent listens on localhost only if no host is given, e.g. --agent 5701. Agents and the controller share a
+secret token in the PERF_AGENT_TOKEN environment variable, or --agent-token of agents, and agents refuse
+controllers without it. Set agents in main() to ["host1:5701", "host2:5701"] and run
+python perf_test_rest_api.py as the controller. The controller sends each agent its share of the scenario
+settings over a TCP connection, starts all agents at the same moment, merges their interval results sent as
+JSON lines, and prints one stats() report. Agents check the settings, e.g. corpus folders must be under the
+root path and scenarios must be test functions of this script.
+
+Load stages:
+Set stages in main() to change the users, or the arrival rate for open model, during the test, e.g. ramp to
+200 users in 60s, hold 10 minutes, spike to 1000 for 30s and recover. Stats are labelled per stage and
+a summary of each stage is printed at the end.
+
+Capacity search:
+Set search in main() to find the highest sustainable throughput under a latency percentile and error rate SLO.
+Probes raise the users, or the arrival rate for open model, by binary search or AIMD, and each probe is measured
+as a load stage. Users above the probe target are parked rather than stopped, so probes reuse warm connections.
+
+Connections:
+Each concurrent user owns a requests session (or an aiohttp session) with a keep-alive connection pool of
+pool_size connections, so response times do not include a TCP/TLS handshake per request. Set keep_alive to
+False to force a new connection per request. Opened and reused connections are reported in stats.
+Set phase_timing to True to split each request into connect (with DNS), TLS, send, time to first byte and
+download phases, reported with percentiles. The asyncio engine reports TLS within connect.
+
+Warm-up:
+Set warmup_time and/or warmup_requests in main() to exclude the first seconds and requests of the test, e.g.
+cold connections and server caches, from the statistics and the RPS denominators. Warm-up results are kept
+separately and reported next to the steady state in stats, the summary file and the HTML report.
+
+Client saturation:
+Every stats interval reports the load generator's own process CPU, scheduling lag of threads or the event loop,
+requests in flight and the open model backlog. When they cross the saturation thresholds in main(), a warning is
+printed and the run is flagged as client-bound, as response times then include the client's own delays.
+
+Time series:
+Each stats interval is appended as one record to timeseries_file under Logs, in CSV or JSON Lines format by
+the file extension, with RPS, request counts and time per request percentiles, so throughput and latency
+curves can be rebuilt after the test. JSON Lines records also keep the interval latency histogram.
+
+HTML report:
+At the end of the test, a .jsonl time series is rendered to report_file under Logs, or any time later with
+--report TIMESERIES REPORT: RPS and time per request percentiles over time, latency histogram, errors by
+status code and per scenario tables. Charts are inline SVG, so the single file opens offline.
+
+Live metrics:
+Set metrics_port in main() to serve current counters, requests in flight, active users and latency histogram
+buckets in OpenMetrics text format at http://<metrics_host>:<metrics_port>/metrics for Prometheus to scrape,
+on localhost by default. The stats thread renders the metrics of its cumulative results every stats interval,
+and scrapes are served from that, so scraping does not merge user results or slow down users.
+
+Logging:
+Log records, e.g. API requests and responses, are queued and written to Logs by a background thread in batches,
+so users do not wait for disk I/O. When the queue is full, records are dropped (or users wait if LOG_QUEUE_FULL
+is "block"), and the number of dropped records is printed at the end of the test.
+
+API transcripts:
+Set transcript in main() to log every API request and response ("full"), 1 in transcript_sample ("sample"),
+only those of tests which do not pass ("failures"), or none ("off"), which keeps failure forensics at high RPS.
+
+Scenario mix:
+Set scenarios in main() to the test functions of TestAPI to run with relative weights, e.g. 75% reads and 25%
+writes. Each request picks a test function by weight, and stats are also reported per scenario.
+
+Corpus replay:
+Set corpus in main() to "inputs" to replay the request files of the functional tests instead of scenarios,
+round robin, weighted or in sequence within each test case. The requests are parsed and encoded once, and
+responses are checked cheaply by status code and, optionally, by the expected values in expects.
+
+Baseline comparison:
+The test writes a compact summary_file under Logs with throughput, time per request and error rate, totals and
+per scenario. Set baseline_file in main() to a summary of a good run, or run with --compare BASELINE CURRENT,
+to gate on regressions: rps, mean and error rate fail only when worse than tolerances and significant by a
+Poisson rate test, Welch's t-test and a two-proportion z-test respectively, and the exit status is 1.
+
+Result statistics:
+Each concurrent user (thread or coroutine) accumulates its own results in a ResultStats without locks,
+and the stats thread merges all users' cumulative results once per stats interval. Interval results are the
+difference from the previous merge, so memory is constant regardless of the interval and request rate.
+
 Python version: 3.7 or above
 """
 from time import sleep
@@ -17,19 +116,58 @@ import logging
 from logging.handlers import RotatingFileHandler
 import requests
 import json
+import html
+import re
+import functools
 import os
 import ast
+import csv
 import inspect
+import math
+import random
+import bisect
+import itertools
 
 import sys
-from threading import Thread, Event, Timer
+from threading import Thread, Event, Timer, Lock, local
 import queue
+import multiprocessing
+import socket
+import hmac
+import numbers
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import asyncio
+import contextvars
+from rest_api_utils import (
+    QueueFileHandler,
+    setup_worker_logs,
+    queue_records_dropped,
+    request_phases,
+    PHASES,
+    end_phases,
+    ThreadConnectionCounter,
+    CountingHTTPAdapter,
+    parse_test_input,
+    flatten_dict,
+    ini_to_dict,
+    parse_ignore_file,
+)
+
+try:
+    import aiohttp
+except ImportError:  # only required by the asyncio engine
+    aiohttp = None
 
 if sys.version_info < (3, 7):
     raise Exception("Requires Python 3.7 or above.")
 
 # Change log level to error to improve client performance.
 LOG_LEVEL = logging.DEBUG  # DEBUG, INFO, WARNING, ERROR, CRITICAL
+# Log records are written by a background thread. When its queue of LOG_QUEUE_SIZE records is full,
+# "drop" - drop and count records, which never slows down tests, "block" - wait to keep all records.
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_FULL = "drop"
 
 # Assume project structure as below:
 # Scripts - python scripts
@@ -48,11 +186,15 @@ common_formatter = logging.Formatter(
 # Note: To create multiple log files, must use different logger name.
 def setup_logger(log_file, level=logging.INFO, name="", formatter=common_formatter):
     """Function setup as many loggers as you want."""
-    handler = logging.FileHandler(log_file, mode="w")  # default mode is append
+    logger = logging.getLogger(name)
+    # keep the logger of test_rest_api.py, e.g. when pytest imports both scripts, instead of truncating its file
+    if any(isinstance(handler, QueueFileHandler) for handler in logger.handlers):
+        return logger
+    # write in a background thread, see QueueFileHandler
+    handler = QueueFileHandler(log_file, LOG_QUEUE_SIZE, LOG_QUEUE_FULL)
     # Or use a rotating file handler
     # handler = RotatingFileHandler(log_file,maxBytes=1024, backupCount=5)
     handler.setFormatter(formatter)
-    logger = logging.getLogger(name)
     logger.setLevel(level)
     logger.addHandler(handler)
     return logger
@@ -125,14 +267,1175 @@ def pretty_print_response_json(response):
     )
 
 
+# argument is aiohttp response object and the response body bytes already read
+def pretty_print_aiohttp(response, body):
+    """pretty print aiohttp request and response, the asyncio engine counterpart of pretty_print_request/response."""
+    log_api.info(
+        "{}\n{}\n\n{}\n".format(
+            "-----------Request----------->",
+            response.method + " " + str(response.url),
+            "\n".join(
+                "{}: {}".format(k, v) for k, v in response.request_info.headers.items()
+            ),
+        )
+    )
+    log_api.info(
+        "{}\n{}\n\n{}\n\n{}\n".format(
+            "<-----------Response-----------",
+            "Status code:" + str(response.status),
+            "\n".join("{}: {}".format(k, v) for k, v in response.headers.items()),
+            body.decode(errors="replace"),
+        )
+    )
+
+
+def pretty_print_transcript(response):
+    """pretty print request, response and response time of a requests response to API log"""
+    pretty_print_request(response.request)
+    try:
+        pretty_print_response_json(response)
+    except ValueError:
+        # not JSON, e.g. an error page of a failed request
+        pretty_print_response(response)
+    log_api.debug("response time in seconds: %s\n", response.elapsed.total_seconds())
+
+
+def pretty_print_aiohttp_transcript(response, body, elapsed):
+    """pretty print request, response and response time of an aiohttp response to API log"""
+    pretty_print_aiohttp(response, body)
+    log_api.debug("response time in seconds: %s\n", elapsed)
+
+
+# API transcripts of the current user (thread or asyncio task) waiting for its test result, see TestAPI.transcribe()
+pending_transcripts = contextvars.ContextVar("pending_transcripts", default=())
+
+# status code of the last response of the current user, to count errors by status code, see ResultStats.add()
+response_status = contextvars.ContextVar("response_status", default=None)
+
+
+def pop_response_status():
+    """status code of the current user's last response, None if none since the last call"""
+    status = response_status.get()
+    response_status.set(None)
+    return status
+
+
+def log_records_dropped():
+    """number of log records dropped by full log queues of this process, see QueueFileHandler"""
+    return queue_records_dropped((log, log_api))
+
+
+# connections opened and requests sent by the current thread, i.e. concurrent user
+connection_counter = ThreadConnectionCounter()
+connection_counts = connection_counter.counts
+
+
+# phase timing of requests, see request_phases and PHASES. connect of the asyncio engine includes TLS, as
+# aiohttp cannot time the TLS handshake separately, see add_phase_trace()
+def start_phases():
+    """start timing the phases of a request of the current user"""
+    request_phases.set({})
+
+
+def add_phase_trace(trace_config):
+    """time the phases of aiohttp requests sent with trace_request_ctx=request_phases.get() by trace_config"""
+
+    async def on_request_start(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["ready_at"] = time.perf_counter()
+
+    async def on_connection_create_start(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["connect_at"] = time.perf_counter()
+
+    async def on_connection_create_end(session, context, params):
+        phases = context.trace_request_ctx
+        if phases is not None:
+            phases["ready_at"] = time.perf_counter()
+            phases["connect"] = phases["ready_at"] - phases.pop("connect_at")
+
+    async def on_connection_reuseconn(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["ready_at"] = time.perf_counter()
+
+    async def on_request_sent(session, context, params):
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx["sent_at"] = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        phases = context.trace_request_ctx
+        if phases is not None:
+            phases["headers_at"] = time.perf_counter()
+            sent_at = phases.pop("sent_at", phases["headers_at"])
+            phases["send"] = sent_at - phases.pop("ready_at")
+            phases["ttfb"] = phases["headers_at"] - sent_at
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_start.append(on_connection_create_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_headers_sent.append(on_request_sent)
+    trace_config.on_request_chunk_sent.append(on_request_sent)
+    trace_config.on_request_end.append(on_request_end)
+
+
+class LatencyHistogram:
+    """
+    HDR style latency histogram with fixed memory.
+
+    Latencies are recorded in microseconds into log buckets: values below sub_bucket_count have exact buckets,
+    and each power of 2 range above is split into sub_bucket_count / 2 linear sub buckets, so the relative error
+    is below 2 / sub_bucket_count, e.g. 1.6% for sub_bucket_bits 7. Values above max_seconds are clamped.
+    Recording is O(1) and histograms with the same settings can be merged, e.g. across threads and intervals.
+    """
+
+    def __init__(self, sub_bucket_bits=7, max_seconds=3600):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.sub_bucket_half = self.sub_bucket_count >> 1
+        self.max_value = int(max_seconds * 1000000)
+        self.counts = [0] * (self._index(self.max_value) + 1)
+        self.total_count = 0
+
+    def _index(self, value):
+        """bucket index of a value in microseconds"""
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (
+            self.sub_bucket_count
+            + (shift - 1) * self.sub_bucket_half
+            + (value >> shift)
+            - self.sub_bucket_half
+        )
+
+    def _lowest_value(self, index):
+        """lowest value in microseconds of the bucket at index"""
+        if index < self.sub_bucket_count:
+            return index
+        return self._highest_value(index - 1) + 1
+
+    def _highest_value(self, index):
+        """highest value in microseconds of the bucket at index"""
+        if index < self.sub_bucket_count:
+            return index
+        shift = (index - self.sub_bucket_count) // self.sub_bucket_half + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.sub_bucket_half
+        return ((sub_bucket + self.sub_bucket_half + 1) << shift) - 1
+
+    def record(self, seconds):
+        """record a latency in seconds"""
+        value = min(int(seconds * 1000000), self.max_value)
+        self.counts[self._index(value)] += 1
+        self.total_count += 1
+
+    def merge(self, other):
+        """add counts of another histogram into this one"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total_count += other.total_count
+
+    def subtract(self, other):
+        """return a new histogram of counts in this one but not in other, e.g. an earlier copy of this one"""
+        diff = LatencyHistogram.__new__(LatencyHistogram)
+        diff.__dict__.update(self.__dict__)
+        diff.counts = [a - b for a, b in zip(self.counts, other.counts)]
+        diff.total_count = self.total_count - other.total_count
+        return diff
+
+    def percentile(self, percent):
+        """latency in seconds at percent (0 - 100), 0 if no values recorded"""
+        # count buckets instead of using total_count, which may be ahead of counts
+        # when merged from a histogram another thread is recording to.
+        total_count = sum(self.counts)
+        if total_count == 0:
+            return 0
+        target = max(math.ceil(percent / 100 * total_count), 1)
+        count = 0
+        for index, bucket_count in enumerate(self.counts):
+            count += bucket_count
+            if count >= target:
+                return self._highest_value(index) / 1000000
+        return self.max_value / 1000000
+
+    def count_le(self, seconds):
+        """count of recorded latencies less than or equal to seconds, within bucket precision"""
+        index = self._index(min(int(seconds * 1000000), self.max_value))
+        # a bucket counts if its highest value is within seconds
+        if self._highest_value(index) > seconds * 1000000:
+            index -= 1
+        return sum(self.counts[: index + 1])
+
+    def min(self):
+        """lowest recorded latency in seconds within bucket precision, 0 if no values recorded"""
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count > 0:
+                return self._lowest_value(index) / 1000000
+        return 0
+
+    def max(self):
+        """highest recorded latency in seconds within bucket precision, 0 if no values recorded"""
+        for index in range(len(self.counts) - 1, -1, -1):
+            if self.counts[index] > 0:
+                return self._highest_value(index) / 1000000
+        return 0
+
+    def to_dict(self):
+        """dict for JSON with non-zero buckets only as [[index, count], ...], see from_dict()"""
+        state = self.__dict__.copy()
+        state["counts"] = [[i, c] for i, c in enumerate(self.counts) if c]
+        state["buckets"] = len(self.counts)
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        """histogram from to_dict()"""
+        histogram = cls.__new__(cls)
+        histogram.__setstate__(state)
+        return histogram
+
+    def __getstate__(self):
+        # send non-zero buckets only between processes
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        state = dict(state)
+        counts = [0] * state.pop("buckets")
+        for i, c in state["counts"]:
+            counts[i] = c
+        state["counts"] = counts
+        self.__dict__.update(state)
+
+
+class ResultStats:
+    """
+    Mergeable aggregate of test results, e.g. results of a concurrent user, a stats interval or a worker process.
+
+    It keeps counters only, so it is compact to send from worker processes to the parent process.
+    Only one thread adds results to it, while other threads may merge it at any time.
+    """
+
+    def __init__(self):
+        self.total_tested_requests = 0
+        self.total_pass_requests = 0
+        self.total_fail_requests = 0
+        self.total_exception_requests = 0
+
+        # time per request of pass requests, sum of squares for the variance, see welch_t_test
+        self.sum_response_time = 0
+        self.sum_squares_response_time = 0
+        self.tpr_min = 999
+        self.tpr_max = 0
+        self.histogram = LatencyHistogram()
+
+        # requests started later than intended in open model, i.e. client backlog
+        self.total_late_requests = 0
+
+        # connections opened and reused by keep-alive
+        self.connections_opened = 0
+        self.connections_reused = 0
+
+        # requests started, i.e. in flight if not tested yet, and users running now (gauge)
+        self.total_started_requests = 0
+        self.active_users = 0
+        # requests dispatched in open model, i.e. queued for a free user if not started yet
+        self.total_dispatched_requests = 0
+
+        # load generator process CPU in cores and scheduling lag in seconds since the last collection (gauges),
+        # the highest of all sources, see TestAPI.collect_results()
+        self.client_cpu = 0
+        self.client_lag = 0
+
+        # log records dropped by a full log queue of a worker process, see QueueFileHandler
+        self.log_records_dropped = 0
+
+        # results of each scenario of the scenario mix, name: ResultStats
+        self.scenarios = {}
+
+        # fail and exception tests by status code of the response, or "exception", e.g. {"503": 2}
+        self.errors = {}
+
+        # results of requests started in the warm-up period, a ResultStats, excluded from the results above,
+        # and wall time the steady state started, the latest of all sources. 0 - no warm-up or not ended yet
+        self.warmup = None
+        self.warmup_end_time = 0
+
+        # time of each request phase if phase timing is on, name: LatencyHistogram, and name: sum of seconds
+        self.phase_histograms = {}
+        self.phase_sums = {}
+
+    def add(self, test_result, elapsed_time, scenario=None, status=None, warmup=False):
+        """
+        add a test result, i.e. pass, fail or exception, and its elapsed time, also to the results of scenario.
+        status is the status code of the response to count a failed test by, see pop_response_status().
+        warmup adds it to the warm-up results instead, see TestAPI.in_warmup().
+        """
+        if warmup:
+            if self.warmup is None:
+                self.warmup = ResultStats()
+            self.warmup.add(test_result, elapsed_time, scenario, status)
+            return
+        if scenario is not None:
+            results = self.scenarios.get(scenario)
+            if results is None:
+                results = self.scenarios[scenario] = ResultStats()
+            results.add(test_result, elapsed_time, status=status)
+        self.total_tested_requests += 1
+        if test_result == "exception":
+            self.total_exception_requests += 1
+            self.errors["exception"] = self.errors.get("exception", 0) + 1
+        elif test_result == "fail":
+            self.total_fail_requests += 1
+            key = str(status) if status is not None else "fail"
+            self.errors[key] = self.errors.get(key, 0) + 1
+        elif test_result == "pass":
+            self.total_pass_requests += 1
+            self.sum_response_time += elapsed_time
+            self.sum_squares_response_time += elapsed_time * elapsed_time
+            if elapsed_time < self.tpr_min:
+                self.tpr_min = elapsed_time
+            if elapsed_time > self.tpr_max:
+                self.tpr_max = elapsed_time
+            self.histogram.record(elapsed_time)
+
+    def add_phases(self, phases):
+        """add the phase times of a request, see request_phases"""
+        for name in PHASES:
+            seconds = max(phases.get(name, 0), 0)
+            histogram = self.phase_histograms.get(name)
+            if histogram is None:
+                histogram = self.phase_histograms[name] = LatencyHistogram()
+                self.phase_sums[name] = 0
+            histogram.record(seconds)
+            self.phase_sums[name] += seconds
+
+    def merge(self, other):
+        """merge another ResultStats into this one"""
+        self.total_tested_requests += other.total_tested_requests
+        self.total_pass_requests += other.total_pass_requests
+        self.total_fail_requests += other.total_fail_requests
+        self.total_exception_requests += other.total_exception_requests
+        self.sum_response_time += other.sum_response_time
+        self.sum_squares_response_time += other.sum_squares_response_time
+        self.tpr_min = min(self.tpr_min, other.tpr_min)
+        self.tpr_max = max(self.tpr_max, other.tpr_max)
+        self.histogram.merge(other.histogram)
+        self.total_late_requests += other.total_late_requests
+        self.connections_opened += other.connections_opened
+        self.connections_reused += other.connections_reused
+        self.total_started_requests += other.total_started_requests
+        self.active_users += other.active_users
+        self.total_dispatched_requests += other.total_dispatched_requests
+        self.client_cpu = max(self.client_cpu, other.client_cpu)
+        self.client_lag = max(self.client_lag, other.client_lag)
+        self.log_records_dropped += other.log_records_dropped
+        # copy items first as a user may add a scenario meanwhile
+        for scenario, results in list(other.scenarios.items()):
+            if scenario not in self.scenarios:
+                self.scenarios[scenario] = ResultStats()
+            self.scenarios[scenario].merge(results)
+        for key, count in list(other.errors.items()):
+            self.errors[key] = self.errors.get(key, 0) + count
+        if other.warmup is not None:
+            if self.warmup is None:
+                self.warmup = ResultStats()
+            self.warmup.merge(other.warmup)
+        self.warmup_end_time = max(self.warmup_end_time, other.warmup_end_time)
+        for name, histogram in list(other.phase_histograms.items()):
+            if name not in self.phase_histograms:
+                self.phase_histograms[name] = LatencyHistogram()
+                self.phase_sums[name] = 0
+            self.phase_histograms[name].merge(histogram)
+            self.phase_sums[name] += other.phase_sums.get(name, 0)
+
+    def subtract(self, other):
+        """
+        return a new ResultStats of results in this one but not in other, where other is an earlier merge
+        of the same results, e.g. interval results from two cumulative merges.
+
+        min/max of the difference come from the histogram, i.e. within bucket precision.
+        """
+        diff = ResultStats()
+        diff.total_tested_requests = (
+            self.total_tested_requests - other.total_tested_requests
+        )
+        diff.total_pass_requests = self.total_pass_requests - other.total_pass_requests
+        diff.total_fail_requests = self.total_fail_requests - other.total_fail_requests
+        diff.total_exception_requests = (
+            self.total_exception_requests - other.total_exception_requests
+        )
+        diff.sum_response_time = self.sum_response_time - other.sum_response_time
+        diff.sum_squares_response_time = (
+            self.sum_squares_response_time - other.sum_squares_response_time
+        )
+        diff.histogram = self.histogram.subtract(other.histogram)
+        diff.total_late_requests = self.total_late_requests - other.total_late_requests
+        diff.connections_opened = self.connections_opened - other.connections_opened
+        diff.connections_reused = self.connections_reused - other.connections_reused
+        diff.total_started_requests = (
+            self.total_started_requests - other.total_started_requests
+        )
+        diff.total_dispatched_requests = (
+            self.total_dispatched_requests - other.total_dispatched_requests
+        )
+        # gauges, not differences
+        diff.active_users = self.active_users
+        diff.client_cpu = self.client_cpu
+        diff.client_lag = self.client_lag
+        diff.log_records_dropped = self.log_records_dropped - other.log_records_dropped
+        diff.scenarios = {
+            scenario: results.subtract(other.scenarios.get(scenario, ResultStats()))
+            for scenario, results in self.scenarios.items()
+        }
+        diff.errors = {
+            key: count - other.errors.get(key, 0)
+            for key, count in self.errors.items()
+            if count > other.errors.get(key, 0)
+        }
+        if self.warmup is not None:
+            diff.warmup = self.warmup.subtract(other.warmup or ResultStats())
+        # a time, not a difference
+        diff.warmup_end_time = self.warmup_end_time
+        diff.phase_histograms = {
+            name: histogram.subtract(other.phase_histograms.get(name, LatencyHistogram()))
+            for name, histogram in self.phase_histograms.items()
+        }
+        diff.phase_sums = {
+            name: seconds - other.phase_sums.get(name, 0)
+            for name, seconds in self.phase_sums.items()
+        }
+        if diff.total_pass_requests > 0:
+            diff.tpr_min = min(max(diff.histogram.min(), self.tpr_min), self.tpr_max)
+            diff.tpr_max = min(diff.histogram.max(), self.tpr_max)
+        return diff
+
+    def to_dict(self):
+        """dict for JSON, e.g. to send results from agents to the controller, see from_dict()"""
+        state = self.__dict__.copy()
+        state["histogram"] = self.histogram.to_dict()
+        state["errors"] = dict(self.errors)
+        if self.warmup is not None:
+            state["warmup"] = self.warmup.to_dict()
+        state["scenarios"] = {
+            scenario: results.to_dict() for scenario, results in self.scenarios.items()
+        }
+        state["phase_histograms"] = {
+            name: histogram.to_dict() for name, histogram in self.phase_histograms.items()
+        }
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        """ResultStats from to_dict()"""
+        results = cls()
+        results.__dict__.update(state)
+        results.histogram = LatencyHistogram.from_dict(state["histogram"])
+        results.scenarios = {
+            scenario: cls.from_dict(scenario_state)
+            for scenario, scenario_state in state.get("scenarios", {}).items()
+        }
+        results.phase_histograms = {
+            name: LatencyHistogram.from_dict(histogram)
+            for name, histogram in state.get("phase_histograms", {}).items()
+        }
+        if state.get("warmup"):
+            results.warmup = cls.from_dict(state["warmup"])
+        return results
+
+
+class TimeSeriesExporter:
+    """
+    Append one record per stats interval to a CSV (.csv) or JSON Lines (.jsonl) file.
+
+    Records are written by the stats thread through a buffered file, so users are never blocked,
+    and the file is flushed per record so it is complete up to the last interval of a long test.
+    """
+
+    def __init__(self, file, percentiles):
+        self.file = file
+        self.percentiles = percentiles
+        self.format = "csv" if file.endswith(".csv") else "jsonl"
+        self.fields = [
+            "timestamp",
+            "elapsed",
+            "interval",
+            "warmup_time",
+            "stage",
+            "rps",
+            "requests",
+            "pass",
+            "fail",
+            "exception",
+            "late",
+            "mean",
+            "min",
+            "max",
+            "client_cpu",
+            "client_lag",
+            "backlog",
+            "client_bound",
+        ] + ["p%g" % p for p in percentiles]
+        # mode w to start a new series per test as the log files do
+        self.f = open(file, "w", newline="")
+        if self.format == "csv":
+            self.writer = csv.DictWriter(self.f, self.fields, extrasaction="ignore")
+            self.writer.writeheader()
+
+    def write(self, record):
+        """append a record dict of fields, and histogram for JSON Lines"""
+        if self.format == "csv":
+            self.writer.writerow(record)
+        else:
+            self.f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+# tolerances of compare_summaries(): relative for rps, mean and percentiles, absolute for error_rate
+DEFAULT_TOLERANCES = {"rps": 0.1, "mean": 0.1, "p99": 0.2, "error_rate": 0.01}
+
+
+def normal_sf(z):
+    """upper tail probability of the standard normal distribution at z"""
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _betacf(a, b, x):
+    """continued fraction of the regularized incomplete beta function by the modified Lentz method"""
+    tiny = 1e-300
+    c = 1.0
+    d = 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        for numerator in (
+            m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+            -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1)),
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    """regularized incomplete beta function I_x(a, b)"""
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(
+        math.lgamma(a + b)
+        - math.lgamma(a)
+        - math.lgamma(b)
+        + a * math.log(x)
+        + b * math.log(1 - x)
+    )
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1 - x) / b
+
+
+def student_t_sf(t, df):
+    """upper tail probability of Student's t distribution with df degrees of freedom at t"""
+    tail = 0.5 * betainc(df / 2, 0.5, df / (df + t * t))
+    return tail if t > 0 else 1 - tail
+
+
+def welch_t_test(count1, mean1, variance1, count2, mean2, variance2):
+    """
+    one-sided p-value of Welch's t-test that mean2 is greater than mean1, e.g. time per request of the current
+    run against the baseline, without assuming equal variances. 1 if either sample is too small to test.
+    """
+    if count1 < 2 or count2 < 2:
+        return 1.0
+    standard_error = variance1 / count1 + variance2 / count2
+    if standard_error <= 0:
+        return 0.0 if mean2 > mean1 else 1.0
+    t = (mean2 - mean1) / math.sqrt(standard_error)
+    # Welch-Satterthwaite degrees of freedom
+    df = standard_error ** 2 / (
+        (variance1 / count1) ** 2 / (count1 - 1) + (variance2 / count2) ** 2 / (count2 - 1)
+    )
+    return student_t_sf(t, df)
+
+
+def two_proportion_z_test(errors1, count1, errors2, count2):
+    """one-sided p-value of the pooled two-proportion z-test that error rate 2 is greater than error rate 1"""
+    if count1 == 0 or count2 == 0:
+        return 1.0
+    pooled = (errors1 + errors2) / (count1 + count2)
+    standard_error = math.sqrt(pooled * (1 - pooled) * (1 / count1 + 1 / count2))
+    difference = errors2 / count2 - errors1 / count1
+    if standard_error == 0:
+        return 0.0 if difference > 0 else 1.0
+    return normal_sf(difference / standard_error)
+
+
+def poisson_rate_test(count1, duration1, count2, duration2):
+    """one-sided p-value of the z-test that Poisson rate 2, e.g. requests per second, is lower than rate 1"""
+    if duration1 <= 0 or duration2 <= 0 or count1 + count2 == 0:
+        return 1.0
+    standard_error = math.sqrt(count1 / duration1 ** 2 + count2 / duration2 ** 2)
+    return normal_sf((count1 / duration1 - count2 / duration2) / standard_error)
+
+
+def results_summary(results, duration, percentiles):
+    """compact summary dict of results for JSON, i.e. throughput, time per request and error rate"""
+    passed = results.total_pass_requests
+    errors = results.total_fail_requests + results.total_exception_requests
+    mean = results.sum_response_time / passed if passed else 0
+    summary = {
+        "duration": round(duration, 3),
+        "requests": results.total_tested_requests,
+        "pass": passed,
+        "fail": results.total_fail_requests,
+        "exception": results.total_exception_requests,
+        "error_rate": errors / results.total_tested_requests
+        if results.total_tested_requests
+        else 0,
+        "rps": passed / duration if duration > 0 else 0,
+        "mean": mean,
+        # sample variance from the sum of squares for welch_t_test
+        "variance": max(results.sum_squares_response_time - passed * mean * mean, 0)
+        / (passed - 1)
+        if passed > 1
+        else 0,
+        "min": results.tpr_min if passed else 0,
+        "max": results.tpr_max,
+        "errors": dict(results.errors),
+    }
+    for p in percentiles:
+        summary["p%g" % p] = min(results.histogram.percentile(p), results.tpr_max)
+    summary["histogram"] = results.histogram.to_dict()["counts"]
+    return summary
+
+
+def compare_summaries(baseline, current, tolerances, significance=0.05):
+    """
+    compare a run summary against a baseline summary, totals and each scenario of the baseline, print a verdict
+    per metric and return the regressions found.
+
+    A metric regresses when it is worse than its tolerance and, for rps, mean and error_rate, the difference
+    is also statistically significant at the significance level, so noise of a short run does not fail it.
+    Tolerances: "rps" and "mean" relative, e.g. 0.1 - 10% lower throughput or 10% higher mean allowed,
+    "error_rate" absolute, e.g. 0.01 - one point higher allowed, and percentiles relative, e.g. "p99": 0.2,
+    without a test as percentiles have no variance to test with.
+    """
+    regressions = []
+    print("\n-----------------Baseline Comparison---------------")
+    groups = [("total", baseline["total"], current["total"])]
+    for scenario, base in baseline.get("scenarios", {}).items():
+        groups.append((scenario, base, current.get("scenarios", {}).get(scenario)))
+    for name, base, run in groups:
+        if run is None:
+            print("%s - missing in this run - REGRESSION" % name)
+            regressions.append("%s missing" % name)
+            continue
+        for metric, tolerance in tolerances.items():
+            if metric not in base or metric not in run:
+                continue
+            before, after = base[metric], run[metric]
+            if metric == "error_rate":
+                worse = after - before > tolerance
+                change = "%+.4f" % (after - before)
+                p_value = two_proportion_z_test(
+                    base["fail"] + base["exception"],
+                    base["requests"],
+                    run["fail"] + run["exception"],
+                    run["requests"],
+                )
+            else:
+                if metric == "rps":
+                    worse = after < before * (1 - tolerance)
+                    p_value = poisson_rate_test(
+                        base["pass"], base["duration"], run["pass"], run["duration"]
+                    )
+                else:
+                    worse = after > before * (1 + tolerance)
+                    p_value = (
+                        welch_t_test(
+                            base["pass"],
+                            base["mean"],
+                            base["variance"],
+                            run["pass"],
+                            run["mean"],
+                            run["variance"],
+                        )
+                        if metric == "mean"
+                        else None
+                    )
+                change = "%+.1f%%" % ((after - before) / before * 100) if before else "n/a"
+            regressed = worse and (p_value is None or p_value < significance)
+            print(
+                "%s %s: %.6f -> %.6f (%s, tolerance %g, %s) - %s"
+                % (
+                    name,
+                    metric,
+                    before,
+                    after,
+                    change,
+                    tolerance,
+                    "no test" if p_value is None else "p = %.4g" % p_value,
+                    "REGRESSION" if regressed else "worse, not significant" if worse else "ok",
+                )
+            )
+            if regressed:
+                regressions.append("%s %s" % (name, metric))
+    print(
+        "%s regression(s) against the baseline%s"
+        % (len(regressions), ": " + ", ".join(regressions) if regressions else ".")
+    )
+    return regressions
+
+
+def compare_summary_files(baseline_file, current_file, tolerances, significance=0.05):
+    """compare two summary files written by write_summary(), return 1 on a regression for the exit code"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    with open(current_file) as f:
+        current = json.load(f)
+    return 1 if compare_summaries(baseline, current, tolerances, significance) else 0
+
+
+# colors of series in report charts
+REPORT_COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2")
+
+
+def svg_line_chart(title, x_values, series, y_label, width=900, height=300):
+    """inline SVG line chart of series [(name, y values), ...] over x_values, e.g. elapsed seconds"""
+    left, right, top, bottom = 70, 20, 30, 40
+    plot_width, plot_height = width - left - right, height - top - bottom
+    x_min, x_max = (min(x_values), max(x_values)) if x_values else (0, 1)
+    if x_max <= x_min:
+        x_max = x_min + 1
+    y_max = max([max(values) for name, values in series if values] + [0]) * 1.1 or 1
+
+    def x(value):
+        return left + (value - x_min) / (x_max - x_min) * plot_width
+
+    def y(value):
+        return top + plot_height - value / y_max * plot_height
+
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-size="11">'
+        % (width, height),
+        '<text x="%d" y="18" font-size="14" font-weight="bold">%s</text>'
+        % (left, html.escape(title)),
+    ]
+    for i in range(6):
+        value = y_max * i / 5
+        parts.append(
+            '<line x1="%d" y1="%.1f" x2="%d" y2="%.1f" stroke="#ddd"/>'
+            '<text x="%d" y="%.1f" text-anchor="end">%.4g</text>'
+            % (left, y(value), width - right, y(value), left - 5, y(value) + 4, value)
+        )
+        value = x_min + (x_max - x_min) * i / 5
+        parts.append(
+            '<text x="%.1f" y="%d" text-anchor="middle">%.4g</text>'
+            % (x(value), height - bottom + 15, value)
+        )
+    parts.append(
+        '<text x="%d" y="%d" text-anchor="middle">elapsed seconds</text>'
+        '<text x="15" y="%d" text-anchor="middle" transform="rotate(-90 15 %d)">%s</text>'
+        % (
+            left + plot_width / 2,
+            height - 5,
+            top + plot_height / 2,
+            top + plot_height / 2,
+            html.escape(y_label),
+        )
+    )
+    for i, (name, values) in enumerate(series):
+        color = REPORT_COLORS[i % len(REPORT_COLORS)]
+        points = " ".join("%.1f,%.1f" % (x(a), y(b)) for a, b in zip(x_values, values))
+        parts.append(
+            '<polyline fill="none" stroke="%s" stroke-width="1.5" points="%s"/>'
+            '<text x="%d" y="%d" fill="%s">%s</text>'
+            % (color, points, width - right - 150, top + 12 * i, color, html.escape(name))
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+def svg_bar_chart(title, labels, values, x_label, width=900, height=300):
+    """inline SVG bar chart of values with a label per bar, e.g. latency histogram bins or status codes"""
+    left, right, top, bottom = 70, 20, 30, 55
+    plot_width, plot_height = width - left - right, height - top - bottom
+    y_max = max(list(values) + [0]) * 1.1 or 1
+    bar_width = plot_width / max(len(values), 1)
+    # label every n-th bar so labels do not overlap
+    label_every = max(int(60 // bar_width), 1)
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-size="11">'
+        % (width, height),
+        '<text x="%d" y="18" font-size="14" font-weight="bold">%s</text>'
+        % (left, html.escape(title)),
+    ]
+    for i in range(6):
+        value = y_max * i / 5
+        y = top + plot_height - value / y_max * plot_height
+        parts.append(
+            '<line x1="%d" y1="%.1f" x2="%d" y2="%.1f" stroke="#ddd"/>'
+            '<text x="%d" y="%.1f" text-anchor="end">%.4g</text>'
+            % (left, y, width - right, y, left - 5, y + 4, value)
+        )
+    for i, (label, value) in enumerate(zip(labels, values)):
+        bar_height = value / y_max * plot_height
+        parts.append(
+            '<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="%s"><title>%s: %s</title></rect>'
+            % (
+                left + i * bar_width + 1,
+                top + plot_height - bar_height,
+                max(bar_width - 2, 1),
+                bar_height,
+                REPORT_COLORS[0],
+                html.escape(str(label)),
+                value,
+            )
+        )
+        if i % label_every == 0:
+            parts.append(
+                '<text x="%.1f" y="%d" text-anchor="middle">%s</text>'
+                % (left + (i + 0.5) * bar_width, top + plot_height + 15, html.escape(str(label)))
+            )
+    parts.append(
+        '<text x="%d" y="%d" text-anchor="middle">%s</text></svg>'
+        % (left + plot_width / 2, height - 10, html.escape(x_label))
+    )
+    return "\n".join(parts)
+
+
+def histogram_bins(histogram, bins=40):
+    """(upper bound seconds, count) of log spaced bins of the non-zero buckets of a LatencyHistogram"""
+    buckets = [(i, c) for i, c in enumerate(histogram.counts) if c]
+    if not buckets:
+        return []
+    low = max(histogram._lowest_value(buckets[0][0]), 1)
+    high = max(histogram._highest_value(buckets[-1][0]), low + 1)
+    ratio = (high / low) ** (1 / bins)
+    edges = [low * ratio ** (i + 1) for i in range(bins)]
+    counts = [0] * bins
+    for index, count in buckets:
+        value = histogram._highest_value(index)
+        counts[min(bisect.bisect_left(edges, value), bins - 1)] += count
+    return [(edge / 1000000, count) for edge, count in zip(edges, counts)]
+
+
+def html_table(header, rows):
+    """HTML table of a header row and rows of cells"""
+    return (
+        "<table><tr>%s</tr>%s</table>"
+        % (
+            "".join("<th>%s</th>" % html.escape(str(cell)) for cell in header),
+            "".join(
+                "<tr>%s</tr>" % "".join("<td>%s</td>" % html.escape(str(cell)) for cell in row)
+                for row in rows
+            ),
+        )
+    )
+
+
+def write_html_report(timeseries_file, report_file):
+    """
+    Write a self-contained HTML report of a JSON Lines time series, see TimeSeriesExporter: RPS and time per
+    request percentiles over time, latency histogram, errors by status code and per scenario tables.
+    Charts are inline SVG without scripts or external resources, so the report opens offline.
+    """
+    if not timeseries_file.endswith(".jsonl"):
+        raise ValueError("HTML report requires a JSON Lines (.jsonl) time series: %s" % timeseries_file)
+    with open(timeseries_file) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        raise ValueError("No records in time series: %s" % timeseries_file)
+    percentile_keys = [key for key in records[0] if re.fullmatch(r"p[0-9.]+", key)]
+    elapsed = [record["elapsed"] for record in records]
+
+    # totals and scenarios from interval counts and histograms
+    def new_totals():
+        return {
+            "requests": 0,
+            "pass": 0,
+            "fail": 0,
+            "exception": 0,
+            "sum": 0.0,
+            "min": None,
+            "max": 0,
+            "histogram": LatencyHistogram(),
+        }
+
+    def add_totals(totals, record):
+        for key in ("requests", "pass", "fail", "exception"):
+            totals[key] += record[key]
+        totals["sum"] += record["mean"] * record["pass"]
+        if record["pass"]:
+            totals["max"] = max(totals["max"], record.get("max", record["mean"]))
+            totals["min"] = min(
+                totals["min"] if totals["min"] is not None else sys.maxsize,
+                record.get("min", record["mean"]),
+            )
+        for index, count in record.get("histogram", []):
+            totals["histogram"].counts[index] += count
+
+    total = new_totals()
+    warmup = new_totals()
+    scenarios = {}
+    errors = {}
+    warmup_errors = {}
+    for record in records:
+        add_totals(total, record)
+        for scenario, scenario_record in record.get("scenarios", {}).items():
+            add_totals(scenarios.setdefault(scenario, new_totals()), scenario_record)
+        for key, count in record.get("errors", {}).items():
+            errors[key] = errors.get(key, 0) + count
+        if "warmup" in record:
+            add_totals(warmup, record["warmup"])
+            for key, count in record["warmup"].get("errors", {}).items():
+                warmup_errors[key] = warmup_errors.get(key, 0) + count
+    warmup_time = sum(record.get("warmup_time", 0) for record in records)
+    # steady state duration, the denominator of rps, see TestAPI.in_warmup()
+    duration = sum(record["interval"] for record in records) - warmup_time
+
+    def totals_row(name, totals, duration=duration):
+        passed = totals["pass"]
+        return [
+            name,
+            totals["requests"],
+            passed,
+            totals["fail"],
+            totals["exception"],
+            "%.2f" % (passed / duration if duration > 0 else 0),
+            "%.6f" % (totals["sum"] / passed if passed else 0),
+            "%.6f" % (totals["min"] or 0),
+            "%.6f" % totals["max"],
+        ] + [
+            "%.6f" % min(totals["histogram"].percentile(float(key[1:])), totals["max"])
+            for key in percentile_keys
+        ]
+
+    header = ["", "requests", "pass", "fail", "exception", "rps", "mean", "min", "max"] + percentile_keys
+    saturated = sum(1 for record in records if record.get("client_bound"))
+    sections = [
+        "<h2>Summary</h2>",
+        "<p>%s to %s, %.2f seconds in %s intervals, of which %.2f seconds warm-up</p>"
+        % (
+            time.asctime(time.localtime(records[0]["timestamp"] - records[0]["interval"])),
+            time.asctime(time.localtime(records[-1]["timestamp"])),
+            duration + warmup_time,
+            len(records),
+            warmup_time,
+        ),
+        "<p><b>Client-bound: load generator saturated in %s of %s intervals, response times may include "
+        "client delays.</b></p>" % (saturated, len(records))
+        if saturated
+        else "",
+        html_table(
+            header,
+            [totals_row("steady state", total)]
+            + ([totals_row("warm-up", warmup, warmup_time)] if warmup["requests"] else []),
+        ),
+        "<h2>Throughput</h2>",
+        svg_line_chart(
+            "Requests per second",
+            elapsed,
+            [("total", [record["rps"] for record in records])]
+            + (
+                [
+                    (
+                        "warm-up",
+                        [
+                            record["warmup"]["pass"] / record["warmup_time"]
+                            if "warmup" in record and record["warmup_time"] > 0
+                            else 0
+                            for record in records
+                        ],
+                    )
+                ]
+                if warmup["requests"]
+                else []
+            )
+            + (
+                [
+                    (
+                        scenario,
+                        [
+                            record.get("scenarios", {}).get(scenario, {}).get("rps", 0)
+                            for record in records
+                        ],
+                    )
+                    for scenario in scenarios
+                ]
+                if len(scenarios) > 1
+                else []
+            ),
+            "requests/s",
+        ),
+        "<h2>Time per Request</h2>",
+        svg_line_chart(
+            "Time per request percentiles",
+            elapsed,
+            [("mean", [record["mean"] for record in records])]
+            + [(key, [record[key] for record in records]) for key in percentile_keys],
+            "seconds",
+        ),
+    ]
+    bins = histogram_bins(total["histogram"])
+    if bins:
+        sections.append(
+            svg_bar_chart(
+                "Latency histogram of pass requests",
+                ["%.4g" % edge for edge, count in bins],
+                [count for edge, count in bins],
+                "seconds (upper bound of bin)",
+            )
+        )
+    sections.append("<h2>Errors by Status Code</h2>")
+    if errors or warmup_errors:
+        codes = sorted(set(errors) | set(warmup_errors), key=lambda key: -errors.get(key, 0))
+        sections.append(
+            svg_bar_chart(
+                "Errors by status code",
+                codes,
+                [errors.get(code, 0) for code in codes],
+                "status code",
+            )
+        )
+        sections.append(
+            html_table(
+                ["status code", "errors", "warm-up errors"],
+                [(code, errors.get(code, 0), warmup_errors.get(code, 0)) for code in codes],
+            )
+        )
+    else:
+        sections.append("<p>No errors.</p>")
+    if scenarios:
+        sections.append("<h2>Scenarios</h2>")
+        sections.append(
+            html_table(
+                header,
+                [totals_row(name, totals) for name, totals in sorted(scenarios.items())],
+            )
+        )
+    with open(report_file, "w") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>Performance Test Report</title>"
+            "<style>body{font-family:sans-serif;margin:20px}table{border-collapse:collapse;margin:10px 0}"
+            "th,td{border:1px solid #ccc;padding:3px 8px;text-align:right}th{background:#eee}"
+            "svg{display:block;margin:10px 0}</style></head><body>\n"
+            "<h1>Performance Test Report</h1>\n%s\n</body></html>\n" % "\n".join(sections)
+        )
+
+
+class CorpusRequest:
+    """
+    A request file of the functional test corpus, parsed and encoded once to replay it many times.
+
+    expected is a list of (key, value) of the expects file except ignored keys, checked if not None.
+    """
+
+    def __init__(self, name, method, url, headers, body, expected=None, keep_alive=True):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.headers = dict(headers)
+        self.body = body.encode() if body is not None else None
+        if body:
+            # JSON body is sent as JSON the same as TestAPI.request of test_rest_api.py
+            try:
+                json.loads(body)
+            except ValueError:
+                pass
+            else:
+                self.headers["Content-Type"] = "application/json"
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+        self.expected = expected
+        # sent as is by requests sessions, which do not change it
+        self.prepared = requests.Request(
+            method, url, headers=self.headers, data=self.body
+        ).prepare()
+
+
+def load_corpus(corpus_root, check="status", keep_alive=True):
+    """
+    Load test cases of corpus_root, e.g. inputs, as [(test case, [CorpusRequest, ...]), ...] sorted by name.
+
+    With check "expects", expected outputs are loaded from expects next to corpus_root, as the functional tests do.
+    """
+    expect_root = os.path.join(os.path.dirname(corpus_root), "expects")
+    corpus = []
+    for case in sorted(os.listdir(corpus_root)):
+        case_dir = os.path.join(corpus_root, case)
+        if not case.startswith("test_case") or not os.path.isdir(case_dir):
+            continue
+        case_requests = []
+        for request_file in sorted(os.listdir(case_dir)):
+            if not request_file.endswith(".txt"):
+                # ignore non-request text files, i.e. .ignore files
+                continue
+            expected = None
+            if check == "expects":
+                expected = parse_expects(
+                    os.path.join(
+                        expect_root, case, request_file.replace("request_", "response_")
+                    ),
+                    os.path.join(case_dir, request_file.replace(".txt", ".ignore")),
+                )
+            method, url, headers, body = parse_test_input(
+                os.path.join(case_dir, request_file)
+            )
+            case_requests.append(
+                CorpusRequest(
+                    "%s/%s" % (case, request_file[: -len(".txt")]),
+                    method,
+                    url,
+                    headers,
+                    body,
+                    expected,
+                    keep_alive,
+                )
+            )
+        if case_requests:
+            corpus.append((case, case_requests))
+    if not corpus:
+        raise ValueError("No test cases in corpus: %s" % corpus_root)
+    return corpus
+
+
+def parse_expects(expect_file, ignore_file):
+    """(key, value) list of an expects file in ini format except keys in ignore_file, None if no expects file"""
+    if not os.path.isfile(expect_file):
+        return None
+    ignore = set(parse_ignore_file(ignore_file))
+    return [(key, value) for key, value in ini_to_dict(expect_file).items() if key not in ignore]
+
+
+# le boundaries in seconds of the OpenMetrics response time histogram
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
 class TestAPI:
     """
     Performance Test Restful HTTP API examples.
     """
 
-    def __init__(self):
+    def __init__(self, percentiles=(50, 90, 95, 99, 99.9)):
         log.debug("To load test data.")
-        self.queue_results = queue.Queue()
+        # results of each running concurrent user, added by the user and merged by collect_results()
+        self.user_results = []
+        # merged results of the users which ended, None if none, see retire_user_results()
+        self.retired_results = None
+        # cumulative merge of user results at last collect_results()
+        self.collected_results = ResultStats()
+        # OpenMetrics text of the metrics server, None if not served, see update_metrics()
+        self.metrics_body = None
+        self.collect_lock = Lock()
 
         # test start and end time
         self.start_time = 0
@@ -142,19 +1445,76 @@ class TestAPI:
         # self.rps_min = 0
         self.rps_mean = 0
         # self.rps_max = 0
-        self.total_tested_requests = 0
         self.total_tested_time = 0
-        self.total_pass_requests = 0
 
-        # time per request
-        self.tpr_min = 999
+        # time per request mean
         self.tpr_mean = 0
-        self.tpr_max = 0
-        self.sum_response_time = 0
 
-        # failures
-        self.total_fail_requests = 0
-        self.total_exception_requests = 0
+        # cumulative results, i.e. request counts, failures and time per request min/max/histogram
+        self.results = ResultStats()
+        # results since last printed stats
+        self.interval_results = ResultStats()
+        self.interval_start_time = 0
+        # active users of each results source, e.g. this process or a worker, see merge_results()
+        self.source_active_users = {}
+
+        # client saturation thresholds, see check_saturation(), and whether any interval crossed them
+        self.saturation = {"cpu": 0.9, "lag": 0.05, "backlog": 1}
+        self.client_bound = False
+        self.saturated_intervals = 0
+        # highest scheduling lag of the monitor thread and the event loop since the last collection,
+        # and process CPU time at the last collection, see monitor_client() and collect_results()
+        self.thread_lag = 0
+        self.loop_lag = 0
+        self.collect_cpu_time = time.process_time()
+        self.collect_time = time.perf_counter()
+        # time per request percentiles to print
+        self.percentiles = percentiles
+
+        # open model requests per second, which load stages may change during the test
+        self.arrival_rate = 0
+
+        # connection pool size of each user's session, and keep-alive or new connection per request
+        self.pool_size = 1
+        self.keep_alive = True
+        # requests session of each user (thread)
+        self.local = local()
+
+        # time connect, TLS, send, TTFB and download phases of each request, see request_phases
+        self.phase_timing = False
+
+        # scenario mix, i.e. test functions and relative weights to pick them per request, see scenario_picker()
+        self.scenarios = [("test_mock_service", 1)]
+        # test cases of the corpus to replay instead of the scenario mix, see load_corpus() and corpus_picker()
+        self.corpus = []
+        self.corpus_order = "round_robin"
+        self.corpus_weights = {}
+
+        # API transcript policy, see transcribe(), and 1 in transcript_sample requests logged by "sample"
+        self.transcript = "full"
+        self.transcript_sample = 100
+
+        # exporter of interval stats records, e.g. TimeSeriesExporter
+        self.exporter = None
+
+        # warm-up period from start_time in seconds and requests, both must be met, see in_warmup()
+        self.warmup_time = 0
+        self.warmup_requests = 0
+        self.warmup_counter = itertools.count(1)
+        # wall time the warm-up of this process ended, 0 - not ended yet
+        self.warmup_end_time = 0
+
+        # load stages: label of the current stage and (label, duration, ResultStats) of ended stages
+        self.current_stage = None
+        self.stage_start_time = 0
+        self.stage_start_results = None
+        self.stage_results = []
+        # index of the current load stage in the stages, None if not in one, and a function called before a load
+        # stage ends, e.g. by a worker process to report the results of the stage, see process_worker()
+        self.stage_index = None
+        self.stage_end_callback = None
+        # capacity search: (target, duration, ResultStats, SLO passed) of each probe
+        self.search_results = []
 
         # event flag to set and check test time is up.
         self.event_time_up = Event()
@@ -179,7 +1539,7 @@ class TestAPI:
         elif resp.status_code != 200:
             log.error(
                 "Test %s failed with response status code %s."
-                % (inpsect.stack()[0][3], resp.status_code)
+                % (inspect.stack()[0].function, resp.status_code)
             )
             return "fail", resp.elapsed.total_seconds()
         elif resp.json()["url"] != url:
@@ -214,7 +1574,7 @@ class TestAPI:
         elif resp.status_code != 200:
             log.error(
                 "Test %s failed with response status code %s."
-                % (inpsect.stack()[0][3], resp.status_code)
+                % (inspect.stack()[0].function, resp.status_code)
             )
             return "fail", resp.elapsed.total_seconds()
         elif resp.json()["code"] != 1:
@@ -234,101 +1594,1282 @@ class TestAPI:
         }
         """
 
-    def loop_test(self, loop_wait=0, loop_times=sys.maxsize):
+    async def async_test_mock_service(self, session):
+        """asyncio version of test_mock_service, returns the same (result, elapsed time) contract."""
+        log.info("Calling async_test_mock_service.")
+        url = r"http://127.0.0.1:5000/hello"
+        resp, body, elapsed = await self.async_get(session, url)
+
+        if resp == None:
+            log.error("Test async_test_mock_service failed with exception.")
+            return "exception", None
+        elif resp.status != 200:
+            log.error(
+                "Test async_test_mock_service failed with response status code %s."
+                % resp.status
+            )
+            return "fail", elapsed
+        elif json.loads(body)["code"] != 1:
+            log.error(
+                "Test async_test_mock_service failed with code %s != 1."
+                % json.loads(body)["code"]
+            )
+            return "fail", elapsed
+        else:
+            log.info("Test async_test_mock_service passed.")
+            return "pass", elapsed
+
+    def test_corpus_request(self, corpus_request):
+        """replay a request of the corpus and check the response, returns the same (result, elapsed time) contract"""
+        try:
+            if self.phase_timing:
+                start_phases()
+            resp = self.session.send(corpus_request.prepared, verify=False)
+            if self.phase_timing:
+                end_phases()
+        except Exception as ex:
+            log.error("Test %s failed with exception: %s" % (corpus_request.name, ex))
+            return "exception", None
+        response_status.set(resp.status_code)
+        self.transcribe(pretty_print_transcript, resp)
+        return (
+            self.check_corpus_response(corpus_request, resp.status_code, resp.content),
+            resp.elapsed.total_seconds(),
+        )
+
+    async def async_test_corpus_request(self, session, corpus_request):
+        """asyncio version of test_corpus_request"""
+        try:
+            if self.phase_timing:
+                start_phases()
+            start = time.perf_counter()
+            async with session.request(
+                corpus_request.method,
+                corpus_request.url,
+                headers=corpus_request.headers,
+                data=corpus_request.body,
+                ssl=False,
+                trace_request_ctx=request_phases.get(),
+            ) as resp:
+                elapsed = time.perf_counter() - start
+                body = await resp.read()
+            if self.phase_timing:
+                end_phases()
+        except Exception as ex:
+            log.error("Test %s failed with exception: %s" % (corpus_request.name, ex))
+            return "exception", None
+        response_status.set(resp.status)
+        self.transcribe(pretty_print_aiohttp_transcript, resp, body, elapsed)
+        return self.check_corpus_response(corpus_request, resp.status, body), elapsed
+
+    def check_corpus_response(self, corpus_request, status_code, body):
+        """
+        Cheap checks of a corpus response: 2xx status code, and the expected values of expects if loaded.
+        Keys not in expects are not checked, unlike the functional tests.
+        """
+        if not 200 <= status_code < 300:
+            log.error(
+                "Test %s failed with response status code %s."
+                % (corpus_request.name, status_code)
+            )
+            return "fail"
+        if corpus_request.expected:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            # flattened the same way as the functional tests, see flatten_dict
+            actual = flatten_dict(data) if isinstance(data, dict) else {}
+            for key, value in corpus_request.expected:
+                if actual.get(key) != value:
+                    log.error(
+                        "Test %s failed with %s = %s != %s."
+                        % (corpus_request.name, key, actual.get(key), value)
+                    )
+                    return "fail"
+        log.info("Test %s passed." % corpus_request.name)
+        return "pass"
+
+    def loop_test(
+        self, loop_wait=0, loop_times=sys.maxsize, stop_event=None, run_event=None
+    ):
         """
         loop test of some APIs for performance test purpose.
 
         Parameters:
         loop_wait   wait time between two loops.
         loop_times  number of loops, default infinite
+        stop_event  event to stop this user only, e.g. when a load stage reduces users
+        run_event   event to run this user while set and park it while not, e.g. by a capacity search
         """
         looped_times = 0
+        results = self.new_user_results()
+        pick_scenario = self.scenario_picker()
 
         while (
             looped_times < loop_times
             and not self.event_time_up.is_set()
             and not self.event_test_done.is_set()
+            and not (stop_event and stop_event.is_set())
         ):
-            # APIs to test
-
-            # API - test_mock_service:
-            test_result, elapsed_time = self.test_mock_service()
-            # put results into a queue for statistics
-            self.queue_results.put(["test_mock_service", test_result, elapsed_time])
-
-            # # API - test_post_headers_body_json:
-            # test_result, elapsed_time = self.test_post_headers_body_json()
-            # self.queue_results.put(['test_post_headers_body_json', test_result, elapsed_time])
+            if run_event is not None and not run_event.is_set():
+                # parked, the session keeps its warm connections until the user runs again
+                results.active_users = 0
+                run_event.wait(0.1)
+                continue
+            results.active_users = 1
+            # API to test, picked from the scenario mix by weight
+            scenario, test = pick_scenario()
+            warmup = self.in_warmup()
+            results.total_started_requests += 1
+            test_result, elapsed_time = self.run_test(scenario, test)
+            # add results to this user's own stats
+            results.add(
+                test_result, elapsed_time, scenario, pop_response_status(), warmup
+            )
+            self.count_connections(results)
+            if self.phase_timing:
+                self.record_phases(results)
+            self.log_transcript(test_result)
 
             looped_times += 1
             sleep(loop_wait)
+        self.retire_user_results(results)
+
+    def run_test(self, scenario, test):
+        """
+        run a test function of the scenario mix, return its (result, elapsed time). An exception raised by the
+        test is an "exception" result, so the user goes on with the next request instead of ending.
+        """
+        try:
+            return test()
+        except Exception:
+            log.exception("Test %s failed with exception." % scenario)
+            return "exception", None
+
+    async def async_run_test(self, scenario, test, session):
+        """asyncio version of run_test"""
+        try:
+            return await test(session)
+        except Exception:
+            log.exception("Test %s failed with exception." % scenario)
+            return "exception", None
+
+    def in_warmup(self):
+        """
+        whether a request starting now is in the warm-up period, i.e. the first warmup_time seconds and the first
+        warmup_requests requests of the test. Requests after it are the steady state.
+        """
+        if self.warmup_end_time or not (self.warmup_time or self.warmup_requests):
+            return False
+        # next() of itertools.count is atomic, so users do not need a lock to count
+        if (
+            next(self.warmup_counter) <= self.warmup_requests
+            or time.time() - self.start_time < self.warmup_time
+        ):
+            return True
+        self.warmup_end_time = time.time()
+        return False
+
+    def steady_start_time(self, now):
+        """wall time the steady state of the results started, now if the warm-up has not ended yet"""
+        if not (self.warmup_time or self.warmup_requests):
+            return self.start_time
+        return self.results.warmup_end_time or now
+
+    def scenario_picker(self, prefix=""):
+        """
+        Return a function which picks a test of the scenario mix by weight, as (scenario name, test function).
+
+        prefix selects the test functions of an engine, e.g. "async_" for async_test_mock_service of asyncio.
+        """
+        if self.corpus:
+            return self.corpus_picker(prefix)
+        names = [name for name, weight in self.scenarios]
+        for name in names:
+            if not callable(getattr(self, prefix + name, None)):
+                raise ValueError("Scenario test function not found: %s" % (prefix + name))
+        tests = [(name, getattr(self, prefix + name)) for name in names]
+        if len(tests) == 1:
+            return lambda: tests[0]
+        cum_weights = list(itertools.accumulate(weight for name, weight in self.scenarios))
+        total = cum_weights[-1]
+
+        def pick_scenario():
+            return tests[bisect.bisect(cum_weights, random.random() * total)]
+
+        return pick_scenario
+
+    def corpus_picker(self, prefix=""):
+        """
+        Return a function which picks the next corpus request to replay by corpus_order, as (scenario name, test function):
+            round_robin - every request in turn, each user starting at a random request to spread the load
+            sequence    - the requests of each test case in order, then the next test case
+            weighted    - a random request by the weights of test cases in corpus_weights, 1 by default
+        Scenario names are requests, e.g. test_case_01/request_01, so stats are reported per request.
+        """
+        test = getattr(self, prefix + "test_corpus_request")
+        tests = [
+            (corpus_request.name, functools.partial(test, corpus_request=corpus_request))
+            for case, case_requests in self.corpus
+            for corpus_request in case_requests
+        ]
+        if self.corpus_order == "weighted":
+            weights = [
+                self.corpus_weights.get(case, 1) / len(case_requests)
+                for case, case_requests in self.corpus
+                for corpus_request in case_requests
+            ]
+            cum_weights = list(itertools.accumulate(weights))
+            total = cum_weights[-1]
+
+            def pick_weighted():
+                return tests[bisect.bisect(cum_weights, random.random() * total)]
+
+            return pick_weighted
+        if self.corpus_order == "sequence":
+            # start at the first request of a random test case
+            starts = list(
+                itertools.accumulate(
+                    [0] + [len(case_requests) for case, case_requests in self.corpus[:-1]]
+                )
+            )
+            next_index = random.choice(starts)
+        elif self.corpus_order == "round_robin":
+            next_index = random.randrange(len(tests))
+        else:
+            raise ValueError("Invalid corpus_order: %s" % self.corpus_order)
+
+        def pick_next():
+            nonlocal next_index
+            index = next_index
+            next_index = (index + 1) % len(tests)
+            return tests[index]
+
+        return pick_next
+
+    def arrival_gap(self, arrival="fixed"):
+        """gap to the next arrival at rate 1, divide by self.arrival_rate to follow rate changes while waiting"""
+        if arrival == "poisson":
+            return random.expovariate(1)
+        return 1
+
+    def open_loop_dispatch(self, dispatch_queue, arrival="fixed", loop_times=sys.maxsize):
+        """
+        Put intended start times (time.perf_counter()) into dispatch_queue at self.arrival_rate for open model,
+        no matter how long responses take. The rate can be changed during the test, e.g. by load stages.
+
+        Parameters:
+        arrival         fixed or poisson intervals between arrivals
+        loop_times      number of requests, default infinite
+        """
+        # dispatched requests, the backlog of users if not started yet
+        results = self.new_user_results(active_users=0)
+        last_time = time.perf_counter()
+        gap = 0  # first request right away
+        dispatched = 0
+        while dispatched < loop_times and not self.event_test_done.is_set():
+            arrival_rate = self.arrival_rate
+            if arrival_rate <= 0:
+                # no arrivals at rate 0, check the rate again later
+                self.event_test_done.wait(0.1)
+                last_time = time.perf_counter()
+                continue
+            intended_time = last_time + gap / arrival_rate
+            delay = intended_time - time.perf_counter()
+            if delay > 0:
+                # wait in short steps to follow rate changes, or stop waiting when test is done
+                self.event_test_done.wait(min(delay, 0.1))
+                continue
+            dispatch_queue.put(intended_time)
+            results.total_dispatched_requests += 1
+            dispatched += 1
+            last_time = intended_time
+            gap = self.arrival_gap(arrival)
+        self.retire_user_results(results)
+
+    def open_loop_test(self, dispatch_queue, late_threshold=0.01):
+        """
+        open model user, which runs a request for each intended start time from dispatch_queue until None.
+
+        Response time includes the delay from the intended start time to the actual start time to correct
+        coordinated omission, and a request is late if the delay is more than late_threshold seconds.
+        """
+        results = self.new_user_results()
+        pick_scenario = self.scenario_picker()
+        while True:
+            intended_time = dispatch_queue.get()
+            if intended_time is None or self.event_test_done.is_set():
+                break
+            start_delay = time.perf_counter() - intended_time
+
+            # API to test, picked from the scenario mix by weight
+            scenario, test = pick_scenario()
+            warmup = self.in_warmup()
+            results.total_started_requests += 1
+            test_result, elapsed_time = self.run_test(scenario, test)
+            if elapsed_time is not None:
+                elapsed_time += start_delay
+            results.add(
+                test_result, elapsed_time, scenario, pop_response_status(), warmup
+            )
+            self.count_connections(results)
+            if self.phase_timing:
+                self.record_phases(results)
+            self.log_transcript(test_result)
+            if start_delay > late_threshold:
+                results.total_late_requests += 1
+        self.retire_user_results(results)
+
+    async def async_loop_test(
+        self, loop_wait=0, loop_times=sys.maxsize, stop_event=None, run_event=None
+    ):
+        """
+        asyncio version of loop_test, one coroutine per concurrent user with its own aiohttp session.
+
+        Parameters:
+        loop_wait   wait time between two loops.
+        loop_times  number of loops, default infinite
+        stop_event  event to stop this user only, e.g. when a load stage reduces users
+        run_event   event to run this user while set and park it while not, e.g. by a capacity search
+        """
+        looped_times = 0
+        results = self.new_user_results()
+        pick_scenario = self.scenario_picker("async_")
+
+        async with self.new_async_session(results, self.pool_size) as session:
+            while (
+                looped_times < loop_times
+                and not self.event_time_up.is_set()
+                and not self.event_test_done.is_set()
+                and not (stop_event and stop_event.is_set())
+            ):
+                if run_event is not None and not run_event.is_set():
+                    # parked, the session keeps its warm connections until the user runs again
+                    results.active_users = 0
+                    await asyncio.sleep(0.1)
+                    continue
+                results.active_users = 1
+                # API to test, picked from the scenario mix by weight
+                scenario, test = pick_scenario()
+                warmup = self.in_warmup()
+                results.total_started_requests += 1
+                test_result, elapsed_time = await self.async_run_test(scenario, test, session)
+                # add results to this user's own stats the same as loop_test
+                results.add(
+                    test_result, elapsed_time, scenario, pop_response_status(), warmup
+                )
+                if self.phase_timing:
+                    self.record_phases(results)
+                self.log_transcript(test_result)
+
+                looped_times += 1
+                await asyncio.sleep(loop_wait)
+        self.retire_user_results(results)
+
+    async def async_open_request(
+        self, session, semaphore, intended_time, results, late_threshold, pick_scenario
+    ):
+        """asyncio version of one open_loop_test request, limited to concurrent users in flight by semaphore"""
+        async with semaphore:
+            if self.event_test_done.is_set():
+                return
+            start_delay = time.perf_counter() - intended_time
+            scenario, test = pick_scenario()
+            warmup = self.in_warmup()
+            results.total_started_requests += 1
+            test_result, elapsed_time = await self.async_run_test(scenario, test, session)
+        if elapsed_time is not None:
+            elapsed_time += start_delay
+        results.add(
+            test_result, elapsed_time, scenario, pop_response_status(), warmup
+        )
+        if self.phase_timing:
+            self.record_phases(results)
+        self.log_transcript(test_result)
+        if start_delay > late_threshold:
+            results.total_late_requests += 1
+
+    async def async_open_loop_dispatch(
+        self, concurrent_users, arrival="fixed", loop_times=sys.maxsize, late_threshold=0.01
+    ):
+        """
+        asyncio version of open_loop_dispatch and open_loop_test, a task per request.
+
+        Requests in flight share one aiohttp session with a pool of pool_size connections per concurrent user.
+        """
+        semaphore = asyncio.Semaphore(concurrent_users)
+        # one thread records all results of the event loop
+        results = self.new_user_results(active_users=concurrent_users)
+        async with self.new_async_session(
+            results, self.pool_size * concurrent_users
+        ) as session:
+            await self.async_open_loop_requests(
+                session, semaphore, results, arrival, loop_times, late_threshold
+            )
+        self.retire_user_results(results)
+
+    async def async_open_loop_requests(
+        self, session, semaphore, results, arrival, loop_times, late_threshold
+    ):
+        """dispatch loop of async_open_loop_dispatch"""
+        pick_scenario = self.scenario_picker("async_")
+        requests_in_flight = set()
+        last_time = time.perf_counter()
+        gap = 0  # first request right away
+        dispatched = 0
+        while dispatched < loop_times and not self.event_test_done.is_set():
+            arrival_rate = self.arrival_rate
+            if arrival_rate <= 0:
+                # no arrivals at rate 0, check the rate again later
+                await asyncio.sleep(0.1)
+                last_time = time.perf_counter()
+                continue
+            intended_time = last_time + gap / arrival_rate
+            delay = intended_time - time.perf_counter()
+            if delay > 0:
+                # wait in short steps to follow rate changes
+                await asyncio.sleep(min(delay, 0.1))
+                continue
+            task = asyncio.create_task(
+                self.async_open_request(
+                    session,
+                    semaphore,
+                    intended_time,
+                    results,
+                    late_threshold,
+                    pick_scenario,
+                )
+            )
+            requests_in_flight.add(task)
+            task.add_done_callback(requests_in_flight.discard)
+            results.total_dispatched_requests += 1
+            dispatched += 1
+            last_time = intended_time
+            gap = self.arrival_gap(arrival)
+        if requests_in_flight:
+            await asyncio.gather(*requests_in_flight)
+
+    async def async_run(self, settings):
+        """
+        Run concurrent users in settings as coroutines on the current event loop, the asyncio engine of main().
+
+        The timer is started after ramp up as what the thread engine does.
+        Open model if arrival_rate > 0, with up to concurrent_users * loop_times requests.
+        If there are load stages, they change the users or arrival rate during the test.
+        """
+        if aiohttp is None:
+            raise ImportError("asyncio engine requires aiohttp: pip install aiohttp")
+        # cancelled by asyncio.run() when users finish
+        asyncio.create_task(self.async_monitor_client())
+
+        concurrent_users = settings["concurrent_users"]
+        loop_times = settings["loop_times"]
+        ramp_up = settings["ramp_up"]
+        stages = settings["stages"]
+        search = settings["search"]
+
+        if self.arrival_rate > 0 or (
+            (stages or search) and settings["arrival_rate"] > 0
+        ):
+            self.start_timer(settings["test_time"])
+            dispatch = asyncio.create_task(
+                self.async_open_loop_dispatch(
+                    concurrent_users,
+                    settings["arrival"],
+                    concurrent_users * loop_times,
+                )
+            )
+            if stages:
+
+                def set_rate(target):
+                    self.arrival_rate = target
+
+                await self.async_run_stages(stages, set_rate, "requests/s")
+                self.set_event_test_done()
+            elif search:
+
+                def set_rate(target):
+                    self.arrival_rate = target
+
+                await self.async_run_search(search, set_rate, "requests/s")
+                self.set_event_test_done()
+            await dispatch
+            return
+
+        users = []
+        if stages:
+            # (task, stop event) of active users
+            active_users = []
+
+            def set_users(target):
+                target = int(round(target))
+                while len(active_users) < target:
+                    stop_event = Event()
+                    task = asyncio.create_task(
+                        self.async_loop_test(loop_times=loop_times, stop_event=stop_event)
+                    )
+                    users.append(task)
+                    active_users.append((task, stop_event))
+                while len(active_users) > target:
+                    active_users.pop()[1].set()
+
+            self.start_timer(settings["test_time"])
+            await self.async_run_stages(stages, set_users, "users")
+            self.set_event_test_done()
+            await asyncio.gather(*users)
+            return
+
+        if search:
+            # park users above the probe target instead of stopping them, so every probe reuses warm connections
+            run_events = []
+
+            def set_users(target):
+                while len(run_events) < target:
+                    run_event = Event()
+                    users.append(
+                        asyncio.create_task(
+                            self.async_loop_test(
+                                loop_times=loop_times, run_event=run_event
+                            )
+                        )
+                    )
+                    run_events.append(run_event)
+                for i, run_event in enumerate(run_events):
+                    if i < target:
+                        run_event.set()
+                    else:
+                        run_event.clear()
+
+            self.start_timer(settings["test_time"])
+            await self.async_run_search(search, set_users, "users")
+            self.set_event_test_done()
+            await asyncio.gather(*users)
+            return
+
+        for i in range(concurrent_users):
+            users.append(asyncio.create_task(self.async_loop_test(loop_times=loop_times)))
+            # ramp up wait
+            await asyncio.sleep(ramp_up / concurrent_users)
+
+        self.start_timer(settings["test_time"])
+        await asyncio.gather(*users)
+
+    def run_stages(self, stages, set_target, unit="users", tick=0.1):
+        """
+        Run a staged load profile, call set_target(target) every tick with the target users or arrival rate,
+        until the last stage ends or test is done. Results of each stage are kept in self.stage_results.
+        """
+        start = time.perf_counter()
+        stage = None
+        while not self.event_test_done.is_set():
+            index, target = stage_target(stages, time.perf_counter() - start)
+            if index is None:
+                break
+            if index != stage:
+                stage = index
+                self.start_stage(stage_label(stages, index, unit), index)
+            set_target(target)
+            self.event_test_done.wait(tick)
+        self.end_stage()
+
+    async def async_run_stages(self, stages, set_target, unit="users", tick=0.1):
+        """asyncio version of run_stages"""
+        start = time.perf_counter()
+        stage = None
+        while not self.event_test_done.is_set():
+            index, target = stage_target(stages, time.perf_counter() - start)
+            if index is None:
+                break
+            if index != stage:
+                stage = index
+                self.start_stage(stage_label(stages, index, unit), index)
+            set_target(target)
+            await asyncio.sleep(tick)
+        self.end_stage()
+
+    def run_search(self, search, set_target, unit="users"):
+        """
+        Run a capacity search, see search_probes(). Each probe sets the target users or arrival rate by set_target,
+        waits settle_time, then measures step_time seconds as a load stage and checks the SLO.
+        Probes are kept as (target, duration, results, passed) in self.search_results.
+        """
+        probes = search_probes(search, integer=unit == "users")
+        target = next(probes)
+        while True:
+            set_target(target)
+            if self.event_test_done.wait(search.get("settle_time", 1)):
+                break
+            self.start_stage(
+                "probe %d: %g %s" % (len(self.search_results) + 1, target, unit)
+            )
+            stopped = self.event_test_done.wait(search.get("step_time", 10))
+            self.end_stage()
+            if stopped:
+                break
+            if self.record_probe(target, search) is None:
+                break
+            try:
+                target = probes.send(self.search_results[-1][3])
+            except StopIteration:
+                break
+
+    async def async_run_search(self, search, set_target, unit="users"):
+        """asyncio version of run_search"""
+        probes = search_probes(search, integer=unit == "users")
+        target = next(probes)
+        while not self.event_test_done.is_set():
+            set_target(target)
+            await asyncio.sleep(search.get("settle_time", 1))
+            if self.event_test_done.is_set():
+                break
+            self.start_stage(
+                "probe %d: %g %s" % (len(self.search_results) + 1, target, unit)
+            )
+            step_end = time.perf_counter() + search.get("step_time", 10)
+            # wait in short steps to stop when test is done
+            while not self.event_test_done.is_set() and time.perf_counter() < step_end:
+                await asyncio.sleep(min(step_end - time.perf_counter(), 0.1))
+            self.end_stage()
+            if self.event_test_done.is_set() or self.record_probe(target, search) is None:
+                break
+            try:
+                target = probes.send(self.search_results[-1][3])
+            except StopIteration:
+                break
+
+    def record_probe(self, target, search):
+        """check the SLO of the last stage, i.e. a probe, keep it in self.search_results and return passed"""
+        label, duration, results = self.stage_results[-1]
+        if duration <= 0:
+            return None
+        percentile = search.get("percentile", 99)
+        errors = results.total_fail_requests + results.total_exception_requests
+        # no response in the whole step is not sustainable either
+        passed = (
+            results.total_tested_requests > 0
+            and errors / results.total_tested_requests <= search.get("error_rate", 0.01)
+            and min(results.histogram.percentile(percentile), results.tpr_max)
+            <= search["latency"]
+        )
+        self.search_results.append((target, duration, results, passed))
+        return passed
+
+    def write_summary(self, file, settings):
+        """write a compact summary of the whole test, totals and per scenario, to a JSON file for compare mode"""
+        steady_start_time = self.steady_start_time(self.end_time)
+        duration = self.end_time - steady_start_time
+        summary = {
+            "timestamp": round(self.end_time, 3),
+            "settings": settings,
+            "total": results_summary(self.results, duration, self.percentiles),
+            "scenarios": {
+                scenario: results_summary(results, duration, self.percentiles)
+                for scenario, results in self.results.scenarios.items()
+            },
+        }
+        summary["client_bound"] = self.client_bound
+        summary["client"] = {
+            "saturated_intervals": self.saturated_intervals,
+            "cpu": self.results.client_cpu,
+            "lag": self.results.client_lag,
+        }
+        if self.results.warmup is not None:
+            # not compared, only the steady state is
+            summary["warmup"] = results_summary(
+                self.results.warmup, steady_start_time - self.start_time, self.percentiles
+            )
+        with open(file, "w") as f:
+            json.dump(summary, f)
+
+    def print_search_stats(self, unit="users"):
+        """
+        print probes of a capacity search with the highest sustainable throughput and the knee, return whether
+        any probe met the SLO, None without a search
+        """
+        if not self.search_results:
+            return None
+        print("\n-----------------Capacity Search---------------")
+        sustainable = []
+        for target, duration, results, passed in self.search_results:
+            rps = results.total_pass_requests / duration
+            errors = results.total_fail_requests + results.total_exception_requests
+            print(
+                "%g %s - Request per Second: %.2f, error rate: %.4f, %s - %s"
+                % (
+                    target,
+                    unit,
+                    rps,
+                    errors / results.total_tested_requests
+                    if results.total_tested_requests
+                    else 0,
+                    self.format_percentiles(results),
+                    "pass" if passed else "SLO broken",
+                )
+            )
+            if passed and results.total_pass_requests > 0:
+                mean = results.sum_response_time / results.total_pass_requests
+                sustainable.append((rps, target, mean))
+        if not sustainable:
+            print("No probe met the SLO.")
+            return False
+        rps, target, mean = max(sustainable)
+        print(
+            "Max sustainable throughput: %.2f requests/s at %g %s, time per request mean: %.6f"
+            % (rps, target, unit, mean)
+        )
+        # knee: max power, i.e. throughput / response time, where latency starts to grow faster than throughput
+        rps, target, mean = max(sustainable, key=lambda probe: probe[0] / probe[2])
+        print(
+            "Knee: %g %s, %.2f requests/s, time per request mean: %.6f"
+            % (target, unit, rps, mean)
+        )
+        return True
+
+    def snapshot_results(self):
+        """cumulative results so far, merged from users in this process, or from worker processes if no users"""
+        snapshot = ResultStats()
+        if self.user_results or self.retired_results is not None:
+            with self.collect_lock:
+                if self.retired_results is not None:
+                    snapshot.merge(self.retired_results)
+                for results in self.user_results:
+                    snapshot.merge(results)
+        else:
+            snapshot.merge(self.results)
+        return snapshot
+
+    def start_stage(self, label, index=None):
+        """end the current load stage if any and start a new one, which labels stats from now on"""
+        self.end_stage()
+        self.current_stage = label
+        self.stage_index = index
+        self.stage_start_time = time.time()
+        self.stage_start_results = self.snapshot_results()
+
+    def end_stage(self):
+        """keep (label, duration, results) of the current load stage in self.stage_results"""
+        if self.current_stage is None:
+            return
+        if self.stage_end_callback is not None:
+            self.stage_end_callback()
+        self.stage_results.append(
+            (
+                self.current_stage,
+                time.time() - self.stage_start_time,
+                self.snapshot_results().subtract(self.stage_start_results),
+            )
+        )
+        self.current_stage = None
+        self.stage_index = None
+
+    def openmetrics(self):
+        """cumulative results of the stats thread in OpenMetrics text format, see update_metrics()"""
+        results = self.results
+        lines = [
+            "# TYPE perf_requests counter",
+            "# HELP perf_requests Tested requests by result.",
+        ]
+        for result, count in (
+            ("pass", results.total_pass_requests),
+            ("fail", results.total_fail_requests),
+            ("exception", results.total_exception_requests),
+        ):
+            lines.append('perf_requests_total{result="%s"} %s' % (result, count))
+        lines += [
+            "# TYPE perf_scenario_requests counter",
+            "# HELP perf_scenario_requests Tested requests by scenario and result.",
+        ]
+        for scenario, scenario_results in sorted(results.scenarios.items()):
+            for result, count in (
+                ("pass", scenario_results.total_pass_requests),
+                ("fail", scenario_results.total_fail_requests),
+                ("exception", scenario_results.total_exception_requests),
+            ):
+                lines.append(
+                    'perf_scenario_requests_total{scenario="%s",result="%s"} %s'
+                    % (scenario, result, count)
+                )
+        lines += [
+            "# TYPE perf_requests_in_flight gauge",
+            "# HELP perf_requests_in_flight Requests started but not tested yet.",
+            "perf_requests_in_flight %s"
+            % max(results.total_started_requests - results.total_tested_requests, 0),
+            "# TYPE perf_active_users gauge",
+            "# HELP perf_active_users Concurrent users running.",
+            "perf_active_users %s" % results.active_users,
+            "# TYPE perf_late_requests counter",
+            "# HELP perf_late_requests Open model requests started later than intended.",
+            "perf_late_requests_total %s" % results.total_late_requests,
+            "# TYPE perf_connections_opened counter",
+            "perf_connections_opened_total %s" % results.connections_opened,
+            "# TYPE perf_connections_reused counter",
+            "perf_connections_reused_total %s" % results.connections_reused,
+            "# TYPE perf_response_time_seconds histogram",
+            "# UNIT perf_response_time_seconds seconds",
+            "# HELP perf_response_time_seconds Time per request of pass requests.",
+        ]
+        for le in METRICS_BUCKETS:
+            lines.append(
+                'perf_response_time_seconds_bucket{le="%g"} %s'
+                % (le, results.histogram.count_le(le))
+            )
+        lines += [
+            'perf_response_time_seconds_bucket{le="+Inf"} %s'
+            % sum(results.histogram.counts),
+            "perf_response_time_seconds_count %s" % sum(results.histogram.counts),
+            "perf_response_time_seconds_sum %s" % results.sum_response_time,
+            "# EOF",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def update_metrics(self):
+        """render openmetrics() for the metrics server, by the stats thread after it merges results"""
+        self.metrics_body = self.openmetrics().encode()
+
+    def start_metrics_server(self, port, host="127.0.0.1"):
+        """
+        serve the metrics of update_metrics() at http://host:port/metrics in a daemon thread, return the server
+        to shut down
+        """
+        perf_test = self
+        self.update_metrics()
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = perf_test.metrics_body
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type",
+                    "application/openmetrics-text; version=1.0.0; charset=utf-8",
+                )
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics: " + format % args)
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        Thread(target=server.serve_forever, daemon=True).start()
+        print("Metrics served at http://%s:%s/metrics." % (host, port))
+        return server
+
+    def print_warmup_stats(self, warmup, duration):
+        """print statistics of the warm-up results of duration seconds, see in_warmup()"""
+        print(
+            "Warm-up requests: %s, pass: %s, fail: %s, exception: %s in %.2f seconds"
+            % (
+                warmup.total_tested_requests,
+                warmup.total_pass_requests,
+                warmup.total_fail_requests,
+                warmup.total_exception_requests,
+                duration,
+            )
+        )
+        if warmup.total_pass_requests > 0 and duration > 0:
+            print(
+                "Warm-up Request per Second: %.2f, Time per Request - mean: %.6f, max: %.6f, %s"
+                % (
+                    warmup.total_pass_requests / duration,
+                    warmup.sum_response_time / warmup.total_pass_requests,
+                    warmup.tpr_max,
+                    self.format_percentiles(warmup),
+                )
+            )
+
+    def print_scenario_stats(self, results, duration):
+        """print statistics of each scenario of a scenario mix in results"""
+        if len(results.scenarios) < 2:
+            return
+        for scenario, scenario_results in sorted(results.scenarios.items()):
+            print(
+                "    %s - requests: %s, pass: %s, fail: %s, exception: %s"
+                % (
+                    scenario,
+                    scenario_results.total_tested_requests,
+                    scenario_results.total_pass_requests,
+                    scenario_results.total_fail_requests,
+                    scenario_results.total_exception_requests,
+                )
+            )
+            if scenario_results.total_pass_requests > 0 and duration > 0:
+                print(
+                    "        Request per Second: %.2f, Time per Request - mean: %.6f, %s"
+                    % (
+                        scenario_results.total_pass_requests / duration,
+                        scenario_results.sum_response_time
+                        / scenario_results.total_pass_requests,
+                        self.format_percentiles(scenario_results),
+                    )
+                )
+
+    def print_stage_stats(self):
+        """print statistics of each load stage"""
+        if not self.stage_results:
+            return
+        print("\n-----------------Stage Statistics---------------")
+        for label, duration, results in self.stage_results:
+            print(
+                "%s - requests: %s, pass: %s, fail: %s, exception: %s in %.2f seconds"
+                % (
+                    label,
+                    results.total_tested_requests,
+                    results.total_pass_requests,
+                    results.total_fail_requests,
+                    results.total_exception_requests,
+                    duration,
+                )
+            )
+            if results.total_pass_requests > 0 and duration > 0:
+                print(
+                    "    Request per Second: %.2f, Time per Request - mean: %.6f, %s"
+                    % (
+                        results.total_pass_requests / duration,
+                        results.sum_response_time / results.total_pass_requests,
+                        self.format_percentiles(results),
+                    )
+                )
+
+    def new_user_results(self, active_users=1):
+        """create and register the ResultStats of a concurrent user, which only that user adds results to"""
+        results = ResultStats()
+        results.active_users = active_users
+        self.user_results.append(results)
+        return results
+
+    def retire_user_results(self, results):
+        """
+        fold the results of a user which ended into self.retired_results and drop them from self.user_results,
+        so users started and stopped by load stages do not grow the results merged every collection
+        """
+        results.active_users = 0
+        with self.collect_lock:
+            if self.retired_results is None:
+                self.retired_results = ResultStats()
+            self.retired_results.merge(results)
+            self.user_results.remove(results)
+
+    def collect_results(self):
+        """merge all users' results and return results since last collection as a ResultStats"""
+        with self.collect_lock:
+            merged = ResultStats()
+            if self.retired_results is not None:
+                merged.merge(self.retired_results)
+            for results in list(self.user_results):
+                merged.merge(results)
+            merged.warmup_end_time = self.warmup_end_time
+            # load generator gauges of this process since the last collection
+            cpu_time, now = time.process_time(), time.perf_counter()
+            if now > self.collect_time:
+                merged.client_cpu = (cpu_time - self.collect_cpu_time) / (
+                    now - self.collect_time
+                )
+            self.collect_cpu_time, self.collect_time = cpu_time, now
+            merged.client_lag = max(self.thread_lag, self.loop_lag)
+            self.thread_lag = self.loop_lag = 0
+            partial = merged.subtract(self.collected_results)
+            self.collected_results = merged
+        return partial
+
+    def monitor_client(self, period=0.1):
+        """
+        Measure the scheduling lag of this process, i.e. how late a thread wakes up compared with plan,
+        every period seconds until the test is done. Run this as a separate thread.
+        A busy GIL or CPU delays users the same way, so their response times include the lag.
+        """
+        while True:
+            planned_time = time.perf_counter() + period
+            if self.event_test_done.wait(period):
+                break
+            self.thread_lag = max(self.thread_lag, time.perf_counter() - planned_time)
+
+    async def async_monitor_client(self, period=0.1):
+        """asyncio version of monitor_client, the lag of the event loop which runs all users"""
+        while not self.event_test_done.is_set():
+            planned_time = time.perf_counter() + period
+            await asyncio.sleep(period)
+            self.loop_lag = max(self.loop_lag, time.perf_counter() - planned_time)
+
+    def check_saturation(self, interval):
+        """
+        print load generator CPU, scheduling lag, requests in flight and backlog of interval results, and warn if
+        they cross the saturation thresholds, when response times are likely inflated by the client itself.
+        """
+        results = self.results
+        in_flight = results.total_started_requests - results.total_tested_requests
+        backlog = max(results.total_dispatched_requests - results.total_started_requests, 0)
+        print(
+            "Client - CPU: %.0f%% of a core, scheduling lag max: %.3f s, in flight: %s, backlog: %s"
+            % (interval.client_cpu * 100, interval.client_lag, in_flight, backlog)
+        )
+        warnings = []
+        if interval.client_cpu > self.saturation["cpu"]:
+            warnings.append("CPU %.0f%% of a core" % (interval.client_cpu * 100))
+        if interval.client_lag > self.saturation["lag"]:
+            warnings.append("scheduling lag %.3f s" % interval.client_lag)
+        if backlog > self.saturation["backlog"] * max(results.active_users, 1):
+            warnings.append("backlog of %s requests" % backlog)
+        if warnings:
+            self.client_bound = True
+            self.saturated_intervals += 1
+            print(
+                "WARNING: load generator saturated (%s), response times may be client-bound."
+                % ", ".join(warnings)
+            )
+        return warnings
+
+    def merge_results(self, partial, source=None):
+        """merge partial results, e.g. from collect_results() or a worker process, into cumulative and interval results"""
+        self.results.merge(partial)
+        self.interval_results.merge(partial)
+        # active users is the latest gauge of each source, not a sum of partial results
+        self.source_active_users[source] = partial.active_users
+        active_users = sum(self.source_active_users.values())
+        self.results.active_users = self.interval_results.active_users = active_users
 
     def stats(self):
         """calculate statistics"""
+        self.merge_results(self.collect_results())
+        self.print_stats()
+
+    def format_percentiles(self, results):
+        """format time per request percentiles, e.g. p50: 0.201000, p99: 0.250000
+
+        Percentiles are the highest values of histogram buckets, so they are capped by the exact max.
+        """
+        return ", ".join(
+            "p%g: %.6f" % (p, min(results.histogram.percentile(p), results.tpr_max))
+            for p in self.percentiles
+        )
+
+    def format_phase(self, results, name):
+        """format mean and percentiles of a request phase, e.g. mean: 0.001000, p50: 0.001000, p99: 0.002000"""
+        histogram = results.phase_histograms[name]
+        count = sum(histogram.counts)
+        return "mean: %.6f, %s" % (
+            results.phase_sums[name] / count if count else 0,
+            ", ".join(
+                "p%g: %.6f" % (p, min(histogram.percentile(p), histogram.max()))
+                for p in self.percentiles
+            ),
+        )
+
+    def interval_record(self, interval, interval_time, end_time):
+        """time series record of interval results, see TimeSeriesExporter"""
+        passed = interval.total_pass_requests
+        # rps of the steady state part of the interval, see in_warmup()
+        warmup_time = min(
+            max(self.steady_start_time(end_time) - (end_time - interval_time), 0),
+            interval_time,
+        )
+        interval_time -= warmup_time
+        record = {
+            "timestamp": round(end_time, 3),
+            "elapsed": round(end_time - self.start_time, 3),
+            "interval": round(interval_time + warmup_time, 3),
+            "warmup_time": round(warmup_time, 3),
+            "stage": self.current_stage or "",
+            "rps": round(passed / interval_time, 3) if interval_time > 0 else 0,
+            "requests": interval.total_tested_requests,
+            "pass": passed,
+            "fail": interval.total_fail_requests,
+            "exception": interval.total_exception_requests,
+            "late": interval.total_late_requests,
+            "mean": round(interval.sum_response_time / passed, 6) if passed else 0,
+            "min": round(interval.tpr_min, 6) if passed else 0,
+            "max": round(interval.tpr_max, 6) if passed else 0,
+            "client_cpu": round(interval.client_cpu, 3),
+            "client_lag": round(interval.client_lag, 6),
+            "backlog": max(
+                self.results.total_dispatched_requests - self.results.total_started_requests, 0
+            ),
+        }
+        for p in self.percentiles:
+            record["p%g" % p] = round(
+                min(interval.histogram.percentile(p), interval.tpr_max), 6
+            )
+        record["histogram"] = interval.histogram.to_dict()["counts"]
+        record["errors"] = interval.errors
+        # warm-up results in JSON Lines only
+        if interval.warmup is not None and interval.warmup.total_tested_requests > 0:
+            warmup = interval.warmup
+            record["warmup"] = {
+                "requests": warmup.total_tested_requests,
+                "pass": warmup.total_pass_requests,
+                "fail": warmup.total_fail_requests,
+                "exception": warmup.total_exception_requests,
+                "mean": round(warmup.sum_response_time / warmup.total_pass_requests, 6)
+                if warmup.total_pass_requests
+                else 0,
+                "min": round(warmup.tpr_min, 6) if warmup.total_pass_requests else 0,
+                "max": round(warmup.tpr_max, 6),
+                "histogram": warmup.histogram.to_dict()["counts"],
+                "errors": warmup.errors,
+            }
+        # per phase and per scenario in JSON Lines only
+        record["phases"] = {}
+        for name, histogram in interval.phase_histograms.items():
+            count = sum(histogram.counts)
+            record["phases"][name] = {
+                "mean": round(interval.phase_sums[name] / count, 6) if count else 0
+            }
+            for p in self.percentiles:
+                record["phases"][name]["p%g" % p] = round(
+                    min(histogram.percentile(p), histogram.max()), 6
+                )
+        record["scenarios"] = {}
+        for scenario, results in interval.scenarios.items():
+            passed = results.total_pass_requests
+            record["scenarios"][scenario] = {
+                "rps": round(passed / interval_time, 3) if interval_time > 0 else 0,
+                "requests": results.total_tested_requests,
+                "pass": passed,
+                "fail": results.total_fail_requests,
+                "exception": results.total_exception_requests,
+                "mean": round(results.sum_response_time / passed, 6) if passed else 0,
+                "min": round(results.tpr_min, 6) if passed else 0,
+                "max": round(results.tpr_max, 6) if passed else 0,
+            }
+            for p in self.percentiles:
+                record["scenarios"][scenario]["p%g" % p] = round(
+                    min(results.histogram.percentile(p), results.tpr_max), 6
+                )
+            record["scenarios"][scenario]["histogram"] = results.histogram.to_dict()["counts"]
+        return record
+
+    def print_stats(self):
+        """print statistics of the interval since last print and of cumulative results"""
         end_time = time.time()
-        # get the approximate queue size
-        qsize = self.queue_results.qsize()
-        loop = 0
-        for i in range(qsize):
-            try:
-                result = self.queue_results.get_nowait()
-                loop += 1
-            except queue.Empty:
-                break
-            # calc stats
-            if result[1] == "exception":
-                self.total_exception_requests += 1
-            elif result[1] == "fail":
-                self.total_fail_requests += 1
-            elif result[1] == "pass":
-                self.total_pass_requests += 1
-                self.sum_response_time += result[2]
-                if result[2] < self.tpr_min:
-                    self.tpr_min = result[2]
-                if result[2] > self.tpr_max:
-                    self.tpr_max = result[2]
-
-        self.total_tested_requests += loop
+        results = self.results
+        if self.metrics_body is not None:
+            self.update_metrics()
+        interval = self.interval_results
         # time per requests mean (avg)
-        if self.total_pass_requests != 0:
-            self.tpr_mean = self.sum_response_time / self.total_pass_requests
+        if results.total_pass_requests != 0:
+            self.tpr_mean = results.sum_response_time / results.total_pass_requests
         # requests per second
+        steady_start_time = self.steady_start_time(end_time)
+        tested_time = end_time - steady_start_time
         if self.start_time == 0:
             log.error("stats: self.start_time is not set, skipping rps stats.")
         else:
-            # calc the tested time so far.
-            tested_time = end_time - self.start_time
-            self.rps_mean = self.total_pass_requests / tested_time
+            # calc the tested time so far, excluding the warm-up period.
+            self.rps_mean = (
+                results.total_pass_requests / tested_time if tested_time > 0 else 0
+            )
+        interval_start_time = self.interval_start_time or self.start_time
+        interval_time = end_time - interval_start_time
+        # the part of the interval in the steady state, the denominator of interval rps
+        steady_interval_time = end_time - max(interval_start_time, steady_start_time)
 
         # print stats
         print("\n-----------------Test Statistics---------------")
         print(time.asctime())
+        if self.current_stage is not None:
+            print("Stage: %s" % self.current_stage)
+        print(
+            "Interval requests: %s, pass: %s, fail: %s, exception: %s in %.2f seconds"
+            % (
+                interval.total_tested_requests,
+                interval.total_pass_requests,
+                interval.total_fail_requests,
+                interval.total_exception_requests,
+                interval_time,
+            )
+        )
+        if interval.warmup is not None and interval.warmup.total_tested_requests > 0:
+            self.print_warmup_stats(interval.warmup, interval_time - steady_interval_time)
+        if interval.total_pass_requests > 0 and steady_interval_time > 0:
+            print(
+                "Request per Second - interval: %.2f"
+                % (interval.total_pass_requests / steady_interval_time)
+            )
+            print(
+                "Time per Request   - interval mean: %.6f, min: %.6f, max: %.6f"
+                % (
+                    interval.sum_response_time / interval.total_pass_requests,
+                    interval.tpr_min,
+                    interval.tpr_max,
+                )
+            )
+            print("Time per Request   - interval %s" % self.format_percentiles(interval))
+        self.print_scenario_stats(interval, steady_interval_time)
+        saturation_warnings = self.check_saturation(interval)
         print(
             "Total requests: %s, pass: %s, fail: %s, exception: %s"
             % (
-                self.total_tested_requests,
-                self.total_pass_requests,
-                self.total_fail_requests,
-                self.total_exception_requests,
+                results.total_tested_requests,
+                results.total_pass_requests,
+                results.total_fail_requests,
+                results.total_exception_requests,
             )
         )
-        if self.total_pass_requests > 0:
+        if results.errors:
+            print(
+                "Errors by status code: %s"
+                % ", ".join(
+                    "%s: %s" % (key, count)
+                    for key, count in sorted(results.errors.items(), key=lambda item: -item[1])
+                )
+            )
+        if results.total_pass_requests > 0:
             print("For pass requests:")
             print("Request per Second - mean: %.2f" % self.rps_mean)
             print(
                 "Time per Request   - mean: %.6f, min: %.6f, max: %.6f"
-                % (self.tpr_mean, self.tpr_min, self.tpr_max)
+                % (self.tpr_mean, results.tpr_min, results.tpr_max)
+            )
+            print("Time per Request   - %s" % self.format_percentiles(results))
+        for name in PHASES:
+            if name in results.phase_histograms:
+                print(
+                    "Phase %-13s- %s"
+                    % (name, self.format_phase(results, name))
+                )
+        self.print_scenario_stats(results, tested_time)
+        if results.warmup is not None:
+            print("Warm-up period (excluded from the statistics above):")
+            self.print_warmup_stats(results.warmup, steady_start_time - self.start_time)
+        if results.connections_opened > 0:
+            print(
+                "Connections - opened: %s, reused: %s"
+                % (results.connections_opened, results.connections_reused)
+            )
+        if results.total_late_requests > 0:
+            print(
+                "Late requests (started later than intended due to client backlog): %s"
+                % results.total_late_requests
+            )
+        if self.client_bound:
+            print(
+                "Client-bound: load generator saturated in %s interval(s), peak CPU: %.0f%% of a core, "
+                "peak scheduling lag: %.3f s"
+                % (self.saturated_intervals, results.client_cpu * 100, results.client_lag)
             )
         # print('\n')
 
+        if self.exporter is not None:
+            record = self.interval_record(interval, interval_time, end_time)
+            record["client_bound"] = bool(saturation_warnings)
+            self.exporter.write(record)
+
+        # start a new interval
+        self.interval_results = ResultStats()
+        self.interval_start_time = end_time
+
     def loop_stats(self, interval=60):
         """print stats in an interval(secs) continunously
 
         Run this as a separate thread so it won't block the main thread.
         """
         # while True:
-        while not self.event_time_up.is_set() and not self.event_test_done.is_set():
-            sleep(interval)
+        # stop waiting as soon as test is done, so the last stats are printed once by the main thread
+        while not self.event_test_done.wait(interval):
             self.stats()
 
     def set_event_time_up(self):
@@ -352,6 +2893,91 @@ class TestAPI:
         if self.timer != None and not self.event_time_up.is_set():
             self.timer.cancel()
 
+    @property
+    def session(self):
+        """requests session of the current user (thread), created on first use"""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = CountingHTTPAdapter(
+                connection_counter,
+                pool_connections=self.pool_size,
+                pool_maxsize=self.pool_size,
+                time_phases=self.phase_timing,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if not self.keep_alive:
+                # server closes the connection after the response, so every request opens a new one
+                session.headers["Connection"] = "close"
+            self.local.session = session
+        return session
+
+    def transcribe(self, pretty_print_function, *args):
+        """
+        Log an API transcript by pretty_print_function(*args) according to the transcript policy:
+            full     - every request
+            sample   - 1 in transcript_sample requests
+            failures - requests of tests which do not pass, deferred until log_transcript()
+            off      - none
+        Transcripts which will not be written are not formatted at all.
+        """
+        if self.transcript == "off" or not log_api.isEnabledFor(logging.INFO):
+            return
+        if self.transcript == "failures":
+            # keep the response only, format it if the test fails
+            pending_transcripts.set(
+                pending_transcripts.get() + ((pretty_print_function, args),)
+            )
+        elif self.transcript == "full" or (
+            self.transcript == "sample"
+            and random.randrange(self.transcript_sample) == 0
+        ):
+            pretty_print_function(*args)
+
+    def log_transcript(self, result):
+        """log transcripts of the current user's test deferred by the failures policy if the test did not pass"""
+        transcripts = pending_transcripts.get()
+        if not transcripts:
+            return
+        pending_transcripts.set(())
+        if result != "pass":
+            for pretty_print_function, args in transcripts:
+                pretty_print_function(*args)
+
+    def record_phases(self, results):
+        """add the phase times of the current user's last request to results, see request_phases"""
+        phases = request_phases.get()
+        if phases and "download" in phases:
+            results.add_phases(phases)
+        request_phases.set(None)
+
+    def count_connections(self, results):
+        """update results with connections opened and reused by the current user (thread)"""
+        opened = getattr(connection_counts, "opened", 0)
+        results.connections_opened = opened
+        results.connections_reused = max(getattr(connection_counts, "requests", 0) - opened, 0)
+
+    def new_async_session(self, results, pool_size):
+        """
+        aiohttp session of pool_size keep-alive connections, or a new connection per request if not keep_alive,
+        which counts opened and reused connections in results.
+        """
+
+        async def on_connection_create_end(session, context, params):
+            results.connections_opened += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            results.connections_reused += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        if self.phase_timing:
+            add_phase_trace(trace_config)
+        connector = aiohttp.TCPConnector(limit=pool_size, force_close=not self.keep_alive)
+        return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
     def post(self, url, data, headers={}, verify=True, amend_headers=True):
         """
         common request post function with below features, which you only need to take care of url and body data:
@@ -375,18 +3001,19 @@ class TestAPI:
 
         # send post request
         try:
-            resp = requests.post(url, data=data, headers=headers_new, verify=verify)
+            if self.phase_timing:
+                start_phases()
+            resp = self.session.post(url, data=data, headers=headers_new, verify=verify)
+            if self.phase_timing:
+                end_phases()
         except Exception as ex:
-            log.error("requests.post() failed with exception:", str(ex))
+            log.error("requests.post() failed with exception: %s" % str(ex))
             return None
 
-        # pretty request and response into API log file
+        response_status.set(resp.status_code)
+        # pretty request and response into API log file by the transcript policy
         # Note: request print is common instead of checking if it is JSON body. So pass pretty formatted json string as argument to the request for pretty logging.
-        pretty_print_request(resp.request)
-        pretty_print_response_json(resp)
-        log_api.debug(
-            "response time in seconds: " + str(resp.elapsed.total_seconds()) + "\n"
-        )
+        self.transcribe(pretty_print_transcript, resp)
 
         return resp
 
@@ -402,77 +3029,924 @@ class TestAPI:
         Return: None for exception
         """
         try:
+            if self.phase_timing:
+                start_phases()
             if auth == None:
-                resp = requests.get(url, verify=verify)
+                resp = self.session.get(url, verify=verify)
             else:
-                resp = requests.get(url, auth=auth, verify=verify)
+                resp = self.session.get(url, auth=auth, verify=verify)
+            if self.phase_timing:
+                end_phases()
         except Exception as ex:
-            log.error("requests.get() failed with exception:", str(ex))
+            log.error("requests.get() failed with exception: %s" % str(ex))
             return None
 
-        # pretty request and response into API log file
-        pretty_print_request(resp.request)
-        pretty_print_response_json(resp)
-        log_api.debug(
-            "response time in seconds: " + str(resp.elapsed.total_seconds()) + "\n"
-        )
+        response_status.set(resp.status_code)
+        # pretty request and response into API log file by the transcript policy
+        self.transcribe(pretty_print_transcript, resp)
 
         return resp
 
+    async def async_get(self, session, url, auth=None, verify=False):
+        """
+        asyncio version of get with aiohttp.
+
+        elapsed time is measured until the response headers are received, the same as requests' resp.elapsed,
+        so response times of the two engines are comparable.
 
-def main():
-    ### Test Settings ###
-    concurrent_users = 10
-    # test stops whenever loop_times or test_time is met first.
-    loop_times = 30
-    test_time = 3600  # time in seconds, e.g. 36000
-    stats_interval = 2
-    ramp_up = 0  # total time in secs to ramp up. default 0, no wait
+        Return: (response, body bytes, elapsed seconds), (None, None, None) for exception
+        """
+        if auth != None:
+            auth = aiohttp.BasicAuth(*auth)
+        try:
+            if self.phase_timing:
+                start_phases()
+            start = time.perf_counter()
+            # ssl=False - Disable SSL certificate verification, None - default verification
+            async with session.get(
+                url,
+                auth=auth,
+                ssl=None if verify else False,
+                trace_request_ctx=request_phases.get(),
+            ) as resp:
+                elapsed = time.perf_counter() - start
+                body = await resp.read()
+            if self.phase_timing:
+                end_phases()
+        except Exception as ex:
+            log.error("aiohttp get failed with exception: %s" % str(ex))
+            return None, None, None
+
+        response_status.set(resp.status)
+        # pretty request and response into API log file by the transcript policy
+        self.transcribe(pretty_print_aiohttp_transcript, resp, body, elapsed)
+
+        return resp, body, elapsed
+
+
+def stage_target(stages, elapsed):
+    """
+    Return (stage index, target) at elapsed seconds of a staged load profile, (None, 0) after the last stage.
+
+    stages: [(duration seconds, target users or arrival rate), ...]. The target changes linearly from
+    the previous stage target (0 before the first stage) to the stage target over the stage duration.
+    """
+    previous_target = 0
+    for index, (duration, target) in enumerate(stages):
+        if elapsed < duration:
+            return index, previous_target + (target - previous_target) * elapsed / duration
+        elapsed -= duration
+        previous_target = target
+    return None, 0
+
+
+def search_probes(search, integer=True):
+    """
+    Generator of probe targets (users or arrival rate) of a capacity search, which is sent whether each probe
+    met the SLO, until the search converges, reaches max or runs steps probes.
+
+    binary - double from start until the SLO is broken, then bisect between the highest passed and lowest
+             broken targets until they are within precision (a fraction of the broken target).
+    aimd   - additive increase by increase after a pass, multiplicative decrease by decrease after a break.
+    """
+    start = search.get("start", 1)
+    maximum = search.get("max", 10000)
+    target = start
+    if search.get("algorithm", "binary") == "aimd":
+        for step in range(search.get("steps", 20)):
+            passed = yield target
+            if passed:
+                target = min(target + search.get("increase", start), maximum)
+            else:
+                target = max(target * search.get("decrease", 0.5), start)
+            if integer:
+                target = int(round(target))
+        return
+    passed_target, broken_target = 0, None
+    for step in range(search.get("steps", 20)):
+        passed = yield target
+        if passed:
+            passed_target = target
+        else:
+            broken_target = target
+        if broken_target is None:
+            if target >= maximum:
+                return
+            target = min(target * 2, maximum)
+        else:
+            gap = broken_target - passed_target
+            if gap <= search.get("precision", 0.05) * broken_target or (
+                integer and gap <= 1
+            ):
+                return
+            target = passed_target + gap / 2
+            if integer:
+                target = passed_target + gap // 2
+            if target < start:
+                return
+
+
+def stage_label(stages, index, unit="users"):
+    """label of a load stage, e.g. stage 2: 200 -> 1000 users in 30s"""
+    previous_target = stages[index - 1][1] if index > 0 else 0
+    duration, target = stages[index]
+    return "stage %d: %g -> %g %s in %gs" % (
+        index + 1,
+        previous_target,
+        target,
+        unit,
+        duration,
+    )
+
+
+def run_users(perf_test, settings):
+    """run concurrent users with the engine in settings in this process, block until all users finish."""
+    engine = settings["engine"]
+    concurrent_users = settings["concurrent_users"]
+    loop_times = settings["loop_times"]
+    test_time = settings["test_time"]
+    ramp_up = settings["ramp_up"]
+    stages = settings["stages"]
+    search = settings["search"]
+    # with stages or a capacity search, the rate starts from 0 and they set it
+    open_model = settings["arrival_rate"] > 0
+    perf_test.arrival_rate = 0 if stages or search else settings["arrival_rate"]
+    perf_test.pool_size = settings["pool_size"]
+    perf_test.keep_alive = settings["keep_alive"]
+    perf_test.phase_timing = settings["phase_timing"]
+    perf_test.warmup_time = settings["warmup_time"]
+    perf_test.warmup_requests = settings["warmup_requests"]
+    perf_test.transcript = settings["transcript"]
+    perf_test.transcript_sample = settings["transcript_sample"]
+    perf_test.scenarios = settings["scenarios"]
+    if settings["corpus"]:
+        # parse and encode all requests once before users start
+        perf_test.corpus = load_corpus(
+            os.path.join(root_path, settings["corpus"]),
+            settings["corpus_check"],
+            settings["keep_alive"],
+        )
+        perf_test.corpus_order = settings["corpus_order"]
+        perf_test.corpus_weights = settings["corpus_weights"]
+    # fail fast on unknown test functions instead of in every user
+    perf_test.scenario_picker("async_" if engine == "asyncio" else "")
+    # scheduling lag of this process, see check_saturation()
+    Thread(target=perf_test.monitor_client, daemon=True).start()
+
+    if engine == "asyncio":
+        # concurrent users as coroutines, block until all users finish.
+        asyncio.run(perf_test.async_run(settings))
+    elif open_model:
+        # open model: concurrent user threads run requests dispatched at arrival rate
+        dispatch_queue = queue.Queue()
+        workers = []
+        for i in range(concurrent_users):
+            thread = Thread(
+                target=perf_test.open_loop_test, args=[dispatch_queue], daemon=True
+            )
+            thread.start()
+            workers.append(thread)
+
+        perf_test.start_timer(test_time)
+        dispatch_thread = Thread(
+            target=perf_test.open_loop_dispatch,
+            args=[dispatch_queue, settings["arrival"], concurrent_users * loop_times],
+            daemon=True,
+        )
+        dispatch_thread.start()
+        if stages:
+
+            def set_rate(target):
+                perf_test.arrival_rate = target
+
+            perf_test.run_stages(stages, set_rate, "requests/s")
+            perf_test.set_event_test_done()
+        elif search:
+            # the user threads and their connections serve every probe rate
+            def set_rate(target):
+                perf_test.arrival_rate = target
+
+            perf_test.run_search(search, set_rate, "requests/s")
+            perf_test.set_event_test_done()
+        # Block until all requests are dispatched or test is done.
+        dispatch_thread.join()
+        for w in workers:
+            dispatch_queue.put(None)
+        for w in workers:
+            w.join()
+    elif stages:
+        # start and stop user threads to follow the load stages
+        workers = []
+        # (thread, stop event) of active users
+        active_users = []
+
+        def set_users(target):
+            target = int(round(target))
+            while len(active_users) < target:
+                stop_event = Event()
+                thread = Thread(
+                    target=perf_test.loop_test,
+                    kwargs={"loop_times": loop_times, "stop_event": stop_event},
+                    daemon=True,
+                )
+                thread.start()
+                workers.append(thread)
+                active_users.append((thread, stop_event))
+            while len(active_users) > target:
+                active_users.pop()[1].set()
+
+        perf_test.start_timer(test_time)
+        perf_test.run_stages(stages, set_users, "users")
+        perf_test.set_event_test_done()
+        for w in workers:
+            w.join()
+    elif search:
+        # park users above the probe target instead of stopping them, so every probe reuses warm connections
+        workers = []
+        run_events = []
+
+        def set_users(target):
+            while len(run_events) < target:
+                run_event = Event()
+                thread = Thread(
+                    target=perf_test.loop_test,
+                    kwargs={"loop_times": loop_times, "run_event": run_event},
+                    daemon=True,
+                )
+                thread.start()
+                workers.append(thread)
+                run_events.append(run_event)
+            for i, run_event in enumerate(run_events):
+                if i < target:
+                    run_event.set()
+                else:
+                    run_event.clear()
+
+        perf_test.start_timer(test_time)
+        perf_test.run_search(search, set_users, "users")
+        perf_test.set_event_test_done()
+        for w in workers:
+            w.join()
+    else:
+        workers = []
+        # start concurrent user threads
+        for i in range(concurrent_users):
+            thread = Thread(
+                target=perf_test.loop_test,
+                kwargs={"loop_times": loop_times},
+                daemon=True,
+            )
+            thread.start()
+            workers.append(thread)
+            # ramp up wait
+            sleep(ramp_up / concurrent_users)
+
+        # start timer
+        perf_test.start_timer(test_time)
+
+        # Block until all threads finish.
+        for w in workers:
+            w.join()
+
+    # stop timer if loop_times is reached first.
+    perf_test.cancel_timer()
+
+
+def process_worker(worker_id, results_queue, settings):
+    """
+    Worker process of the multi-process mode.
 
+    Run this process' share of concurrent users in settings, put (worker_id, ResultStats, stage index) of the
+    results since last report into results_queue every stats interval and when a load stage ends, and
+    (worker_id, None, None) when done. The stage index is of the load stage the results ran in, None if none.
+    """
+    setup_worker_logs(worker_id, (log, log_api))
     perf_test = TestAPI()
+    perf_test.start_time = time.time()
+    report_lock = Lock()
+
+    def report():
+        with report_lock:
+            results_queue.put((worker_id, perf_test.collect_results(), perf_test.stage_index))
+
+    # report the results of a stage when it ends, so the parent counts none of them in the next stage
+    perf_test.stage_end_callback = report
+
+    def report_loop():
+        while not perf_test.event_test_done.wait(settings["stats_interval"]):
+            report()
+
+    report_thread = Thread(target=report_loop, daemon=True)
+    report_thread.start()
+
+    run_users(perf_test, settings)
+
+    perf_test.set_event_test_done()
+    report_thread.join()
+    results = perf_test.collect_results()
+    results.log_records_dropped = log_records_dropped()
+    # worker processes exit without logging.shutdown()
+    for logger in (log, log_api):
+        for handler in logger.handlers:
+            handler.flush()
+    results_queue.put((worker_id, results, None))
+    results_queue.put((worker_id, None, None))
+
+
+def share_settings(settings, users):
+    """settings of a worker process or agent running users of concurrent users, with its share of the load"""
+    concurrent_users = settings["concurrent_users"]
+    worker_settings = dict(settings)
+    worker_settings["concurrent_users"] = users
+    worker_settings["arrival_rate"] = settings["arrival_rate"] * users / concurrent_users
+    worker_settings["warmup_requests"] = math.ceil(
+        settings["warmup_requests"] * users / concurrent_users
+    )
+    # stage targets are users or arrival rate, which are shared the same way
+    worker_settings["stages"] = [
+        (duration, target * users / concurrent_users)
+        for duration, target in settings["stages"]
+    ]
+    return worker_settings
+
+
+def split_users(concurrent_users, workers):
+    """users of each worker to spread concurrent users evenly, without workers of 0 users"""
+    shares = [
+        concurrent_users // workers + (1 if i < concurrent_users % workers else 0)
+        for i in range(workers)
+    ]
+    return [users for users in shares if users > 0]
+
+
+def merge_worker_results(perf_test, settings, results_queue, workers, workers_alive):
+    """
+    Merge partial results of workers from results_queue into perf_test and print stats every stats interval,
+    until all workers say done with (worker_id, None, None), or workers_alive() is False. Partial results are
+    also merged into the results of the load stage the worker tagged them with, see process_worker().
+
+    Used by both multi-process mode and distributed mode.
+    """
+    stats_interval = settings["stats_interval"]
+    stages = settings["stages"]
+    stage_unit = "requests/s" if settings["arrival_rate"] > 0 else "users"
+    # results of each load stage by stage index
+    stage_results = {}
+    running = workers
+    start = time.time()
+    next_stats_time = start + stats_interval
+    while running > 0:
+        try:
+            worker_id, partial, stage = results_queue.get(
+                timeout=max(min(next_stats_time - time.time(), 0.1), 0.01)
+            )
+        except queue.Empty:
+            # stop waiting if workers died without saying done
+            if not workers_alive() and results_queue.empty():
+                log.error("merge_worker_results: workers exited unexpectedly.")
+                break
+        else:
+            if partial is None:
+                running -= 1
+            else:
+                perf_test.merge_results(partial, worker_id)
+                if isinstance(stage, int) and 0 <= stage < len(stages):
+                    if stage not in stage_results:
+                        stage_results[stage] = ResultStats()
+                    stage_results[stage].merge(partial)
+                    # stats are labeled with the latest stage of any worker
+                    if stage == max(stage_results):
+                        perf_test.current_stage = stage_label(stages, stage, stage_unit)
+
+        if time.time() >= next_stats_time:
+            perf_test.print_stats()
+            next_stats_time += stats_interval
+
+    perf_test.current_stage = None
+    # the last stage run may be cut short by the end of the test
+    elapsed = time.time() - start
+    stage_start = 0
+    for index, (duration, target) in enumerate(stages):
+        if index in stage_results:
+            perf_test.stage_results.append(
+                (
+                    stage_label(stages, index, stage_unit),
+                    max(min(duration, elapsed - stage_start), 0),
+                    stage_results[index],
+                )
+            )
+        stage_start += duration
+
+
+def run_processes(perf_test, settings):
+    """
+    Spread concurrent users and arrival rate in settings over worker processes, block until all workers finish.
+
+    Partial results from the workers are merged into perf_test, which prints stats every stats interval.
+    """
+    results_queue = multiprocessing.Queue()
     workers = []
+    for i, users in enumerate(
+        split_users(settings["concurrent_users"], settings["processes"])
+    ):
+        p = multiprocessing.Process(
+            target=process_worker,
+            args=(i + 1, results_queue, share_settings(settings, users)),
+            daemon=True,
+        )
+        p.start()
+        workers.append(p)
+
+    merge_worker_results(
+        perf_test,
+        settings,
+        results_queue,
+        len(workers),
+        lambda: any(p.is_alive() for p in workers),
+    )
+    for p in workers:
+        p.join()
+
+
+def send_message(writer, message):
+    """send a message dict as a JSON line on the control channel"""
+    writer.write(json.dumps(message) + "\n")
+    writer.flush()
+
+
+def receive_message(reader):
+    """receive a message dict as a JSON line from the control channel, None if the connection is closed"""
+    line = reader.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class AgentResultsQueue:
+    """results queue of an agent, which sends results put by process_worker to the controller"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = Lock()
+
+    def put(self, item):
+        worker_id, partial, stage = item
+        if partial is None:
+            message = {"type": "done"}
+        else:
+            message = {"type": "results", "results": partial.to_dict(), "stage": stage}
+        with self.lock:
+            try:
+                send_message(self.writer, message)
+            except OSError as ex:
+                log.error("Agent failed to send results: %s" % str(ex))
+
+
+# settings a controller may send to agents, with their types, see check_agent_settings()
+AGENT_SETTINGS = {
+    "concurrent_users": int,
+    "loop_times": int,
+    "test_time": numbers.Real,
+    "stats_interval": numbers.Real,
+    "ramp_up": numbers.Real,
+    "engine": str,
+    "processes": int,
+    "percentiles": list,
+    "arrival_rate": numbers.Real,
+    "arrival": str,
+    "stages": list,
+    "search": dict,
+    "pool_size": int,
+    "keep_alive": bool,
+    "phase_timing": bool,
+    "warmup_time": numbers.Real,
+    "warmup_requests": int,
+    "saturation": dict,
+    "agents": list,
+    "timeseries_file": str,
+    "report_file": str,
+    "metrics_port": int,
+    "metrics_host": str,
+    "scenarios": list,
+    "corpus": str,
+    "corpus_order": str,
+    "corpus_weights": dict,
+    "corpus_check": str,
+    "transcript": str,
+    "transcript_sample": int,
+    "summary_file": str,
+    "baseline_file": str,
+    "tolerances": dict,
+    "significance": numbers.Real,
+}
+
+
+def check_agent_settings(settings):
+    """
+    Raise ValueError unless settings sent by a controller are safe for an agent to run: known settings of
+    the expected types, scenarios of test functions of TestAPI, and a corpus folder under the root path.
+    """
+    if not isinstance(settings, dict):
+        raise ValueError("Invalid settings: %r" % settings)
+    unknown = set(settings) - set(AGENT_SETTINGS)
+    missing = set(AGENT_SETTINGS) - set(settings)
+    if unknown or missing:
+        raise ValueError(
+            "Invalid settings, unknown: %s, missing: %s" % (sorted(unknown), sorted(missing))
+        )
+    for key, value_type in AGENT_SETTINGS.items():
+        if not isinstance(settings[key], value_type):
+            raise ValueError("Invalid setting %s: %r" % (key, settings[key]))
+    if settings["processes"] != 0 or settings["agents"]:
+        raise ValueError("Agents run in their own process, without processes or agents.")
+    if settings["engine"] not in ("thread", "asyncio"):
+        raise ValueError("Invalid engine: %s" % settings["engine"])
+    for scenario in settings["scenarios"]:
+        if (
+            not isinstance(scenario, list)
+            or len(scenario) != 2
+            or not isinstance(scenario[0], str)
+            or not scenario[0].startswith("test_")
+            or scenario[0] == "test_corpus_request"
+            or not isinstance(scenario[1], numbers.Real)
+        ):
+            raise ValueError("Invalid scenario: %r" % (scenario,))
+    if settings["corpus"]:
+        # expects of the corpus are next to it, so its parent must be under the root path as well
+        root = os.path.realpath(root_path)
+        corpus_root = os.path.realpath(os.path.join(root_path, settings["corpus"]))
+        if corpus_root == root or os.path.commonpath([root, corpus_root]) != root:
+            raise ValueError("Corpus must be a folder under %s: %s" % (root, settings["corpus"]))
+
+
+def run_agent(address, token):
+    """
+    Run as an agent of distributed mode, which listens on address "[host:]port", localhost if no host, and runs
+    the scenarios of controllers one by one. Controllers must send the same token, and settings which pass
+    check_agent_settings().
+
+    Control channel messages (JSON lines):
+    controller -> agent: {"type": "scenario", "agent_id": 1, "token": "...", "settings": {...}}
+    agent -> controller: {"type": "ready"}, or {"type": "error", "error": "..."} if the scenario is refused
+    controller -> agent: {"type": "start"}
+    agent -> controller: {"type": "results", "results": ResultStats.to_dict(), "stage": index or null} every
+                         stats interval and when a load stage ends
+    agent -> controller: {"type": "done"}, or {"type": "error", "error": "..."} if the scenario failed
+    """
+    if not token:
+        raise ValueError("Agents require a token: set PERF_AGENT_TOKEN or --agent-token.")
+    host, _, port = address.rpartition(":")
+    host = host or "127.0.0.1"
+    # socket.create_server requires Python 3.8
+    server = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    if os.name != "nt":  # restart on the port of a closed agent, as create_server does
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, int(port)))
+    server.listen()
+    print("Agent listening on %s:%s." % (host, port))
+    while True:
+        conn, peer = server.accept()
+        print("Controller connected from %s:%s." % peer)
+        with conn:
+            reader = conn.makefile("r")
+            writer = conn.makefile("w")
+            try:
+                scenario = receive_message(reader)
+                if not isinstance(scenario, dict) or scenario.get("type") != "scenario":
+                    continue
+                if not hmac.compare_digest(str(scenario.get("token", "")), token):
+                    send_message(writer, {"type": "error", "error": "Invalid token."})
+                    log.error("Agent refused controller %s:%s: invalid token." % peer)
+                    continue
+                check_agent_settings(scenario.get("settings"))
+                agent_id = int(scenario["agent_id"])
+                send_message(writer, {"type": "ready"})
+                start = receive_message(reader)
+                if start is None or start["type"] != "start":
+                    continue
+                print("Tests started at %s." % time.asctime())
+                process_worker(
+                    agent_id,
+                    AgentResultsQueue(writer),
+                    scenario["settings"],
+                )
+                print("Tests ended at %s." % time.asctime())
+            except Exception as ex:
+                # a failed scenario must not stop the agent serving the next controller
+                log.error("Agent failed with controller %s:%s: %r" % (peer + (ex,)))
+                print("Agent failed with controller %s:%s: %r" % (peer + (ex,)))
+                try:
+                    send_message(writer, {"type": "error", "error": str(ex)})
+                except OSError:
+                    pass
+            finally:
+                # the socket is closed once its files are closed as well
+                reader.close()
+                writer.close()
+
+
+def run_agents(perf_test, settings, token):
+    """
+    Run as the controller of distributed mode, which spreads concurrent users and arrival rate in settings
+    over agents, starts them at the same moment and merges their results into perf_test, which prints stats
+    every stats interval. Block until all agents finish. token is the secret token of the agents.
+    """
+    results_queue = queue.Queue()
+    agents = []
+    for i, users in enumerate(
+        split_users(settings["concurrent_users"], len(settings["agents"]))
+    ):
+        host, port = settings["agents"][i].rsplit(":", 1)
+        conn = socket.create_connection((host, int(port)))
+        reader = conn.makefile("r")
+        writer = conn.makefile("w")
+        agent_settings = share_settings(settings, users)
+        # agents run their users in their own process
+        agent_settings["processes"] = 0
+        agent_settings["agents"] = []
+        send_message(
+            writer,
+            {"type": "scenario", "agent_id": i + 1, "token": token, "settings": agent_settings},
+        )
+        agents.append((i + 1, conn, reader, writer))
+
+    # wait for all agents to be ready, then start all at once
+    for agent_id, conn, reader, writer in agents:
+        ready = receive_message(reader)
+        if ready is None or ready["type"] != "ready":
+            raise ConnectionError("Agent %s is not ready: %s" % (agent_id, ready))
+    for agent_id, conn, reader, writer in agents:
+        send_message(writer, {"type": "start"})
+    perf_test.start_time = time.time()
+
+    def receive_results(agent_id, reader):
+        while True:
+            try:
+                message = receive_message(reader)
+            except (OSError, ValueError) as ex:
+                log.error("Controller failed to receive from agent %s: %s" % (agent_id, ex))
+                message = None
+            if message is None:
+                log.error("Agent %s disconnected before done." % agent_id)
+                break
+            if message["type"] == "error":
+                log.error("Agent %s failed: %s" % (agent_id, message["error"]))
+                break
+            if message["type"] == "done":
+                results_queue.put((agent_id, None, None))
+                break
+            results_queue.put(
+                (agent_id, ResultStats.from_dict(message["results"]), message.get("stage"))
+            )
+
+    receivers = []
+    for agent_id, conn, reader, writer in agents:
+        receiver = Thread(target=receive_results, args=(agent_id, reader), daemon=True)
+        receiver.start()
+        receivers.append(receiver)
+
+    merge_worker_results(
+        perf_test,
+        settings,
+        results_queue,
+        len(agents),
+        lambda: any(r.is_alive() for r in receivers),
+    )
+    for agent_id, conn, reader, writer in agents:
+        conn.close()
+
+
+def main(**overrides):
+    """
+    Run the performance test with the settings below, changed by overrides, e.g. main(concurrent_users=5)
+    from another script. Return the exit status, 1 on a regression against the baseline or if a capacity
+    search found no sustainable load.
+    """
+    ### Test Settings ###
+    settings = {
+        # closed model: concurrent users loop tests. open model: max requests in flight
+        "concurrent_users": 10,
+        # test stops whenever loop_times or test_time is met first.
+        # loop_times is per user, i.e. concurrent_users * loop_times requests in total for open model.
+        "loop_times": 30,
+        "test_time": 3600,  # time in seconds, e.g. 36000
+        "stats_interval": 2,
+        "ramp_up": 0,  # total time in secs to ramp up. default 0, no wait
+        "engine": "thread",  # thread or asyncio
+        # worker processes to spread concurrent users over, e.g. os.cpu_count(). 0 - run all users in this process
+        "processes": 0,
+        # time per request percentiles to print in stats
+        "percentiles": [50, 90, 95, 99, 99.9],
+        # open model: requests per second regardless of response times. 0 - closed model
+        "arrival_rate": 0,
+        "arrival": "fixed",  # fixed or poisson intervals between arrivals for open model
+        # load stages [(duration secs, target users or arrival rate for open model), ...] change the load
+        # linearly from the previous target to the stage target, e.g. ramp to 200 users in 60s, hold 10 minutes,
+        # spike to 1000 and recover: [(60, 200), (600, 200), (5, 1000), (25, 1000), (5, 200), (60, 200)].
+        # Test ends after the last stage unless loop_times or test_time is met first. [] - no stages
+        "stages": [],
+        # capacity search: raise the users, or the arrival rate for open model, probe by probe until the SLO is
+        # broken, then report the highest sustainable throughput and the knee. {} - no search. e.g.
+        # {"algorithm": "binary", "percentile": 99, "latency": 0.5, "error_rate": 0.01, "start": 10, "max": 2000,
+        #  "step_time": 10, "settle_time": 1, "precision": 0.05, "steps": 20}
+        # "aimd" algorithm instead: "increase": 10 after a pass, "decrease": 0.5 after a break.
+        # Runs in this process only, so processes must be 0 and agents []. Exits with status 1 if no probe meets
+        # the SLO.
+        "search": {},
+        # keep-alive connection pool size of each user's session, 1 is enough as a user sends one request at a time
+        "pool_size": 1,
+        # False - force a new connection per request, e.g. to measure connection setup
+        "keep_alive": True,
+        # True - time connect (with DNS), TLS, send, TTFB and download phases of each request, see request_phases
+        "phase_timing": False,
+        # warm-up period excluded from statistics: first warmup_time seconds and first warmup_requests requests,
+        # e.g. to leave out cold connections and server caches. Both must be met. 0, 0 - no warm-up
+        "warmup_time": 0,
+        "warmup_requests": 0,
+        # load generator saturation thresholds to warn that response times may be client-bound: process CPU in
+        # cores (a GIL bound process cannot use much more than 1), scheduling lag in seconds of threads or the
+        # event loop, and backlog of open model requests waiting for a free user, per concurrent user
+        "saturation": {"cpu": 0.9, "lag": 0.05, "backlog": 1},
+        # distributed mode: agents ["host:port", ...] started by: python perf_test_rest_api.py --agent port
+        # Run as the controller of the agents if any. [] - run in this process or worker processes
+        "agents": [],
+        # time series file under Logs, a record per stats interval, .csv or .jsonl format. "" - no time series
+        "timeseries_file": "timeseries.jsonl",
+        # self-contained HTML report under Logs built from a .jsonl timeseries_file at the end of the test.
+        # Also: python perf_test_rest_api.py --report Logs/timeseries.jsonl report.html. "" - no report
+        "report_file": "perf_report.html",
+        # port to serve live metrics in OpenMetrics format at /metrics, e.g. 9100. 0 - no metrics endpoint
+        "metrics_port": 0,
+        # address to serve metrics on, e.g. "0.0.0.0" for a Prometheus server on another host
+        "metrics_host": "127.0.0.1",
+        # scenario mix: [test function name of TestAPI, relative weight], e.g. 75% reads and 25% writes:
+        # [["test_mock_service", 75], ["test_post_headers_body_json", 25]]
+        # The asyncio engine runs async_<name> test functions, of which only async_test_mock_service exists, so
+        # the scenarios of the asyncio engine can only be [["test_mock_service", 1]] unless more are added.
+        "scenarios": [["test_mock_service", 1]],
+        # folder of functional test cases under the root path to replay instead of scenarios, e.g. "inputs".
+        # "" - run scenarios. Each agent replays the corpus on its own host.
+        "corpus": "",
+        # "round_robin" - every request in turn, "sequence" - requests of each test case in order,
+        # "weighted" - random requests by corpus_weights of test cases, e.g. {"test_case_01": 3}, 1 by default
+        "corpus_order": "round_robin",
+        "corpus_weights": {},
+        # "status" - check 2xx status code, "expects" - also check expected values in expects except ignored keys
+        "corpus_check": "status",
+        # API requests and responses to log: "full", "sample" - 1 in transcript_sample, "failures" - of failed
+        # or exception tests only, "off". Pretty printing costs more CPU than a request at high RPS.
+        "transcript": "full",
+        "transcript_sample": 100,
+        # summary file under Logs of throughput, time per request and error rate, totals and per scenario.
+        # "" - no summary
+        "summary_file": "summary.json",
+        # baseline summary file to compare this run with, e.g. a copy of summary.json of a good run. Exits with
+        # status 1 on a regression beyond tolerances which is statistically significant at the significance level.
+        # Also: python perf_test_rest_api.py --compare baseline.json summary.json. "" - no comparison
+        "baseline_file": "",
+        "tolerances": DEFAULT_TOLERANCES,
+        "significance": 0.05,
+    }
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise ValueError("Unknown settings: %s" % sorted(unknown))
+    settings.update(overrides)
+
+    # secret token of the agents, the same as PERF_AGENT_TOKEN or --agent-token of the agents. Not a setting,
+    # so it is neither sent to agents as one nor written to the summary file
+    agent_token = os.environ.get("PERF_AGENT_TOKEN", "")
+
+    perf_test = TestAPI(settings["percentiles"])
+    # to report the warm-up of worker processes and agents as well
+    perf_test.warmup_time = settings["warmup_time"]
+    perf_test.warmup_requests = settings["warmup_requests"]
+    perf_test.saturation = settings["saturation"]
+    if settings["timeseries_file"]:
+        perf_test.exporter = TimeSeriesExporter(
+            os.path.join(root_path, "Logs", settings["timeseries_file"]),
+            settings["percentiles"],
+        )
+    metrics_server = None
+    if settings["metrics_port"]:
+        metrics_server = perf_test.start_metrics_server(
+            settings["metrics_port"], settings["metrics_host"]
+        )
     start_time = time.time()
     perf_test.start_time = start_time
     print("Tests started at %s." % time.asctime())
 
-    # start stats thread
-    stats_thread = Thread(
-        target=perf_test.loop_stats, args=[stats_interval], daemon=True
-    )
-    stats_thread.start()
-
-    # start concurrent user threads
-    for i in range(concurrent_users):
-        thread = Thread(
-            target=perf_test.loop_test, kwargs={"loop_times": loop_times}, daemon=True
+    if settings["search"] and (settings["agents"] or settings["processes"] > 0):
+        raise ValueError("Capacity search runs in this process only, without processes or agents.")
+
+    if settings["agents"]:
+        # agents report to this controller, which prints stats
+        run_agents(perf_test, settings, agent_token)
+    elif settings["processes"] > 0:
+        # worker processes report to this process, which prints stats
+        run_processes(perf_test, settings)
+    else:
+        # start stats thread
+        stats_thread = Thread(
+            target=perf_test.loop_stats, args=[settings["stats_interval"]], daemon=True
         )
-        thread.start()
-        workers.append(thread)
-        # ramp up wait
-        sleep(ramp_up / concurrent_users)
+        stats_thread.start()
 
-    # start timer
-    perf_test.start_timer(test_time)
+        run_users(perf_test, settings)
 
-    # Block until all threads finish.
-    for w in workers:
-        w.join()
+        # stop stats thread before the last statistics
+        perf_test.set_event_test_done()
+        stats_thread.join()
 
     # clean up
-    # stop timer if loop_times is reached first.
-    perf_test.cancel_timer()
-
     end_time = time.time()
     perf_test.end_time = end_time
 
     # Ensure to execute the last statistics:
     perf_test.stats()
+    perf_test.print_stage_stats()
+    search_passed = perf_test.print_search_stats(
+        "requests/s" if settings["arrival_rate"] > 0 else "users"
+    )
+    if perf_test.exporter is not None:
+        perf_test.exporter.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if settings["report_file"] and settings["timeseries_file"].endswith(".jsonl"):
+        write_html_report(
+            os.path.join(root_path, "Logs", settings["timeseries_file"]),
+            os.path.join(root_path, "Logs", settings["report_file"]),
+        )
+    summary_file = os.path.join(root_path, "Logs", settings["summary_file"])
+    if settings["summary_file"]:
+        perf_test.write_summary(summary_file, settings)
 
     print(
         "\nTests ended at %s.\nTotal test time: %.2f seconds."
         % (time.asctime(), end_time - start_time)
     )
+    print(
+        "Log records dropped: %s (LOG_QUEUE_FULL = %s)."
+        % (perf_test.results.log_records_dropped + log_records_dropped(), LOG_QUEUE_FULL)
+    )
+    exit_code = 0
+    if search_passed is False:
+        exit_code = 1
+    if settings["baseline_file"] and settings["summary_file"]:
+        exit_code = max(
+            exit_code,
+            compare_summary_files(
+                os.path.join(root_path, "Logs", settings["baseline_file"]),
+                summary_file,
+                settings["tolerances"],
+                settings["significance"],
+            ),
+        )
+    return exit_code
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="REST API performance test")
+    parser.add_argument(
+        "--agent",
+        metavar="[HOST:]PORT",
+        help="run as an agent of distributed mode, listening for a controller on this address, "
+        "localhost if no host",
+    )
+    parser.add_argument(
+        "--agent-token",
+        default=os.environ.get("PERF_AGENT_TOKEN", ""),
+        help="secret token controllers must send to the agent, default: PERF_AGENT_TOKEN environment variable",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two summary files without running a test, exit status 1 on a regression",
+    )
+    parser.add_argument(
+        "--report",
+        nargs=2,
+        metavar=("TIMESERIES", "REPORT"),
+        help="write a self-contained HTML report of a .jsonl time series without running a test",
+    )
+    parser.add_argument(
+        "--tolerances",
+        type=json.loads,
+        default=DEFAULT_TOLERANCES,
+        help='tolerances of --compare as JSON, default: %s' % json.dumps(DEFAULT_TOLERANCES),
+    )
+    parser.add_argument(
+        "--significance",
+        type=float,
+        default=0.05,
+        help="significance level of --compare, default: 0.05",
+    )
+    args = parser.parse_args()
+    if args.agent:
+        run_agent(args.agent, args.agent_token)
+    elif args.report:
+        write_html_report(*args.report)
+    elif args.compare:
+        sys.exit(compare_summary_files(*args.compare, args.tolerances, args.significance))
+    else:
+        sys.exit(main())
@@ -0,0 +1,481 @@
+"""
+Description:
+Utilities shared by test_rest_api.py and perf_test_rest_api.py
+
+The log handler, worker log files, connection counting and request phase timing of both scripts, and parsing
+of the request files of inputs and the ini format of outputs and expects, so functional tests and corpus
+replays read the test cases the same way.
+
+No logging setup or other side effects at import. Logs go to the debug logger "log" of the importing script.
+"""
+import logging
+import re
+import queue
+import time
+import contextvars
+from functools import lru_cache
+from os import path
+from threading import Thread, Lock, local
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+log = logging.getLogger("log")
+
+
+class QueueFileHandler(logging.Handler):
+    """
+    Log handler which hands records to a background thread that writes them to log_file in batches,
+    so threads logging API requests and responses do not wait for the file lock or disk I/O.
+
+    The queue holds at most queue_size records. When it is full, records are dropped and counted
+    if queue_full is "drop", or the logging thread waits for room if queue_full is "block".
+    """
+
+    def __init__(
+        self,
+        log_file,
+        queue_size=10000,
+        queue_full="drop",
+        batch_size=500,
+        flush_interval=0.5,
+    ):
+        if queue_full not in ("drop", "block"):
+            raise ValueError("queue_full must be drop or block: %s" % queue_full)
+        # created first, so logging.shutdown() at exit closes this handler before the file handler
+        self.file_handler = logging.FileHandler(log_file, mode="w")  # default mode is append
+        super().__init__()
+        self.queue = queue.Queue(queue_size)
+        self.block = queue_full == "block"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.writer = Thread(target=self.write_records, daemon=True)
+        self.writer.start()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.file_handler.setFormatter(fmt)
+
+    def emit(self, record):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_records(self):
+        """write queued records in batches with one flush per batch, until None is queued"""
+        stream = self.file_handler.stream
+        done = False
+        while not done:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            lines = []
+            for record in batch:
+                try:
+                    lines.append(self.file_handler.format(record) + "\n")
+                except Exception:
+                    self.handleError(record)
+            stream.write("".join(lines))
+            stream.flush()
+            for _ in range(len(batch) + done):
+                self.queue.task_done()
+
+    def flush(self):
+        """wait until queued records are written"""
+        if self.writer.is_alive():
+            self.queue.join()
+
+    def close(self):
+        """write the remaining records and close the file"""
+        # the writer thread does not exist in a forked child process, e.g. a worker before setup_worker_logs()
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+        if self.dropped and self.file_handler.stream is not None:
+            self.file_handler.stream.write(
+                "%s log records dropped as the log queue was full.\n" % self.dropped
+            )
+        self.file_handler.close()
+        super().close()
+
+
+def setup_worker_logs(worker_id, loggers):
+    """
+    Log to separate files per worker process, e.g. Logs/debug_1.log, so processes do not write to the same
+    file. The QueueFileHandler of each of loggers is replaced by one with the same settings for its file.
+    """
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+            handler.close()
+            if isinstance(handler, QueueFileHandler):
+                base, ext = path.splitext(handler.file_handler.baseFilename)
+                worker_handler = QueueFileHandler(
+                    "%s_%s%s" % (base, worker_id, ext),
+                    handler.queue.maxsize,
+                    "block" if handler.block else "drop",
+                    handler.batch_size,
+                    handler.flush_interval,
+                )
+                worker_handler.setFormatter(handler.formatter)
+                logger.addHandler(worker_handler)
+
+
+def queue_records_dropped(loggers):
+    """number of log records dropped by the full log queues of loggers in this process, see QueueFileHandler"""
+    return sum(
+        handler.dropped
+        for logger in loggers
+        for handler in logger.handlers
+        if isinstance(handler, QueueFileHandler)
+    )
+
+
+# request phases in seconds, see PHASES, of the current request of the current thread or asyncio task while
+# phase timing is on, i.e. a dict set by the caller, None if off
+request_phases = contextvars.ContextVar("request_phases", default=None)
+
+# connect includes DNS
+PHASES = ("connect", "tls", "send", "ttfb", "download")
+
+
+def add_phase(name, seconds):
+    """add seconds to a phase of the current request"""
+    phases = request_phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0) + seconds
+
+
+def end_phases():
+    """end timing the phases of the current request, i.e. the body is downloaded"""
+    phases = request_phases.get()
+    if phases is not None and "headers_at" in phases:
+        phases["download"] = time.perf_counter() - phases.pop("headers_at")
+
+
+class PhaseTimingMixin:
+    """urllib3 connection mixin which times the phases of requests, see request_phases"""
+
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        add_phase("connect", time.perf_counter() - start)
+        return sock
+
+    def request(self, *args, **kwargs):
+        phases = request_phases.get() or {}
+        setup = phases.get("connect", 0) + phases.get("tls", 0)
+        start = time.perf_counter()
+        result = super().request(*args, **kwargs)
+        # an HTTP connection may connect when sending the request
+        setup = phases.get("connect", 0) + phases.get("tls", 0) - setup
+        add_phase("send", time.perf_counter() - start - setup)
+        return result
+
+    def getresponse(self, *args, **kwargs):
+        start = time.perf_counter()
+        response = super().getresponse(*args, **kwargs)
+        add_phase("ttfb", time.perf_counter() - start)
+        phases = request_phases.get()
+        if phases is not None:
+            phases["headers_at"] = time.perf_counter()
+        return response
+
+
+class HTTPSPhaseTimingMixin(PhaseTimingMixin):
+    """PhaseTimingMixin of urllib3 HTTPS connections, which also times the TLS handshake"""
+
+    def connect(self):
+        phases = request_phases.get() or {}
+        connect = phases.get("connect", 0)
+        start = time.perf_counter()
+        super().connect()
+        add_phase("tls", time.perf_counter() - start - (phases.get("connect", 0) - connect))
+
+
+class ConnectionCounter:
+    """
+    Counts of the connections of the pools of a CountingHTTPAdapter in counts, guarded by lock: connections
+    opened, requests sent, connections discarded by a full pool and the peak of connections in use of a pool.
+    """
+
+    def __init__(self):
+        self.counts = {"opened": 0, "requests": 0, "discarded": 0, "peak_in_use": 0}
+        self.lock = Lock()
+
+    def count(self, name):
+        """count a connection event, i.e. opened, requests or discarded"""
+        with self.lock:
+            self.counts[name] += 1
+
+    def get_conn(self, pool):
+        """a connection is taken from pool for a request"""
+        with self.lock:
+            pool.in_use += 1
+            self.counts["peak_in_use"] = max(self.counts["peak_in_use"], pool.in_use)
+
+    def put_conn(self, pool, conn):
+        """a connection is returned to pool after a request, conn is None if it was closed"""
+        with self.lock:
+            pool.in_use -= 1
+        # a full pool closes the connection instead of keeping it alive
+        if conn is not None and pool.pool is not None and pool.pool.full():
+            self.count("discarded")
+
+
+class ThreadConnectionCounter(ConnectionCounter):
+    """
+    Counts of the connections opened and requests sent by the current thread, i.e. concurrent user, in the
+    attributes of counts, a threading.local, so threads count without a lock. Pools are not counted.
+    """
+
+    def __init__(self):
+        self.counts = local()
+
+    def count(self, name):
+        setattr(self.counts, name, getattr(self.counts, name, 0) + 1)
+
+    def get_conn(self, pool):
+        pass
+
+    def put_conn(self, pool, conn):
+        pass
+
+
+class CountingConnectionMixin:
+    """urllib3 connection mixin which counts new connections and requests sent by counter"""
+
+    counter = None
+
+    def connect(self):
+        super().connect()
+        self.counter.count("opened")
+
+    def request(self, *args, **kwargs):
+        self.counter.count("requests")
+        return super().request(*args, **kwargs)
+
+
+class CountingPoolMixin:
+    """urllib3 connection pool mixin which counts connections in use and discarded by counter"""
+
+    counter = None
+    in_use = 0
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        self.counter.get_conn(self)
+        return conn
+
+    def _put_conn(self, conn):
+        self.counter.put_conn(self, conn)
+        super()._put_conn(conn)
+
+
+@lru_cache(maxsize=None)
+def counting_pool_classes(counter, time_phases):
+    """
+    urllib3 connection pool classes by scheme whose connections are counted by counter, see ConnectionCounter,
+    and time the phases of requests if time_phases, see request_phases
+    """
+    pool_classes = {}
+    for scheme, pool_class, connection_class, timing_mixin in (
+        ("http", HTTPConnectionPool, HTTPConnection, PhaseTimingMixin),
+        ("https", HTTPSConnectionPool, HTTPSConnection, HTTPSPhaseTimingMixin),
+    ):
+        mixins = (timing_mixin, CountingConnectionMixin) if time_phases else (CountingConnectionMixin,)
+        name = ("Timing" if time_phases else "Counting") + connection_class.__name__
+        connection_class = type(name, mixins + (connection_class,), {"counter": counter})
+        pool_classes[scheme] = type(
+            name + "Pool",
+            (CountingPoolMixin, pool_class),
+            {"ConnectionCls": connection_class, "counter": counter},
+        )
+    return pool_classes
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    requests transport adapter whose connection pools count connections by counter, see ConnectionCounter,
+    and time the phases of requests if time_phases, see request_phases.
+    """
+
+    def __init__(self, counter, *args, time_phases=False, **kwargs):
+        # before HTTPAdapter.__init__, which calls init_poolmanager
+        self.counter = counter
+        self.time_phases = time_phases
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = counting_pool_classes(self.counter, self.time_phases)
+
+
+def parse_test_input(file: str):
+    """Parse request test input
+
+    file: file path
+    Return: method, url, headers, body
+
+    Sample Input:
+    POST http://httpbin.org/post
+
+    User-Agent: Python Requests
+    Content-Type: application/json
+
+    {
+        "key1": 1,
+        "key2": "value2"
+    }
+    """
+    if not path.isfile(file):
+        log.error("parse_test_input: Invalid file: %s" % file)
+        raise FileNotFoundError(file)
+
+    # initialize default
+    headers = {}
+    body = None
+
+    with open(file, "r") as f:
+        content = f.read()
+        # 3 parts split by empty line (\n\n) with possible whitespace in between \n\n.
+        # Note: With \n\n, re.split will support \r\n\r\n implicitly for windows files as well
+        parts = re.split(r"\s*\n\s*\n", content)
+        parts_len = len(parts)
+
+        # part 1: Method and url
+        assert len(parts[0].split()) == 2
+        method, url = parts[0].split()
+        method, url = method.strip(), url.strip()
+
+        # part 2: headers or body if no specific headers
+        if parts_len > 1 and parts[1].strip() != "":
+            header_lines = re.split(r"\s*\n", parts[1].strip())
+            header_lines = [line.strip() for line in header_lines]  # strip line spaces
+            # if it is headers
+            #   condition: header_key: value
+            #   and avoid false json body condition: {"key": "value"}
+            #       there could be other false positive conditions but don't want to complicate things.
+            header_line_1_elements = re.split(r":\s*", header_lines[0])
+            header_line_1_elements = [e.strip() for e in header_line_1_elements]
+            if len(header_line_1_elements) == 2 and not header_line_1_elements[0].startswith('{'):
+                headers = dict([re.split(r":\s*", line) for line in header_lines])
+            # no headers, part 2 is body
+            else:
+                body = parts[1].strip()
+
+        # part 3: body
+        if parts_len > 2 and parts[2].strip() != "" and body is None:
+            body = parts[2].strip()
+
+    return method, url, headers, body
+
+
+def iter_ini_lines(dict_var):
+    """
+    Generate the unsorted 'key1.key2[i] = value' lines of a dict, see dict_to_ini of test_rest_api.py. The dict is walked with a
+    stack of iterators instead of recursion, so deeply nested dicts do not hit the recursion limit.
+    """
+    assert isinstance(dict_var, dict)
+    # (prefix, iterator of (key or index, value), True if a list)
+    stack = [(None, iter(dict_var.items()), False)]
+    while stack:
+        prefix, items, is_list = stack[-1]
+        item = next(items, None)
+        if item is None:
+            stack.pop()
+            continue
+        k, var = item
+        if is_list:
+            new_prefix = "%s[%d]" % (prefix, k)  # e.g. scores[0]
+        elif prefix is None:
+            new_prefix = k  # e.g. age
+        else:
+            new_prefix = prefix + "." + k  # e.g. name.firstname
+        if isinstance(var, dict):
+            stack.append((new_prefix, iter(var.items()), False))
+        elif isinstance(var, list):
+            stack.append((new_prefix, enumerate(var), True))
+        else:
+            # for multiple line string, i.e. with \n, convert to 1 line repr string
+            if isinstance(var, str) and "\n" in var:
+                var = repr(var)
+            yield "%s = %s" % (new_prefix, var)
+
+
+def ini_to_dict(input):
+    """Covert a ini file to a simple dict
+
+    Example Input (file or content string)
+    -------------
+    age = 30
+    name.firstname = Peter
+    scores[0] = 100
+
+    Example Output dict
+    --------------
+    {
+    "age": "30",
+    "name.firstname" : "Peter",
+    "scores[0]" : "100"
+    }
+    """
+    if path.isfile(input):
+        with open(input) as f:
+            content = f.read()
+    else:
+        return {}
+
+    return ini_lines_to_dict(content.split("\n"))
+
+
+def ini_lines_to_dict(lines):
+    """simple dict of ini lines, see ini_to_dict"""
+    ret_dict = {}
+    for line in lines:
+        if " = " in line:
+            key, value = line.split(" = ", maxsplit=1)
+            key, value = key.strip(), value.strip()
+            ret_dict[key] = value
+    return ret_dict
+
+
+def flatten_dict(dict_var):
+    """
+    Flatten a dict in memory to the simple dict which ini_to_dict reads from the file of dict_to_ini, e.g. to
+    compare a response with expects without the file round trip.
+    """
+    lines = list(iter_ini_lines(dict_var))
+    flat = ini_lines_to_dict(lines)
+    if len(flat) < len(lines) or any("\n" in line or "\r" in line for line in lines):
+        # keys which are duplicate once stripped, or contain " = " or new lines: read them as the sorted file,
+        # whose \r\n and \r are read as \n
+        content = "\n".join(sorted(lines)).replace("\r\n", "\n").replace("\r", "\n")
+        flat = ini_lines_to_dict(content.split("\n"))
+    return flat
+
+
+def parse_ignore_file(file):
+    """Parse ignore file and return a list of ignored keys"""
+    ignore_keys = []
+    if path.isfile(file):
+        with open(file) as f:
+            for line in f:
+                if line.strip != "":
+                    ignore_keys.append(line.strip())
+
+    return ignore_keys
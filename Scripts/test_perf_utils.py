@@ -0,0 +1,710 @@
+"""
+Tests of perf_test_rest_api.py which need no API to test: how users count failed tests, what a test run
+writes to its files, and the mergeable results of users, worker processes and agents.
+
+Run:
+pytest test_perf_utils.py
+"""
+import datetime
+import json
+import os
+import pickle
+import queue
+import time
+from random import Random
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+import perf_test_rest_api as perf
+
+
+class StatusAdapter(BaseAdapter):
+    """requests transport adapter which answers every request with status and body, without a server"""
+
+    def __init__(self, status, body=b'{"code": 1}'):
+        super().__init__()
+        self.status = status
+        self.body = body
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = self.body
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=0.01)
+        return response
+
+    def close(self):
+        pass
+
+
+def new_perf_test(status, scenario="test_mock_service"):
+    """TestAPI of one scenario whose session, i.e. of the calling thread, answers every request with status"""
+    perf_test = perf.TestAPI([50, 99])
+    perf_test.transcript = "off"
+    perf_test.scenarios = [(scenario, 1)]
+    session = requests.Session()
+    session.mount("http://", StatusAdapter(status))
+    session.mount("https://", StatusAdapter(status))
+    perf_test.local.session = session
+    return perf_test
+
+
+def counts(results):
+    """(tested, pass, fail, exception) requests of results"""
+    return (
+        results.total_tested_requests,
+        results.total_pass_requests,
+        results.total_fail_requests,
+        results.total_exception_requests,
+    )
+
+
+class TestFailedRequests:
+    """
+    Test that users count 5xx responses as failed tests, and exceptions of tests as exception results.
+    """
+
+    def test_closed_loop_5xx(self):
+        perf_test = new_perf_test(503)
+        perf_test.loop_test(loop_times=5)
+        results = perf_test.collect_results()
+        assert counts(results) == (5, 0, 5, 0)
+        assert results.errors == {"503": 5}
+        assert counts(results.scenarios["test_mock_service"]) == (5, 0, 5, 0)
+
+    def test_open_loop_5xx(self):
+        perf_test = new_perf_test(500, "test_post_headers_body_json")
+        dispatch_queue = queue.Queue()
+        for _ in range(4):
+            dispatch_queue.put(time.perf_counter())
+        dispatch_queue.put(None)
+        perf_test.open_loop_test(dispatch_queue)
+        results = perf_test.collect_results()
+        assert counts(results) == (4, 0, 4, 0)
+        assert results.errors == {"500": 4}
+
+    def test_pass(self):
+        perf_test = new_perf_test(200)
+        perf_test.loop_test(loop_times=3)
+        results = perf_test.collect_results()
+        assert counts(results) == (3, 3, 0, 0)
+        assert results.errors == {}
+
+    def test_exception_does_not_end_user(self):
+        perf_test = new_perf_test(200)
+        calls = []
+
+        def broken_test():
+            calls.append(1)
+            raise ValueError("broken test")
+
+        perf_test.test_mock_service = broken_test
+        perf_test.loop_test(loop_times=3)
+        results = perf_test.collect_results()
+        assert len(calls) == 3
+        assert counts(results) == (3, 0, 0, 3)
+        assert results.errors == {"exception": 3}
+
+
+class TestOutputFiles:
+    """
+    Test the files main() writes under Logs.
+    """
+
+    def test_summary_without_agent_token(self, tmp_path, monkeypatch):
+        os.makedirs(str(tmp_path / "Logs"))
+        monkeypatch.setattr(perf, "root_path", str(tmp_path))
+        monkeypatch.setenv("PERF_AGENT_TOKEN", "s3cret-agent-token")
+        session = requests.Session()
+        session.mount("http://", StatusAdapter(200))
+        monkeypatch.setattr(perf.TestAPI, "session", property(lambda self: session))
+        assert perf.main() == 0
+        with open(str(tmp_path / "Logs" / "summary.json")) as f:
+            text = f.read()
+        assert json.loads(text)["total"]["requests"] == 300
+        assert "s3cret-agent-token" not in text
+        assert "agent_token" not in text
+
+
+def passed_results(count, elapsed_time=0.1):
+    """ResultStats of count pass requests of elapsed_time each"""
+    results = perf.ResultStats()
+    for _ in range(count):
+        results.add("pass", elapsed_time)
+    return results
+
+
+class TestWorkerResults:
+    """
+    Test merge_worker_results(), which merges the partial results of worker processes and agents.
+    """
+
+    def test_merge_per_stage(self):
+        perf_test = perf.TestAPI([50])
+        settings = {"stats_interval": 60, "stages": [(1, 2), (1, 2)], "arrival_rate": 0}
+        results_queue = queue.Queue()
+        # worker 2 is already in stage 2 while worker 1 reports stage 1, and results after the last stage
+        for message in [
+            (1, passed_results(2), 0),
+            (2, passed_results(3), 1),
+            (1, passed_results(1), 0),
+            (1, passed_results(4), None),
+            (1, None, None),
+            (2, None, None),
+        ]:
+            results_queue.put(message)
+        perf.merge_worker_results(perf_test, settings, results_queue, 2, lambda: True)
+        assert perf_test.results.total_tested_requests == 10
+        assert [(label, results.total_tested_requests) for label, _, results in perf_test.stage_results] == [
+            ("stage 1: 0 -> 2 users in 1s", 3),
+            ("stage 2: 2 -> 2 users in 1s", 3),
+        ]
+        assert perf_test.current_stage is None
+
+
+def mixed_results(elapsed_times, fails=0, exceptions=0, scenario="test_mock_service"):
+    """ResultStats of a pass request per elapsed time, fails 503 and exceptions, all of scenario"""
+    results = perf.ResultStats()
+    for elapsed_time in elapsed_times:
+        results.add("pass", elapsed_time, scenario, 200)
+    for _ in range(fails):
+        results.add("fail", 0.5, scenario, 503)
+    for _ in range(exceptions):
+        results.add("exception", None, scenario)
+    return results
+
+
+def assert_same_results(actual, expected, rel=0):
+    """
+    assert results have the same counts and histograms, min and max within rel, e.g. bucket precision, and the
+    same scenarios except empty ones, which a subtraction leaves
+    """
+    assert counts(actual) == counts(expected)
+    assert actual.histogram.counts == expected.histogram.counts
+    assert actual.errors == expected.errors
+    assert actual.sum_response_time == pytest.approx(expected.sum_response_time)
+    assert actual.sum_squares_response_time == pytest.approx(expected.sum_squares_response_time)
+    assert actual.tpr_min == pytest.approx(expected.tpr_min, rel=rel)
+    assert actual.tpr_max == pytest.approx(expected.tpr_max, rel=rel)
+    scenarios = [name for name, results in actual.scenarios.items() if results.total_tested_requests]
+    assert sorted(scenarios) == sorted(expected.scenarios)
+    for scenario, results in expected.scenarios.items():
+        assert_same_results(actual.scenarios[scenario], results, rel)
+
+
+class TestLatencyHistogram:
+    """
+    Test LatencyHistogram against latencies of known percentiles.
+    """
+
+    def test_exact_buckets(self):
+        histogram = perf.LatencyHistogram()
+        for microseconds in range(1, 101):
+            histogram.record(microseconds / 1000000)
+        assert histogram.total_count == 100
+        assert histogram.percentile(50) == 0.00005
+        assert histogram.percentile(99) == 0.000099
+        assert histogram.percentile(100) == 0.0001
+        assert (histogram.min(), histogram.max()) == (0.000001, 0.0001)
+        assert histogram.count_le(0.00002) == 20
+
+    @pytest.mark.parametrize(
+        "percent, expected",
+        [
+            # highest value of the bucket of the n-th of 1, 2, ... 100 ms, e.g. 50 ms in [49.664, 50.175] ms
+            (0, 0.001007),
+            (1, 0.001007),
+            (50, 0.050175),
+            (90, 0.090111),
+            (99, 0.099327),
+            (100, 0.100351),
+        ],
+    )
+    def test_percentile(self, percent, expected):
+        histogram = perf.LatencyHistogram()
+        for milliseconds in range(100, 0, -1):
+            histogram.record(milliseconds / 1000)
+        assert histogram.percentile(percent) == expected
+        # within the relative error of 2 / sub_bucket_count
+        assert abs(expected - max(percent, 1) / 1000) <= 2 / 128 * expected
+
+    def test_empty(self):
+        histogram = perf.LatencyHistogram()
+        assert histogram.percentile(99) == 0
+        assert (histogram.min(), histogram.max(), histogram.count_le(1)) == (0, 0, 0)
+
+    def test_clamp_to_max(self):
+        histogram = perf.LatencyHistogram(max_seconds=1)
+        histogram.record(5)
+        assert histogram.percentile(100) == pytest.approx(1, rel=2 / 128)
+
+    def test_merge_and_subtract(self):
+        first, second, both = (perf.LatencyHistogram() for _ in range(3))
+        for milliseconds in range(1, 61):
+            (first if milliseconds <= 20 else second).record(milliseconds / 1000)
+            both.record(milliseconds / 1000)
+        merged = perf.LatencyHistogram()
+        merged.merge(first)
+        merged.merge(second)
+        assert merged.counts == both.counts and merged.total_count == 60
+        assert merged.percentile(50) == both.percentile(50)
+        difference = merged.subtract(first)
+        assert difference.counts == second.counts and difference.total_count == 40
+        # subtract returns a new histogram
+        assert merged.total_count == 60
+
+    def test_dict_and_pickle(self):
+        histogram = perf.LatencyHistogram()
+        for milliseconds in (1, 2, 2, 300, 4000):
+            histogram.record(milliseconds / 1000)
+        for copy in (
+            perf.LatencyHistogram.from_dict(json.loads(json.dumps(histogram.to_dict()))),
+            pickle.loads(pickle.dumps(histogram)),
+        ):
+            assert copy.counts == histogram.counts
+            assert copy.total_count == 5
+            assert copy.percentile(80) == histogram.percentile(80)
+
+
+class TestResultStats:
+    """
+    Test that ResultStats merge, subtract and copy through to_dict and from_dict without losing results.
+    """
+
+    def test_counts(self):
+        results = mixed_results([0.25, 0.5, 0.125], fails=2, exceptions=1)
+        assert counts(results) == (6, 3, 2, 1)
+        assert results.errors == {"503": 2, "exception": 1}
+        assert (results.sum_response_time, results.sum_squares_response_time) == (0.875, 0.328125)
+        assert (results.tpr_min, results.tpr_max) == (0.125, 0.5)
+        assert counts(results.scenarios["test_mock_service"]) == (6, 3, 2, 1)
+
+    def test_merge_same_as_add(self):
+        first = mixed_results([0.25, 0.5], fails=1)
+        second = mixed_results([0.125], exceptions=2, scenario="test_post_headers_body_json")
+        second.merge(mixed_results([0.75], fails=1))
+        merged = perf.ResultStats()
+        merged.merge(first)
+        merged.merge(second)
+        expected = mixed_results([0.25, 0.5, 0.75], fails=2)
+        expected.merge(mixed_results([0.125], exceptions=2, scenario="test_post_headers_body_json"))
+        assert_same_results(merged, expected)
+        assert counts(merged) == (8, 4, 2, 2)
+
+    def test_subtract_earlier_merge(self):
+        cumulative = mixed_results([0.25, 0.5], fails=1)
+        earlier = perf.ResultStats()
+        earlier.merge(cumulative)
+        cumulative.merge(mixed_results([0.125, 1.5], exceptions=1))
+        interval = cumulative.subtract(earlier)
+        assert counts(interval) == (3, 2, 0, 1)
+        assert interval.errors == {"exception": 1}
+        assert interval.sum_response_time == 1.625
+        # min and max of the difference are within bucket precision
+        assert interval.tpr_min == pytest.approx(0.125, rel=2 / 128)
+        assert interval.tpr_max == pytest.approx(1.5, rel=2 / 128)
+
+    def test_merge_then_subtract_is_identity(self):
+        random = Random(0)
+        for _ in range(50):
+            results = mixed_results(
+                [random.uniform(0.001, 2) for _ in range(random.randint(1, 30))],
+                fails=random.randint(0, 3),
+                exceptions=random.randint(0, 3),
+            )
+            other = mixed_results(
+                [random.uniform(0.001, 2) for _ in range(random.randint(0, 30))],
+                fails=random.randint(0, 3),
+                scenario=random.choice(["test_mock_service", "test_post_headers_body_json"]),
+            )
+            merged = perf.ResultStats()
+            merged.merge(results)
+            merged.merge(other)
+            assert_same_results(merged.subtract(other), results, rel=2 / 128)
+
+    def test_dict_round_trip(self):
+        results = mixed_results([0.25, 0.5, 0.125], fails=2, exceptions=1)
+        results.add("pass", 0.01, "test_mock_service", 200, warmup=True)
+        results.add_phases({"connect": 0.001, "ttfb": 0.2, "download": 0.01})
+        copy = perf.ResultStats.from_dict(json.loads(json.dumps(results.to_dict())))
+        assert_same_results(copy, results)
+        assert counts(copy.warmup) == (1, 1, 0, 0)
+        assert copy.phase_histograms["ttfb"].counts == results.phase_histograms["ttfb"].counts
+        assert copy.phase_sums == results.phase_sums
+        assert copy.to_dict() == results.to_dict()
+
+    def test_worker_results(self):
+        """results of workers reach the parent through pickle, and of agents through JSON"""
+        workers = [
+            mixed_results([0.25, 0.5], fails=1),
+            mixed_results([0.125], exceptions=1),
+            mixed_results([1.5, 0.75, 0.25]),
+        ]
+        workers[2].active_users = 3
+        results_queue = queue.Queue()
+        for worker_id, results in enumerate(workers, 1):
+            if worker_id == 3:
+                results = perf.ResultStats.from_dict(json.loads(json.dumps(results.to_dict())))
+            else:
+                results = pickle.loads(pickle.dumps(results))
+            results_queue.put((worker_id, results, None))
+            results_queue.put((worker_id, None, None))
+        perf_test = perf.TestAPI([50])
+        settings = {"stats_interval": 60, "stages": [], "arrival_rate": 0}
+        perf.merge_worker_results(perf_test, settings, results_queue, len(workers), lambda: True)
+        expected = perf.ResultStats()
+        for results in workers:
+            expected.merge(results)
+        assert_same_results(perf_test.results, expected)
+        assert counts(perf_test.results) == (8, 6, 1, 1)
+        assert perf_test.results.active_users == 3
+        assert perf_test.stage_results == []
+
+
+class TestLoadProfiles:
+    """
+    Test the targets of load stages and the probes of capacity searches.
+    """
+
+    stages = [(10, 100), (20, 100), (5, 0)]
+
+    @pytest.mark.parametrize(
+        "elapsed, expected",
+        [
+            # ramp up from 0
+            (0, (0, 0)),
+            (5, (0, 50)),
+            # hold
+            (10, (1, 100)),
+            (29.5, (1, 100)),
+            # ramp down
+            (30, (2, 100)),
+            (32.5, (2, 50)),
+            # after the last stage
+            (35, (None, 0)),
+            (100, (None, 0)),
+        ],
+    )
+    def test_stage_target(self, elapsed, expected):
+        assert perf.stage_target(self.stages, elapsed) == expected
+
+    @pytest.mark.parametrize(
+        "stages, elapsed, expected",
+        [
+            ([], 0, (None, 0)),
+            # a stage of no duration jumps to its target
+            ([(0, 50), (10, 100)], 0, (1, 50)),
+            ([(10, 100), (10, 20)], 15, (1, 60)),
+        ],
+    )
+    def test_stage_target_edges(self, stages, elapsed, expected):
+        assert perf.stage_target(stages, elapsed) == expected
+
+    def test_stage_label(self):
+        assert perf.stage_label(self.stages, 0) == "stage 1: 0 -> 100 users in 10s"
+        assert perf.stage_label(self.stages, 2, "requests/s") == "stage 3: 100 -> 0 requests/s in 5s"
+
+    @staticmethod
+    def run_probes(search, capacity, integer=True):
+        """probe targets of a search of a system which meets the SLO up to capacity"""
+        probes = perf.search_probes(search, integer)
+        targets = [next(probes)]
+        try:
+            while True:
+                targets.append(probes.send(targets[-1] <= capacity))
+        except StopIteration:
+            return targets
+
+    @pytest.mark.parametrize(
+        "search, capacity, integer, expected",
+        [
+            # double until broken, then bisect within precision
+            ({"start": 10, "max": 2000}, 75, True, [10, 20, 40, 80, 60, 70, 75, 77]),
+            ({"start": 10, "max": 2000}, 33.3, False, [10, 20, 40, 30, 35, 32.5, 33.75]),
+            # stop at max, or when start is already broken
+            ({"start": 10, "max": 50}, 1000, True, [10, 20, 40, 50]),
+            ({"start": 10, "max": 2000}, 5, True, [10]),
+            # steps limit the probes
+            ({"start": 10, "max": 2000, "steps": 3}, 75, True, [10, 20, 40]),
+            # additive increase after a pass, multiplicative decrease after a break, not below start
+            (
+                {"algorithm": "aimd", "start": 10, "increase": 10, "steps": 8},
+                35,
+                True,
+                [10, 20, 30, 40, 20, 30, 40, 20],
+            ),
+            (
+                {"algorithm": "aimd", "start": 10, "increase": 10, "decrease": 0.2, "steps": 4},
+                5,
+                True,
+                [10, 10, 10, 10],
+            ),
+            (
+                {"algorithm": "aimd", "start": 4, "increase": 3, "decrease": 0.5, "steps": 5},
+                9,
+                False,
+                [4, 7, 10, 5, 8],
+            ),
+        ],
+    )
+    def test_search_probes(self, search, capacity, integer, expected):
+        assert self.run_probes(search, capacity, integer) == expected
+
+
+class TestUserResults:
+    """
+    Test that the results of users which ended are folded into the retired results.
+    """
+
+    def test_retired_users(self):
+        perf_test = new_perf_test(200)
+        perf_test.loop_test(loop_times=3)
+        assert perf_test.user_results == []
+        assert counts(perf_test.collect_results()) == (3, 3, 0, 0)
+        perf_test.loop_test(loop_times=2)
+        assert perf_test.user_results == []
+        assert counts(perf_test.retired_results) == (5, 5, 0, 0)
+        # collections after retirement count each request once
+        assert counts(perf_test.collect_results()) == (2, 2, 0, 0)
+        assert counts(perf_test.snapshot_results()) == (5, 5, 0, 0)
+        assert perf_test.retired_results.active_users == 0
+
+
+class TestStatistics:
+    """
+    Test the significance tests of the baseline comparison against reference values, e.g. of scipy.stats.
+    """
+
+    @pytest.mark.parametrize(
+        "a, b, x, expected",
+        [
+            (2, 2, 0.5, 0.5),
+            (1, 1, 0.3, 0.3),
+            (3, 1, 0.5, 0.125),
+            (2, 3, 0.3, 0.3483),
+            (0.5, 0.5, 0, 0),
+            (0.5, 0.5, 1, 1),
+        ],
+    )
+    def test_betainc(self, a, b, x, expected):
+        assert perf.betainc(a, b, x) == pytest.approx(expected, abs=1e-9)
+
+    @pytest.mark.parametrize(
+        "t, df, expected",
+        [
+            (0, 10, 0.5),
+            (2, 10, 0.036694),
+            (-2, 10, 0.963306),
+            (1, 1, 0.25),
+            (2, 2, 0.091752),
+            (2.228, 10, 0.025),
+            (5 ** 0.5, 18, 0.019125),
+        ],
+    )
+    def test_student_t_sf(self, t, df, expected):
+        assert perf.student_t_sf(t, df) == pytest.approx(expected, abs=1e-5)
+
+    def test_normal_sf(self):
+        assert perf.normal_sf(0) == 0.5
+        assert perf.normal_sf(1.96) == pytest.approx(0.024998, abs=1e-6)
+
+    @pytest.mark.parametrize(
+        "samples, expected",
+        [
+            # t = 2.236, 18 degrees of freedom
+            ((10, 0, 1, 10, 1, 1), 0.019125),
+            ((10, 1, 1, 10, 0, 1), 0.980875),
+            ((10, 1, 1, 10, 1, 1), 0.5),
+            # zero variance: any increase is significant, none is not
+            ((10, 1, 0, 10, 1.5, 0), 0),
+            ((10, 1, 0, 10, 1, 0), 1),
+            # too small samples
+            ((1, 0, 0, 10, 1, 1), 1),
+            ((10, 0, 1, 0, 0, 0), 1),
+        ],
+    )
+    def test_welch_t_test(self, samples, expected):
+        assert perf.welch_t_test(*samples) == pytest.approx(expected, abs=1e-5)
+
+    @pytest.mark.parametrize(
+        "errors1, count1, errors2, count2, expected",
+        [
+            # z = 2.558
+            (10, 1000, 25, 1000, 0.0052647),
+            (25, 1000, 10, 1000, 0.9947353),
+            (10, 1000, 10, 1000, 0.5),
+            # no errors or all errors in both runs, or no requests
+            (0, 1000, 0, 1000, 1),
+            (1000, 1000, 1000, 1000, 1),
+            (0, 0, 5, 10, 1),
+            (0, 10, 0, 0, 1),
+        ],
+    )
+    def test_two_proportion_z_test(self, errors1, count1, errors2, count2, expected):
+        assert perf.two_proportion_z_test(errors1, count1, errors2, count2) == pytest.approx(
+            expected, abs=1e-6
+        )
+
+    @pytest.mark.parametrize(
+        "count1, duration1, count2, duration2, expected",
+        [
+            # z = 2.294
+            (1000, 10, 900, 10, 0.010891),
+            (900, 10, 1000, 10, 0.989109),
+            (1000, 10, 2000, 20, 0.5),
+            # no requests or no duration
+            (0, 10, 0, 10, 1),
+            (1000, 0, 900, 10, 1),
+            (1000, 10, 900, 0, 1),
+        ],
+    )
+    def test_poisson_rate_test(self, count1, duration1, count2, duration2, expected):
+        assert perf.poisson_rate_test(count1, duration1, count2, duration2) == pytest.approx(
+            expected, abs=1e-6
+        )
+
+
+def run_summary(elapsed_times, fails=0, duration=10):
+    """summary of a run of the scenario test_mock_service, as write_summary() writes it"""
+    results = mixed_results(elapsed_times, fails=fails)
+    return {
+        "total": perf.results_summary(results, duration, [50, 99]),
+        "scenarios": {
+            scenario: perf.results_summary(scenario_results, duration, [50, 99])
+            for scenario, scenario_results in results.scenarios.items()
+        },
+    }
+
+
+class TestCompareSummaries:
+    """
+    Test compare_summaries() and compare_summary_files() of runs with known differences.
+    """
+
+    baseline = run_summary([0.09, 0.11] * 100)
+
+    def test_same_run(self):
+        assert perf.compare_summaries(self.baseline, self.baseline, perf.DEFAULT_TOLERANCES) == []
+
+    def test_slower(self):
+        current = run_summary([0.13, 0.15] * 100)
+        assert perf.compare_summaries(self.baseline, current, perf.DEFAULT_TOLERANCES) == [
+            "total mean",
+            "total p99",
+            "test_mock_service mean",
+            "test_mock_service p99",
+        ]
+
+    def test_lower_throughput_and_errors(self):
+        current = run_summary([0.09, 0.11] * 50, fails=100)
+        assert perf.compare_summaries(self.baseline, current, perf.DEFAULT_TOLERANCES) == [
+            "total rps",
+            "total error_rate",
+            "test_mock_service rps",
+            "test_mock_service error_rate",
+        ]
+
+    def test_worse_not_significant(self, capsys):
+        baseline = run_summary([0.1, 0.2, 0.3], duration=1)
+        current = run_summary([0.15, 0.25, 0.3], duration=1)
+        assert perf.compare_summaries(baseline, current, {"mean": 0.1}) == []
+        assert "worse, not significant" in capsys.readouterr().out
+
+    def test_zero_counts(self):
+        empty = run_summary([])
+        assert empty["total"]["requests"] == 0 and empty["scenarios"] == {}
+        assert perf.compare_summaries(empty, empty, perf.DEFAULT_TOLERANCES) == []
+        # a run without requests has no throughput, which is significant against a busy baseline
+        assert perf.compare_summaries(self.baseline, empty, perf.DEFAULT_TOLERANCES) == [
+            "total rps",
+            "test_mock_service missing",
+        ]
+
+    def test_zero_variance(self):
+        baseline = run_summary([0.1] * 100)
+        # zero but for the rounding of the sum of squares
+        assert baseline["total"]["variance"] == pytest.approx(0, abs=1e-12)
+        assert perf.compare_summaries(baseline, run_summary([0.1] * 100), {"mean": 0.1}) == []
+        assert perf.compare_summaries(baseline, run_summary([0.12] * 100), {"mean": 0.1}) == [
+            "total mean",
+            "test_mock_service mean",
+        ]
+
+    def test_exit_code(self, tmp_path):
+        baseline_file, current_file = str(tmp_path / "baseline.json"), str(tmp_path / "summary.json")
+        with open(baseline_file, "w") as f:
+            json.dump(self.baseline, f)
+        with open(current_file, "w") as f:
+            json.dump(self.baseline, f)
+        assert perf.compare_summary_files(baseline_file, current_file, perf.DEFAULT_TOLERANCES) == 0
+        with open(current_file, "w") as f:
+            json.dump(run_summary([0.13, 0.15] * 100), f)
+        assert perf.compare_summary_files(baseline_file, current_file, perf.DEFAULT_TOLERANCES) == 1
+
+
+class TestSearchGate:
+    """
+    Test the SLO gate of capacity search probes and the exit code of main() when no probe meets the SLO.
+    """
+
+    search = {"latency": 0.5, "percentile": 99, "error_rate": 0.1}
+
+    def gate(self, results, duration=10):
+        perf_test = perf.TestAPI([50, 99])
+        perf_test.stage_results = [("probe", duration, results)]
+        return perf_test.record_probe(10, self.search)
+
+    @pytest.mark.parametrize(
+        "results, expected",
+        [
+            (mixed_results([0.1] * 90, fails=10), True),
+            (mixed_results([0.1] * 90, fails=5, exceptions=6), False),
+            (mixed_results([0.1] * 98 + [0.9] * 2), False),
+            (mixed_results([0.1] * 99 + [0.9]), True),
+            (mixed_results([]), False),
+            (mixed_results([], fails=3), False),
+        ],
+    )
+    def test_record_probe(self, results, expected):
+        assert self.gate(results) is expected
+
+    def test_no_duration(self):
+        perf_test = perf.TestAPI([50, 99])
+        perf_test.stage_results = [("probe", 0, mixed_results([0.1]))]
+        assert perf_test.record_probe(10, self.search) is None
+        assert perf_test.search_results == []
+
+    def test_print_search_stats(self, capsys):
+        perf_test = perf.TestAPI([50, 99])
+        assert perf_test.print_search_stats() is None
+        perf_test.search_results = [(1, 10, mixed_results([0.1], fails=9), False)]
+        assert perf_test.print_search_stats() is False
+        assert "No probe met the SLO." in capsys.readouterr().out
+        perf_test.search_results.insert(0, (1, 10, mixed_results([0.1] * 10), True))
+        assert perf_test.print_search_stats() is True
+
+    def run_main(self, tmp_path, monkeypatch, status):
+        os.makedirs(str(tmp_path / "Logs"))
+        monkeypatch.setattr(perf, "root_path", str(tmp_path))
+        session = requests.Session()
+        session.mount("http://", StatusAdapter(status))
+        monkeypatch.setattr(perf.TestAPI, "session", property(lambda self: session))
+        return perf.main(
+            search={"latency": 0.5, "start": 1, "max": 2, "step_time": 0.2, "settle_time": 0.05},
+            loop_times=10 ** 9,
+            timeseries_file="",
+            report_file="",
+            transcript="off",
+        )
+
+    def test_exit_code_slo_broken(self, tmp_path, monkeypatch):
+        assert self.run_main(tmp_path, monkeypatch, 503) == 1
+
+    def test_exit_code_slo_met(self, tmp_path, monkeypatch):
+        assert self.run_main(tmp_path, monkeypatch, 200) == 0
+
+    def test_unknown_setting(self):
+        with pytest.raises(ValueError, match="search_time"):
+            perf.main(search_time=10)
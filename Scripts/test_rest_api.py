@@ -8,6 +8,7 @@ pip install -r requirements.txt
 
 Run:
 pytest
+Set PARALLEL_WORKERS to run input/output test cases in a worker pool, e.g. for a corpus of thousands of cases.
 
 Python version: 3.6 or above
 
@@ -31,10 +32,59 @@ from dotmap import DotMap
 import re
 import pytest
 import shutil
+from threading import Lock, local
+from http.cookiejar import DefaultCookiePolicy
+import time
+import tempfile
+import heapq
+import pickle
+from itertools import islice
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from rest_api_utils import (
+    QueueFileHandler,
+    setup_worker_logs,
+    queue_records_dropped,
+    request_phases,
+    PHASES,
+    end_phases,
+    ConnectionCounter,
+    CountingHTTPAdapter,
+    parse_test_input,
+    iter_ini_lines,
+    ini_to_dict,
+    ini_lines_to_dict,
+    flatten_dict,
+    parse_ignore_file,
+)
 import pdb
 
 ### Settings ###
 LOG_LEVEL = logging.INFO  # DEBUG, INFO, WARNING, ERROR, CRITICAL
+# Log records are written by a background thread. When its queue of LOG_QUEUE_SIZE records is full,
+# "drop" - drop and count records, which never slows down tests, "block" - wait to keep all records.
+LOG_QUEUE_SIZE = 10000
+LOG_QUEUE_FULL = "drop"
+# True - time connect (with DNS), TLS, send, TTFB and download phases of each request, logged per request
+# and summarized with percentiles at the end of the tests
+PHASE_TIMING = False
+# Run input/output test cases in a pool of PARALLEL_WORKERS workers before their tests report the results,
+# e.g. os.cpu_count(). 0 - run each test case in its own test one by one.
+# PARALLEL_POOL: "thread" for API bound test cases, or "process" to use more cores for big responses.
+PARALLEL_WORKERS = 0
+PARALLEL_POOL = "thread"
+# Requests of all tests share keep-alive connection pools: POOL_HOSTS hosts cached, and up to POOL_SIZE idle
+# connections kept per host, which should be at least the threads calling a host at once, e.g. PARALLEL_WORKERS.
+POOL_HOSTS = 10
+POOL_SIZE = 10
+# threads to send the independent requests of a test case at once, see request_dependencies()
+CASE_WORKERS = 8
+# Responses are compared with the expects in memory. True - also write outputs/ and diff/ files in the
+# background for debugging, e.g. to copy outputs to expects, False - skip them.
+WRITE_OUTPUTS = True
+# outputs/ files of responses up to INI_SORT_LINES lines are sorted in memory, bigger ones in temporary files
+INI_SORT_LINES = 100000
 
 if sys.version_info < (3, 8):
     raise SystemError("Requires Python 3.8 or above.")
@@ -52,7 +102,8 @@ common_formatter = logging.Formatter(
 # Note: To create multiple log files, must use different logger name.
 def setup_logger(log_file, level=logging.INFO, name="", formatter=common_formatter):
     """Function setup as many loggers as you want."""
-    handler = logging.FileHandler(log_file, mode="w")  # default mode is append
+    # write in a background thread, see QueueFileHandler
+    handler = QueueFileHandler(log_file, LOG_QUEUE_SIZE, LOG_QUEUE_FULL)
     # Or use a rotating file handler
     # handler = RotatingFileHandler(log_file,maxBytes=1024, backupCount=5)
     handler.setFormatter(formatter)
@@ -86,11 +137,165 @@ if path.isdir(input_root):
             test_case_list.append(tc)
 test_case_list.sort()
 
-# clear up old diff and output files
 diff_root = path.join(root_path, "diff")
 output_root = path.join(root_path, "outputs")
-shutil.rmtree(diff_root, ignore_errors=True)
-shutil.rmtree(output_root, ignore_errors=True)
+
+
+def setup_output_dirs():
+    """clear up old diff and output files, once per test session, see conftest.py"""
+    shutil.rmtree(diff_root, ignore_errors=True)
+    shutil.rmtree(output_root, ignore_errors=True)
+
+
+# mode of new files, e.g. 0o644, as mkstemp creates files only the owner can read. Read once at import, as
+# os.umask() can only be read by setting it for the whole process.
+file_umask = os.umask(0)
+os.umask(file_umask)
+new_file_mode = 0o666 & ~file_umask
+
+
+def write_file_atomic(file, content):
+    """
+    write content to file through a temporary file in the same folder, so readers never see a partial file.
+    content is a string or an iterable of strings, e.g. a generator to stream a big file.
+    """
+    fd, temp_file = tempfile.mkstemp(dir=path.dirname(file), prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "w") as f:
+            if isinstance(content, str):
+                f.write(content)
+            else:
+                f.writelines(content)
+        os.chmod(temp_file, new_file_mode)
+        os.replace(temp_file, file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+def worker_logs(worker_counter):
+    """initializer of the worker processes of the pool: log to files per worker, see setup_worker_logs()"""
+    with worker_counter.get_lock():
+        worker_counter.value += 1
+        worker_id = worker_counter.value
+    setup_worker_logs(worker_id, (log, log_api))
+
+
+# log records dropped by worker processes of the pool, see log_records_dropped()
+worker_log_records_dropped = 0
+
+
+def log_records_dropped():
+    """
+    number of log records dropped by full log queues of this process and the worker processes of the pool,
+    see QueueFileHandler, reported at the end of the tests by conftest.py
+    """
+    return worker_log_records_dropped + queue_records_dropped((log, log_api))
+
+# phases of all requests of the tests if PHASE_TIMING, summarized by teardown_module(), see request_phases
+phase_samples = []
+
+
+# connections opened, requests sent, connections discarded by a full pool and peak connections in use
+# of all threads, see connection_stats()
+connection_counter = ConnectionCounter()
+connection_counts = connection_counter.counts
+connection_counts_lock = connection_counter.lock
+
+
+# keep-alive connection pools shared by the requests sessions of all threads, see shared_session()
+http_adapter = None
+thread_sessions = local()
+
+
+def reset_connection_pools():
+    """new connection pools and sessions, e.g. in a forked worker process, which must not use the parent's sockets"""
+    global http_adapter, thread_sessions
+    http_adapter = CountingHTTPAdapter(
+        connection_counter,
+        pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE, time_phases=PHASE_TIMING
+    )
+    thread_sessions = local()
+    with connection_counts_lock:
+        for name in connection_counts:
+            connection_counts[name] = 0
+
+
+reset_connection_pools()
+# no fork and no register_at_fork on Windows, where workers are spawned and import this module anew
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_connection_pools)
+
+
+def shared_session():
+    """
+    requests session of the current thread, which reuses keep-alive connections of the shared pools across
+    requests, tests and threads. The urllib3 pools are thread-safe, while sessions are not, so each thread has
+    its own. Cookies are not kept between requests, the same as requests.request().
+    """
+    session = getattr(thread_sessions, "session", None)
+    if session is None:
+        session = thread_sessions.session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.mount("http://", http_adapter)
+        session.mount("https://", http_adapter)
+    return session
+
+
+def connection_stats():
+    """pool sizing and connection reuse statistics of the test session, e.g. to print at the end"""
+    counts = dict(connection_counts)
+    return (
+        "Connections - requests: %s, opened: %s, reused: %s, peak in use: %s per host, "
+        "discarded by full pool: %s (POOL_SIZE = %s, POOL_HOSTS = %s)"
+        % (
+            counts["requests"],
+            counts["opened"],
+            max(counts["requests"] - counts["opened"], 0),
+            counts["peak_in_use"],
+            counts["discarded"],
+            POOL_SIZE,
+            POOL_HOSTS,
+        )
+    )
+
+
+def timed_request(method, url, **kwargs):
+    """request of shared_session() which times the phases of the request, return (response, phases dict)"""
+    phases = {}
+    request_phases.set(phases)
+    try:
+        resp = shared_session().request(method, url, **kwargs)
+        end_phases()
+    finally:
+        request_phases.set(None)
+    return resp, phases
+
+
+def teardown_module():
+    """
+    wait for outputs/ and diff/ files, log connection statistics, and percentiles of request phases of the
+    tests if PHASE_TIMING
+    """
+    flush_debug_files()
+    log.info(connection_stats())
+    if not phase_samples:
+        return
+    log.info("Request phases of %s requests in seconds:" % len(phase_samples))
+    for name in PHASES:
+        values = sorted(phases.get(name, 0) for phases in phase_samples)
+        log.info(
+            "%-8s - mean: %.6f, %s"
+            % (
+                name,
+                sum(values) / len(values),
+                # nearest rank percentiles
+                ", ".join(
+                    "p%g: %.6f" % (p, values[max(int(len(values) * p / 100 + 0.5), 1) - 1])
+                    for p in (50, 90, 99)
+                ),
+            )
+        )
 
 
 def pretty_print_request(request):
@@ -177,86 +382,149 @@ def dict_to_ini(dict_var, file=None):
 
     Note: The output is sorted.
     """
-    ini_content_list = []
-
-    def iterate_dict(var, prefix=None):
-        """iterate dict and convert to a list of 'key1.key2[i] = value' string"""
-        # recursive if dict
-        if isinstance(var, dict):
-            for k, v in var.items():
-                if prefix is None:
-                    new_prefix = k  # e.g. age
-                else:
-                    new_prefix = prefix + "." + k  # e.g. name.firstname
-                iterate_dict(v, new_prefix)
-        elif isinstance(var, list):
-            for index, value in enumerate(var):
-                assert (
-                    prefix is not None
-                )  # Invalid to start from something like iterate_dict([1,2], None)
-                new_prefix = "%s[%d]" % (prefix, index)  # e.g. scores[0]
-                iterate_dict(value, new_prefix)
-        else:
-            # for multiple line string, i.e. with \n, convert to 1 line repr string
-            if isinstance(var, str) and "\n" in var:
-                var = repr(var)
-            this_item = "%s = %s" % (prefix, var)
-            nonlocal ini_content_list
-            ini_content_list.append(this_item)
-
-    assert isinstance(dict_var, dict)
-    iterate_dict(dict_var, None)
-    ini_content_list.sort()
-    ini_content = "\n".join(ini_content_list)
+    ini_content = "\n".join(sorted(iter_ini_lines(dict_var)))
     if file:
-        with open(file, "w") as f:
-            f.write(ini_content)
+        write_file_atomic(file, ini_content)
 
     return ini_content
 
 
-def ini_to_dict(input):
-    """Covert a ini file to a simple dict
+def write_sorted_run(sorted_lines):
+    """write sorted lines to a temporary file in pickled batches of 1000 lines, as lines may have new lines"""
+    run = tempfile.TemporaryFile()
+    for batch in iter(lambda: list(islice(sorted_lines, 1000)), []):
+        pickle.dump(batch, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
 
-    Example Input (file or content string)
-    -------------
-    age = 30
-    name.firstname = Peter
-    scores[0] = 100
 
-    Example Output dict
-    --------------
-    {
-    "age": "30",
-    "name.firstname" : "Peter",
-    "scores[0]" : "100"
-    }
+def read_sorted_run(run):
+    """generate the lines of write_sorted_run"""
+    while True:
+        try:
+            batch = pickle.load(run)
+        except EOFError:
+            return
+        yield from batch
+
+
+def join_lines(lines):
+    """generate "\n".join(lines) in chunks of 1000 lines"""
+    lines = iter(lines)
+    separator = ""
+    for batch in iter(lambda: list(islice(lines, 1000)), []):
+        yield separator + "\n".join(batch)
+        separator = "\n"
+
+
+def write_ini(dict_var, file, run_lines=None, max_runs=64):
     """
-    if path.isfile(input):
-        with open(input) as f:
-            content = f.read()
-    else:
-        return {}
+    Write a dict to an ini file, byte for byte the same as dict_to_ini, with bounded memory for big responses.
+
+    Lines are generated by iter_ini_lines and sorted in memory up to run_lines (INI_SORT_LINES) lines. More
+    lines are sorted in runs of run_lines lines in temporary files, which are merged into the file, and into
+    one run when there are max_runs runs.
+    """
+    run_lines = run_lines or INI_SORT_LINES
+    runs = []
+    try:
+        lines = []
+        for line in iter_ini_lines(dict_var):
+            lines.append(line)
+            if len(lines) >= run_lines:
+                lines.sort()
+                runs.append(write_sorted_run(iter(lines)))
+                lines = []
+                if len(runs) >= max_runs:
+                    merged = write_sorted_run(heapq.merge(*map(read_sorted_run, runs)))
+                    for run in runs:
+                        run.close()
+                    runs = [merged]
+        lines.sort()
+        if runs:
+            lines = heapq.merge(lines, *map(read_sorted_run, runs))
+        write_file_atomic(file, join_lines(lines))
+    finally:
+        for run in runs:
+            run.close()
+
+
+# pre-flattened expects and ignore keys, {(file, parse function): ((mtime, size) or None if no file, result)}
+expected_cache = {}
+expected_cache_lock = Lock()
+
+
+def cached_parse(file, parse):
+    """parse(file) cached until the file changes, e.g. ini_to_dict of an expect file"""
+    try:
+        stat = os.stat(file)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stamp = None
+    with expected_cache_lock:
+        cached = expected_cache.get((file, parse))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    result = parse(file)
+    with expected_cache_lock:
+        expected_cache[(file, parse)] = (stamp, result)
+    return result
+
+
+def parse_ignore_set(file):
+    """ignore keys of parse_ignore_file as a set for fast lookups"""
+    return frozenset(parse_ignore_file(file))
+
+
+# single background thread writing outputs/ and diff/ files for debugging, see WRITE_OUTPUTS
+output_writer = None
+output_writer_lock = Lock()
+
+
+def write_debug_files(output_file_path, resp, diff_file_path, diff):
+    """write a response to outputs/ in ini format, and its diff to diff/ if any"""
+    os.makedirs(path.dirname(output_file_path), exist_ok=True)
+    os.makedirs(path.dirname(diff_file_path), exist_ok=True)
+    write_ini(resp, output_file_path)
+    if diff != "":
+        write_file_atomic(diff_file_path, diff)
+
+
+def log_write_error(future):
+    if future.exception() is not None:
+        log.error("Failed to write output files: %r" % future.exception())
+
+
+def write_debug_files_async(output_file_path, resp, diff_file_path, diff):
+    """queue write_debug_files to the background writer, which flush_debug_files waits for"""
+    global output_writer
+    with output_writer_lock:
+        if output_writer is None:
+            output_writer = ThreadPoolExecutor(1, thread_name_prefix="output_writer")
+        future = output_writer.submit(
+            write_debug_files, output_file_path, resp, diff_file_path, diff
+        )
+    future.add_done_callback(log_write_error)
+
+
+def flush_debug_files():
+    """wait for the queued outputs/ and diff/ files to be written"""
+    global output_writer
+    with output_writer_lock:
+        writer, output_writer = output_writer, None
+    if writer is not None:
+        writer.shutdown(wait=True)
 
-    ret_dict = {}
-    for line in content.split("\n"):
-        if " = " in line:
-            key, value = line.split(" = ", maxsplit=1)
-            key, value = key.strip(), value.strip()
-            ret_dict[key] = value
-    return ret_dict
 
+def reset_output_writer():
+    """drop the writer of the parent in a forked worker process, whose thread does not exist there"""
+    global output_writer, output_writer_lock
+    output_writer = None
+    output_writer_lock = Lock()
 
-def parse_ignore_file(file):
-    """Parse ignore file and return a list of ignored keys"""
-    ignore_keys = []
-    if path.isfile(file):
-        with open(file) as f:
-            for line in f:
-                if line.strip != "":
-                    ignore_keys.append(line.strip())
 
-    return ignore_keys
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_output_writer)
 
 
 def diff_simple_dict(expected, actual, ignore=[], output_file=None):
@@ -290,70 +558,210 @@ def diff_simple_dict(expected, actual, ignore=[], output_file=None):
 
     diff = "\n".join(diff_list)
     if output_file and diff != "":
-        with open(output_file, "w") as f:
-            f.write(diff)
+        write_file_atomic(output_file, diff)
 
     return diff
 
 
-def parse_test_input(file: str):
-    """Parse request test input
-
-    file: file path
-    Return: method, url, headers, body
-
-    Sample Input:
-    POST http://httpbin.org/post
+def request_dependencies(testcase_full_dir, request_files):
+    """
+    Return {request file: set of request files it waits for} of the sorted request files of a test case.
+
+    By default each request waits for the one before it, i.e. the requests are sent in order. Annotations next
+    to a request file, the same way as .ignore files, allow concurrency:
+        request_03.depends  request files (with or without .txt) to wait for, one per line, e.g. request_01.txt.
+                            Empty - no dependencies, sent at once.
+        request_02.group    a group name. Consecutive requests of the same group are sent concurrently, after
+                            the requests before the group, and the requests after the group wait for all of them.
+    """
+    dependencies = {}
+    # requests the next request waits for by default, and the current group with what it waits for
+    previous = set()
+    group, group_dependencies = None, set()
+    for request_file in request_files:
+        base = path.join(testcase_full_dir, request_file[: -len(".txt")])
+        group_file = base + ".group"
+        this_group = None
+        if path.isfile(group_file):
+            with open(group_file) as f:
+                this_group = f.read().strip() or None
+        if path.isfile(base + ".depends"):
+            with open(base + ".depends") as f:
+                names = [line.strip() for line in f if line.strip()]
+            dependencies[request_file] = {
+                name if name.endswith(".txt") else name + ".txt" for name in names
+            }
+            for name in dependencies[request_file]:
+                assert name in request_files, "%s depends on unknown request %s" % (
+                    request_file,
+                    name,
+                )
+            previous = {request_file}
+            group = None
+        elif this_group is not None and this_group == group:
+            # another member of the current group
+            dependencies[request_file] = set(group_dependencies)
+            previous.add(request_file)
+        else:
+            dependencies[request_file] = set(previous)
+            group, group_dependencies = this_group, set(previous)
+            previous = {request_file}
+    return dependencies
+
+
+def run_test_request(testcase_folder, request_file):
+    """send a request file of a test case and compare its response with expects, see run_test_case"""
+    input_root = path.join(root_path, "inputs")
+    output_root = path.join(root_path, "outputs")
+    expect_root = path.join(root_path, "expects")
+    diff_root = path.join(root_path, "diff")
+    testcase_full_dir = path.join(input_root, testcase_folder)
+
+    # parse input files
+    request_file_path = path.join(testcase_full_dir, request_file)
+    log.info("Test by input file %s" % request_file_path)
+    method, url, headers, body = parse_test_input(request_file_path)
+    log.debug("Parsed request:")
+    log.debug("%s %s\n%s\n%s" % (method, url, headers, body))
+
+    resp = TestAPI().request(method, url, headers, body)
+    assert resp != None
+
+    # compare the response flattened in memory with the cached expects
+    output_filename = request_file.replace("request_", "response_")
+    expect_file_path = path.join(expect_root, testcase_folder, output_filename)
+    ignore_filename = request_file.replace(".txt", ".ignore")
+    ignore_file_path = path.join(testcase_full_dir, ignore_filename)
+
+    actual = flatten_dict(resp)
+    expected = cached_parse(expect_file_path, ini_to_dict)
+    ignore = cached_parse(ignore_file_path, parse_ignore_set)
+    diff = diff_simple_dict(expected, actual, ignore=ignore)
+
+    # write response dict to a ini format file, and the diff, in the background
+    if WRITE_OUTPUTS:
+        write_debug_files_async(
+            path.join(output_root, testcase_folder, output_filename),
+            resp,
+            path.join(diff_root, testcase_folder, output_filename),
+            diff,
+        )
+    assert diff == "", "%s: response does not match expected output" % request_file
 
-    User-Agent: Python Requests
-    Content-Type: application/json
 
-    {
-        "key1": 1,
-        "key2": "value2"
-    }
+def run_test_case(testcase_folder):
     """
-    if not path.isfile(file):
-        log.error("parse_test_input: Invalid file: %s" % file)
-        raise FileNotFoundError(file)
-
-    # initialize default
-    headers = {}
-    body = None
-
-    with open(file, "r") as f:
-        content = f.read()
-        # 3 parts split by empty line (\n\n) with possible whitespace in between \n\n.
-        # Note: With \n\n, re.split will support \r\n\r\n implicitly for windows files as well
-        parts = re.split(r"\s*\n\s*\n", content)
-        parts_len = len(parts)
-
-        # part 1: Method and url
-        assert len(parts[0].split()) == 2
-        method, url = parts[0].split()
-        method, url = method.strip(), url.strip()
-
-        # part 2: headers or body if no specific headers
-        if parts_len > 1 and parts[1].strip() != "":
-            header_lines = re.split(r"\s*\n", parts[1].strip())
-            header_lines = [line.strip() for line in header_lines]  # strip line spaces
-            # if it is headers
-            #   condition: header_key: value
-            #   and avoid false json body condition: {"key": "value"}
-            #       there could be other false positive conditions but don't want to complicate things.
-            header_line_1_elements = re.split(r":\s*", header_lines[0])
-            header_line_1_elements = [e.strip() for e in header_line_1_elements]
-            if len(header_line_1_elements) == 2 and not header_line_1_elements[0].startswith('{'):
-                headers = dict([re.split(r":\s*", line) for line in header_lines])
-            # no headers, part 2 is body
-            else:
-                body = parts[1].strip()
+    run the requests of an input/output test case and compare responses with expects, see test_by_input_output_text.
+    Independent requests are sent concurrently by CASE_WORKERS threads, see request_dependencies().
+    """
+    testcase_full_dir = path.join(root_path, "inputs", testcase_folder)
+    # get and sort all request files
+    request_files = []
+    for request_file in os.listdir(testcase_full_dir):
+        if request_file.endswith(".txt"):
+            # ignore non-request text files, i.e. .ignore files
+            request_files.append(request_file)
+    request_files.sort()
+    dependencies = request_dependencies(testcase_full_dir, request_files)
+
+    if all(
+        dependencies[request_file] == set(request_files[i - 1 : i])
+        for i, request_file in enumerate(request_files)
+    ):
+        # in order, stop at the first failure
+        for request_file in request_files:
+            run_test_request(testcase_folder, request_file)
+    else:
+        # submit requests whose dependencies passed, skip requests which depend on a failed one
+        passed, failed, running = set(), {}, {}
+        with ThreadPoolExecutor(CASE_WORKERS) as executor:
+            while True:
+                for request_file in request_files:
+                    if (
+                        request_file not in passed
+                        and request_file not in failed
+                        and request_file not in running.values()
+                        and dependencies[request_file] <= passed
+                    ):
+                        future = executor.submit(run_test_request, testcase_folder, request_file)
+                        running[future] = request_file
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    request_file = running.pop(future)
+                    if future.exception() is None:
+                        passed.add(request_file)
+                    else:
+                        failed[request_file] = future.exception()
+        for request_file in request_files:
+            if request_file in failed:
+                raise failed[request_file]
+        skipped = [request_file for request_file in request_files if request_file not in passed]
+        assert not skipped, "requests with circular dependencies not sent: %s" % skipped
+    log.info("Test test_by_input_output_text[%s] passed." % testcase_folder)
 
-        # part 3: body
-        if parts_len > 2 and parts[2].strip() != "" and body is None:
-            body = parts[2].strip()
 
-    return method, url, headers, body
+def run_test_case_in_pool(testcase_folder):
+    """
+    run_test_case in a worker of the pool, return (None or error with traceback, request phases, connection
+    counts and log records dropped of a worker process)
+    """
+    start = len(phase_samples)
+    start_counts = dict(connection_counts)
+    start_dropped = log_records_dropped()
+    try:
+        run_test_case(testcase_folder)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    # phases and connections of a worker process are summarized by the main process, see teardown_module()
+    if not multiprocessing.parent_process():
+        return error, [], {}, 0
+    flush_debug_files()
+    counts = {name: connection_counts[name] - start_counts[name] for name in connection_counts}
+    counts["peak_in_use"] = connection_counts["peak_in_use"]
+    return error, phase_samples[start:], counts, log_records_dropped() - start_dropped
+
+
+@pytest.fixture(scope="session")
+def parallel_case_results(request):
+    """
+    Run the selected input/output test cases in a pool of PARALLEL_WORKERS workers at once, and return their
+    results as {testcase_folder: None or error}, which test_by_input_output_text reports case by case.
+    None if PARALLEL_WORKERS is 0.
+    """
+    global worker_log_records_dropped
+    if PARALLEL_WORKERS <= 0:
+        return None
+    testcase_folders = [
+        item.callspec.params["testcase_folder"]
+        for item in request.session.items
+        if item.originalname == "test_by_input_output_text"
+    ]
+    if PARALLEL_POOL == "process":
+        executor = ProcessPoolExecutor(
+            PARALLEL_WORKERS,
+            initializer=worker_logs,
+            initargs=(multiprocessing.Value("i", 0),),
+        )
+    else:
+        executor = ThreadPoolExecutor(PARALLEL_WORKERS)
+    results = {}
+    with executor:
+        for testcase_folder, (error, phases, counts, dropped) in zip(
+            testcase_folders, executor.map(run_test_case_in_pool, testcase_folders)
+        ):
+            results[testcase_folder] = error
+            phase_samples.extend(phases)
+            worker_log_records_dropped += dropped
+            with connection_counts_lock:
+                for name, count in counts.items():
+                    if name == "peak_in_use":
+                        connection_counts[name] = max(connection_counts[name], count)
+                    else:
+                        connection_counts[name] += count
+    return results
 
 
 class TestAPI:
@@ -473,67 +881,25 @@ class TestAPI:
 
     # parametrize means for testcase_folder in test_case_list run this test function.
     @pytest.mark.parametrize("testcase_folder", test_case_list)
-    def test_by_input_output_text(self, testcase_folder):
+    def test_by_input_output_text(self, testcase_folder, parallel_case_results):
         """test by input and expected output text files
 
         Write only this test function and use parametrize method to test different cases by:
         - read input request text files
         - compare output with expected output text files where json content is converted to ini format for easy comparison
 
+        Request files are sent in order, unless .depends or .group files next to them declare that some requests
+        do not depend on each other, see request_dependencies().
+
         Best Practice:
         For the first run, no need to prepare the expected output files.
         Run it without expect files, examine the output manually, then copy output folder as expect folder if passed.
         """
-        input_root = path.join(root_path, "inputs")
-        output_root = path.join(root_path, "outputs")
-        expect_root = path.join(root_path, "expects")
-        diff_root = path.join(root_path, "diff")
-        testcase_full_dir = path.join(input_root, testcase_folder)
-        # get and sort all request files
-        request_files = []
-        for request_file in os.listdir(testcase_full_dir):
-            if request_file.endswith(".txt"):
-                # ignore non-request text files, i.e. .ignore files
-                request_files.append(request_file)
-        request_files.sort()
-
-        for request_file in request_files:
-            # parse input files
-            request_file_path = path.join(testcase_full_dir, request_file)
-            log.info("Test by input file %s" % request_file_path)
-            method, url, headers, body = parse_test_input(request_file_path)
-            log.debug("Parsed request:")
-            log.debug("%s %s\n%s\n%s" % (method, url, headers, body))
-
-            resp = self.request(method, url, headers, body)
-            assert resp != None
-
-            # write response dict to a ini format file
-            output_file_dir = path.join(output_root, testcase_folder)
-            os.makedirs(output_file_dir, exist_ok=True)
-            output_filename = request_file.replace("request_", "response_")
-            output_file_path = path.join(output_file_dir, output_filename)
-            dict_to_ini(resp, output_file_path)
-
-            # compare
-            expect_file_dir = path.join(expect_root, testcase_folder)
-            expect_file_path = path.join(expect_file_dir, output_filename)
-            ignore_filename = request_file.replace(".txt", ".ignore")
-            ignore_file_path = path.join(testcase_full_dir, ignore_filename)
-            diff_file_dir = path.join(diff_root, testcase_folder)
-            os.makedirs(diff_file_dir, exist_ok=True)
-            diff_file_path = path.join(diff_file_dir, output_filename)
-
-            actual = ini_to_dict(output_file_path)
-            expected = ini_to_dict(expect_file_path)
-            ignore = parse_ignore_file(ignore_file_path)
-            diff = diff_simple_dict(
-                expected, actual, ignore=ignore, output_file=diff_file_path
-            )
-            assert diff == "", "response does not match expected output"
-            log.info(
-                "Test %s[%s] passed." % (inspect.stack()[0].function, testcase_folder)
-            )
+        if parallel_case_results is None:
+            run_test_case(testcase_folder)
+        else:
+            error = parallel_case_results[testcase_folder]
+            assert error is None, error
 
     def post(
         self, url, headers={}, data=None, verify=False, amend_headers=True, **kwargs
@@ -594,12 +960,23 @@ class TestAPI:
 
         # send request
         try:
-            resp = requests.request(
-                method, url, headers=headers_new, data=data, verify=verify, auth=auth, **kwargs
-            )
+            if PHASE_TIMING:
+                resp, phases = timed_request(
+                    method, url, headers=headers_new, data=data, verify=verify, auth=auth, **kwargs
+                )
+            else:
+                resp = shared_session().request(
+                    method, url, headers=headers_new, data=data, verify=verify, auth=auth, **kwargs
+                )
         except Exception as ex:
-            log.error("requests.request() failed with exception: %s" % str(ex))
+            log.error("session.request() failed with exception: %s" % str(ex))
             return None
+        if PHASE_TIMING:
+            phase_samples.append(phases)
+            log_api.info(
+                "request phases in seconds: %s\n"
+                % ", ".join("%s %.6f" % (name, phases.get(name, 0)) for name in PHASES)
+            )
 
         # pretty request and response into API log file
         # Note: request print is common as it could be a JSON body or a normal text
@@ -0,0 +1,183 @@
+"""
+Tests of the utilities of the input/output test cases, which need no API to test:
+request dependencies and the flattened ini format of responses.
+
+Run:
+pytest test_utils.py
+"""
+import os
+import random
+import time
+from threading import Lock
+import pytest
+import test_rest_api
+from test_rest_api import (
+    request_dependencies,
+    run_test_case,
+    dict_to_ini,
+    write_ini,
+    ini_to_dict,
+    flatten_dict,
+)
+
+
+def write_request_files(testcase_dir, request_files, annotations={}):
+    """create request files of a test case, and annotation files, e.g. {"request_02.group": "a"}"""
+    os.makedirs(testcase_dir, exist_ok=True)
+    for request_file in request_files:
+        with open(os.path.join(testcase_dir, request_file), "w") as f:
+            f.write("GET http://localhost:5000/hello\n")
+    for file, content in annotations.items():
+        with open(os.path.join(testcase_dir, file), "w") as f:
+            f.write(content)
+
+
+def random_json(depth=0):
+    """random JSON like value, with keys and values which are hard to flatten, e.g. spaces, ' = ' and new lines"""
+    choice = random.random()
+    if depth > 4 or choice < 0.4:
+        return random.choice(
+            [0, 1, 2.5, -3, "x", " y ", "a\nb", "a\rb", "c\r\nd", "= z", "", None, True, False, "é"]
+        )
+    if choice < 0.7:
+        return [random_json(depth + 1) for _ in range(random.randint(0, 4))]
+    keys = ["a", "b", " a", "a ", "a = b", "x\ny", "c.d", "", "r\r", "é"]
+    return {random.choice(keys): random_json(depth + 1) for _ in range(random.randint(0, 4))}
+
+
+class TestRequestDependencies:
+    """
+    Test request_dependencies() and how run_test_case() schedules the requests of a test case.
+    """
+
+    request_files = ["request_01.txt", "request_02.txt", "request_03.txt", "request_04.txt"]
+
+    def test_in_order_by_default(self, tmp_path):
+        write_request_files(tmp_path, self.request_files)
+        assert request_dependencies(str(tmp_path), self.request_files) == {
+            "request_01.txt": set(),
+            "request_02.txt": {"request_01.txt"},
+            "request_03.txt": {"request_02.txt"},
+            "request_04.txt": {"request_03.txt"},
+        }
+
+    def test_group(self, tmp_path):
+        write_request_files(
+            tmp_path,
+            self.request_files,
+            {"request_02.group": "reads\n", "request_03.group": "reads"},
+        )
+        assert request_dependencies(str(tmp_path), self.request_files) == {
+            "request_01.txt": set(),
+            "request_02.txt": {"request_01.txt"},
+            "request_03.txt": {"request_01.txt"},
+            "request_04.txt": {"request_02.txt", "request_03.txt"},
+        }
+
+    def test_depends(self, tmp_path):
+        write_request_files(
+            tmp_path,
+            self.request_files,
+            {"request_02.depends": "", "request_04.depends": "request_01\nrequest_02.txt\n"},
+        )
+        assert request_dependencies(str(tmp_path), self.request_files) == {
+            "request_01.txt": set(),
+            "request_02.txt": set(),
+            "request_03.txt": {"request_02.txt"},
+            "request_04.txt": {"request_01.txt", "request_02.txt"},
+        }
+
+    def test_depends_on_unknown_request(self, tmp_path):
+        write_request_files(tmp_path, self.request_files, {"request_02.depends": "request_09"})
+        with pytest.raises(AssertionError):
+            request_dependencies(str(tmp_path), self.request_files)
+
+    def run_case(self, tmp_path, monkeypatch, annotations, fail=(), delay=0.1):
+        """
+        run_test_case of a test case under tmp_path with a fake run_test_request, return the requests sent, also
+        kept in self.sent if run_test_case raises, and the peak of requests sent at once
+        """
+        write_request_files(tmp_path / "inputs" / "test_case_01", self.request_files, annotations)
+        monkeypatch.setattr(test_rest_api, "root_path", str(tmp_path))
+        sent, running, lock = [], [], Lock()
+        self.sent = sent
+        peak = [0]
+
+        def fake_run_test_request(testcase_folder, request_file):
+            with lock:
+                running.append(request_file)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(delay)
+            with lock:
+                running.remove(request_file)
+                sent.append(request_file)
+            assert request_file not in fail, "%s failed" % request_file
+
+        monkeypatch.setattr(test_rest_api, "run_test_request", fake_run_test_request)
+        run_test_case("test_case_01")
+        return sent, peak[0]
+
+    def test_run_group_concurrently(self, tmp_path, monkeypatch):
+        sent, peak = self.run_case(
+            tmp_path,
+            monkeypatch,
+            {"request_02.group": "a", "request_03.group": "a"},
+        )
+        assert sent[0] == "request_01.txt" and sent[-1] == "request_04.txt"
+        assert sorted(sent) == self.request_files
+        assert peak == 2
+
+    def test_skip_dependents_of_failure(self, tmp_path, monkeypatch):
+        with pytest.raises(AssertionError, match="request_02.txt failed"):
+            self.run_case(
+                tmp_path,
+                monkeypatch,
+                {"request_01.depends": "", "request_02.depends": "", "request_03.depends": "request_02"},
+                fail=("request_02.txt",),
+            )
+        assert sorted(self.sent) == ["request_01.txt", "request_02.txt"]
+
+    def test_circular_dependencies(self, tmp_path, monkeypatch):
+        with pytest.raises(AssertionError, match="circular dependencies"):
+            self.run_case(
+                tmp_path,
+                monkeypatch,
+                {"request_02.depends": "request_03", "request_03.depends": "request_02"},
+            )
+
+
+class TestIniFormat:
+    """
+    Test that write_ini and flatten_dict give the same results as dict_to_ini and ini_to_dict of its file.
+    """
+
+    def test_write_ini_same_as_dict_to_ini(self, tmp_path):
+        random.seed(0)
+        expected_file, actual_file = str(tmp_path / "expected.txt"), str(tmp_path / "actual.txt")
+        for _ in range(500):
+            var = {"root": random_json()}
+            dict_to_ini(var, expected_file)
+            # tiny runs to sort and merge in temporary files, even for small dicts
+            write_ini(var, actual_file, run_lines=random.randint(1, 4), max_runs=random.randint(2, 3))
+            with open(expected_file, "rb") as expected, open(actual_file, "rb") as actual:
+                assert actual.read() == expected.read(), var
+
+    def test_flatten_dict_same_as_ini_file(self, tmp_path):
+        random.seed(1)
+        file = str(tmp_path / "response.txt")
+        for _ in range(500):
+            var = {"root": random_json()}
+            dict_to_ini(var, file)
+            assert flatten_dict(var) == ini_to_dict(file), var
+
+    def test_deeply_nested(self, tmp_path):
+        var = leaf = {}
+        for _ in range(5000):
+            leaf["k"] = [{}]
+            leaf = leaf["k"][0]
+        leaf["v"] = 1
+        file = str(tmp_path / "response.txt")
+        write_ini(var, file)
+        with open(file) as f:
+            assert f.read() == "k[0]." * 4999 + "k[0].v = 1"
+        assert dict_to_ini(var) == "k[0]." * 4999 + "k[0].v = 1"